@@ -0,0 +1,236 @@
+"""
+Benchmarks of the review pipeline hot paths.
+
+Every stage is timed over several runs and its peak memory is measured in a
+separate run with tracemalloc. Results can be saved as a baseline and later
+runs compared against it, exiting with an error on regressions:
+
+    python .experiments/benchmarks/benchmark.py --save baseline.json
+    python .experiments/benchmarks/benchmark.py --baseline baseline.json
+
+The end-to-end reviews use the mock provider, so no model is called. Timings
+depend on the machine, compare against a baseline recorded on the same one.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from kaizen.formatters.code_review_formatter import create_pr_review_text
+from kaizen.helpers import chunking
+from kaizen.helpers.diff import Diff
+from kaizen.helpers.parser import (
+    extract_json,
+    patch_to_combined_chunks,
+    should_ignore_file,
+)
+from synthetic import (
+    dataset_pull_request,
+    llm_output,
+    load_dataset,
+    make_pull_request,
+)
+
+# Synthetic pull requests, files x changed lines per file
+SCALES = {
+    "1x100": (1, 100),
+    "100x200": (100, 200),
+    "5000x20": (5000, 20),
+    "1x100000": (1, 100000),
+}
+MIN_TIME = 0.5
+MAX_RUNS = 20
+CHUNK_BUDGET = 100000
+# Stages below these are too noisy to gate on
+MIN_GATED_TIME = 0.001
+MIN_GATED_MEMORY = 64 * 2**10
+
+
+def measure(func, min_time=MIN_TIME, max_runs=MAX_RUNS):
+    """Run `func` until `min_time` has passed, then once more for its peak memory."""
+    timings = []
+    while len(timings) < max_runs and sum(timings) < min_time:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "runs": len(timings),
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "peak_memory": peak,
+    }
+
+
+@contextlib.contextmanager
+def mock_config(issues, latency):
+    """Run in a directory whose `config.json` selects the mock provider."""
+    config = {
+        "language_model": {
+            "provider": "mock",
+            "mock": {
+                "default_response": {"review": issues, "code_quality_percentage": 80},
+                "latency": {"distribution": "constant", "median": latency},
+                "seed": 0,
+            },
+            "models": [
+                {"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}}
+            ],
+        },
+        "github_app": {"check_signature": False},
+    }
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "config.json"), "w") as f:
+            json.dump(config, f)
+        os.chdir(directory)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+def make_reviewer(issues, latency):
+    try:
+        from kaizen.llms.provider import LLMProvider
+        from kaizen.reviewer.code_review import CodeReviewer
+    except ImportError as e:
+        print(f"Skipping end-to-end reviews: {e}", file=sys.stderr)
+        return None
+    with mock_config(issues, latency):
+        return CodeReviewer(llm_provider=LLMProvider())
+
+
+def review(reviewer, diff_text):
+    return reviewer.review_pull_request(
+        diff_text=diff_text,
+        pull_request_title="Benchmark",
+        pull_request_desc="",
+        pull_request_files=[],
+    )
+
+
+def scale_stages(name, reviewer):
+    files, lines = SCALES[name]
+    diff_text, pr_files = make_pull_request(files, lines)
+    names = [file["filename"] for file in pr_files]
+    parts = [f"File Name: {file['filename']}\n{file['patch']}" for file in pr_files]
+    token_counts = [len(part) // 4 for part in parts]
+
+    stages = {
+        "parse_diff": lambda: Diff.from_patch(diff_text),
+        "should_ignore_file": lambda: [should_ignore_file(n) for n in names],
+        "patch_to_combined_chunks": lambda: [
+            patch_to_combined_chunks(file["patch"]) for file in pr_files
+        ],
+        "pack_chunks": lambda: chunking.pack_chunks(
+            parts, CHUNK_BUDGET, len, token_counts=token_counts
+        ),
+    }
+    if reviewer is not None:
+        stages["review_pull_request"] = lambda: review(reviewer, diff_text)
+    return stages
+
+
+def dataset_stages(dataset, reviewer):
+    issues = [issue for pr_issues in dataset.values() for issue in pr_issues]
+    output = llm_output(issues)
+    large_output = llm_output(issues, copies=100)
+    diffs = [dataset_pull_request(pr_issues) for pr_issues in dataset.values()]
+
+    stages = {
+        "extract_json": lambda: extract_json(output),
+        "extract_json_large": lambda: extract_json(large_output),
+        "create_pr_review_text": lambda: create_pr_review_text(
+            issues * 20, code_quality=80
+        ),
+    }
+    if reviewer is not None:
+        stages["review_pull_request"] = lambda: [review(reviewer, d) for d in diffs]
+    return stages
+
+
+def compare(results, baseline, max_time_regression, max_memory_regression):
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        time_ratio = result["median"] / previous["median"]
+        memory_ratio = result["peak_memory"] / max(1, previous["peak_memory"])
+        if time_ratio > 1 + max_time_regression and result["median"] > MIN_GATED_TIME:
+            regressions.append(f"{key}: {time_ratio:.2f}x slower")
+        if (
+            memory_ratio > 1 + max_memory_regression
+            and result["peak_memory"] > MIN_GATED_MEMORY
+        ):
+            regressions.append(f"{key}: {memory_ratio:.2f}x more memory")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scales", nargs="*", default=list(SCALES), choices=list(SCALES)
+    )
+    parser.add_argument("--no-review", action="store_true", help="Skip end-to-end")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Mock response time in seconds"
+    )
+    parser.add_argument("--save", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare with results saved before")
+    parser.add_argument("--max-time-regression", type=float, default=0.25)
+    parser.add_argument("--max-memory-regression", type=float, default=0.25)
+    args = parser.parse_args()
+
+    dataset = load_dataset()
+    issues = [issue for pr_issues in dataset.values() for issue in pr_issues]
+    reviewer = None if args.no_review else make_reviewer(issues, args.latency)
+
+    suites = {f"dataset[{len(dataset)} prs]": dataset_stages(dataset, reviewer)}
+    for name in args.scales:
+        suites[f"synthetic[{name}]"] = scale_stages(name, reviewer)
+
+    results = {}
+    print(f"{'stage':<50} {'median':>12} {'min':>12} {'peak memory':>14}")
+    for suite, stages in suites.items():
+        for stage, func in stages.items():
+            key = f"{suite} {stage}"
+            result = results[key] = measure(func)
+            print(
+                f"{key:<50} {result['median'] * 1e3:>10.2f}ms "
+                f"{result['min'] * 1e3:>10.2f}ms "
+                f"{result['peak_memory'] / 2**20:>11.2f}MiB"
+            )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results, baseline, args.max_time_regression, args.max_memory_regression
+        )
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import json
+import os
+from collections import defaultdict
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(SCRIPT_DIR, "..", "code_review", "dataset")
+
+# Files the reviewer skips, mixed into the synthetic pull requests
+IGNORED_FILES = ["package-lock.json", "assets/logo.png", "node_modules/lib/index.js"]
+
+
+def make_file_name(index):
+    if index % 10 == 9:
+        return IGNORED_FILES[index // 10 % len(IGNORED_FILES)]
+    return f"src/package_{index % 50}/module_{index}.py"
+
+
+def make_file_patch(index, lines, hunk_size=40):
+    """Patch of one file with `lines` changed lines, split in hunks."""
+    patch = []
+    for start in range(0, lines, hunk_size):
+        body = []
+        old_count = new_count = 0
+        for line in range(start, min(lines, start + hunk_size)):
+            kind = line % 4
+            if kind == 0:
+                body.append(f"     return helper_{index}_{line}(value)")
+                old_count += 1
+                new_count += 1
+            elif kind == 1:
+                body.append(f"-    value = compute_{line}(value, {line})")
+                old_count += 1
+            else:
+                body.append(f"+    value = compute_{line}(value, {line}, cache=True)")
+                new_count += 1
+        patch.append(
+            f"@@ -{start + 1},{old_count} +{start + 1},{new_count} @@ def func_{start}():"
+        )
+        patch.extend(body)
+    return "\n".join(patch)
+
+
+def make_pull_request(files, lines_per_file):
+    """Return the unified diff and the GitHub files API payload of a synthetic PR."""
+    diff = []
+    pr_files = []
+    for index in range(files):
+        name = make_file_name(index)
+        patch = make_file_patch(index, lines_per_file)
+        diff.append(
+            f"diff --git a/{name} b/{name}\n--- a/{name}\n+++ b/{name}\n{patch}"
+        )
+        pr_files.append({"filename": name, "status": "modified", "patch": patch})
+    return "\n".join(diff) + "\n", pr_files
+
+
+def load_dataset():
+    """Expected issues of the recorded PRs, keyed by PR name."""
+    prs = {}
+    for name in sorted(os.listdir(DATASET_DIR)):
+        path = os.path.join(DATASET_DIR, name, "issues.json")
+        if os.path.isfile(path):
+            with open(path) as f:
+                prs[name] = json.load(f)
+    return prs
+
+
+def dataset_pull_request(issues):
+    """
+    Rebuild a diff from the issues of a recorded PR, adding the flagged code
+    at the lines the issues point to.
+    """
+    by_file = defaultdict(list)
+    for issue in issues:
+        by_file[issue.get("file_path") or "unknown.py"].append(issue)
+
+    diff = []
+    for name, file_issues in by_file.items():
+        diff.append(f"diff --git a/{name} b/{name}\n--- a/{name}\n+++ b/{name}")
+        line = 1
+        for issue in sorted(file_issues, key=lambda i: int(i.get("start_line") or 0)):
+            code = (issue.get("suggested_code") or issue["description"]).splitlines()
+            start = max(line, int(issue.get("start_line") or 0))
+            diff.append(f"@@ -{start},0 +{start},{len(code)} @@")
+            diff.extend(f"+{code_line}" for code_line in code)
+            line = start + len(code)
+    return "\n".join(diff) + "\n"
+
+
+def llm_output(issues, copies=1):
+    """A completion as models return it, JSON wrapped in prose and a fence."""
+    payload = {"review": issues * copies, "code_quality_percentage": 80}
+    return (
+        "Here is the review of the pull request:\n\n```json\n"
+        + json.dumps(payload, indent=2)
+        + "\n```\n\nLet me know if you need anything else."
+    )
@@ -0,0 +1,52 @@
+import time
+
+import litellm
+from kaizen.llms.tokens import TokenCounter, estimate_tokens
+
+MODEL = "gpt-4o-mini"
+ITERATIONS = 200
+
+
+def make_file_diff(index, lines=200):
+    body = "\n".join(
+        f"+    value_{index}_{line} = compute(value_{index}_{line - 1}, {line})"
+        for line in range(lines)
+    )
+    return f"\n---->\nFile Name: src/module_{index}.py\nPatch Details:\n{body}"
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / ITERATIONS * 1e6:>12.1f} us/call")
+
+
+def main():
+    texts = [make_file_diff(i) for i in range(10)]
+    counter = TokenCounter()
+
+    print(f"Token counting overhead for {len(texts)} diffs, model {MODEL}")
+    timed(
+        "before: litellm.token_counter",
+        lambda: [litellm.token_counter(model=MODEL, text=t) for t in texts],
+    )
+    timed(
+        "before: litellm.get_max_tokens",
+        lambda: litellm.get_max_tokens(MODEL),
+    )
+    timed(
+        "after: TokenCounter.count",
+        lambda: [counter.count(t, MODEL) for t in texts],
+    )
+    timed("after: TokenCounter.max_tokens", lambda: counter.max_tokens(MODEL))
+    timed("after: estimate_tokens", lambda: [estimate_tokens(t) for t in texts])
+
+    exact = sum(counter.count(t, MODEL) for t in texts)
+    estimate = sum(estimate_tokens(t) for t in texts)
+    print(f"\nExact tokens: {exact}, estimated tokens: {estimate}")
+
+
+if __name__ == "__main__":
+    main()
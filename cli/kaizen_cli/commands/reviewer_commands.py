@@ -1,5 +1,6 @@
 import click
 from kaizen.generator.pr_description import PRDescriptionGenerator
+from kaizen.reviewer.code_review import CodeReviewer
 from kaizen.llms.provider import LLMProvider
 from ..config.manager import load_config
 
@@ -19,6 +20,35 @@ def work(github_url, branch):
     # Implement the reviewer work logic here
 
 
+@reviewer.command()
+@click.argument("diff_file", type=click.File("r"), default="-")
+@click.option("--title", default="", help="Pull request title")
+@click.option("--description", default="", help="Pull request description")
+def review(diff_file, title, description):
+    """Review a unified diff, read from stdin by default"""
+    model_config = load_config()["language_model"]["models"][0]["litellm_params"]
+    code_reviewer = CodeReviewer(LLMProvider(model_config=model_config))
+
+    def show_issue(issue):
+        # Issues are printed as soon as the model has written them
+        click.echo(
+            f"[{issue.get('impact', '')}] {issue.get('file_path', '')}:"
+            f"{issue.get('start_line', '')} {issue.get('description', '')}"
+        )
+
+    review_data = code_reviewer.review_pull_request(
+        diff_text=diff_file.read(),
+        pull_request_title=title,
+        pull_request_desc=description,
+        pull_request_files=[],
+        on_issue=show_issue,
+    )
+    click.echo(
+        f"\nFound {len(review_data.issues)} issues, "
+        f"code quality: {review_data.code_quality}"
+    )
+
+
 @click.command()
 @click.argument("diff", type=str, required=True)
 def generate_commit_msg(diff):
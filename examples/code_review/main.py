@@ -1,6 +1,7 @@
 from kaizen.reviewer.code_review import CodeReviewer
 from kaizen.generator.pr_description import PRDescriptionGenerator
 from kaizen.llms.provider import LLMProvider
+from kaizen.helpers.diff import Diff
 from github_app.github_helper.utils import get_diff_text, get_pr_files
 import logging
 from kaizen.formatters.code_review_formatter import (
@@ -16,6 +17,8 @@ pr_title = "feat: updated the prompt to provide solution"
 
 diff_text = get_diff_text(pr_diff, "")
 pr_files = get_pr_files(pr_files, "")
+# Parse the pull request once and share it between the reviewers
+diff = Diff.from_pr_files(pr_files)
 # print("diff: ", diff_text)
 # print("pr_files", pr_files)
 
@@ -30,9 +33,12 @@ review_data = reviewer.review_pull_request(
     pull_request_files=pr_files,
     reeval_response=False,
     custom_rules=custom_rule,
+    diff=diff,
 )
 
-comments, issues, is_critical = filter_and_categorize_issues(data=review_data.issues)
+comments, issues, is_critical = filter_and_categorize_issues(
+    data=review_data.issues, pr_files=diff
+)
 review_desc = create_pr_review_text(
     review_data.issues, code_quality=review_data.code_quality
 )
@@ -48,6 +54,7 @@ desc_data = pr_desc.generate_pull_request_desc(
     pull_request_desc="",
     pull_request_files=pr_files,
     user="kaizen/example",
+    diff=diff,
 )
 print(desc_data)
 
@@ -1,13 +1,24 @@
+import asyncio
 import requests
 import logging
 import os
-from github_app.github_helper.utils import get_diff_text, get_pr_files
+from github_app.github_helper.utils import get_compare, get_diff_text, get_pr_files
 from github_app.github_helper.installation import get_installation_access_token
 from github_app.github_helper.permissions import PULL_REQUEST_PERMISSION
 from kaizen.reviewer.code_review import CodeReviewer
+from kaizen.reviewer.review_state import (
+    DEFAULT_REVIEW_STATE_PATH,
+    ReviewStateStore,
+    carry_forward_issues,
+)
 from kaizen.generator.pr_description import PRDescriptionGenerator
 from kaizen.formatters.code_review_formatter import create_pr_review_text
+from kaizen.helpers import tracing
+from kaizen.helpers.diff import Diff
+from kaizen.llms import registry
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.singleflight import AsyncSingleFlight, SingleFlight
+from kaizen.utils.config import ConfigData
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +26,15 @@ GITHUB_API_BASE_URL = os.environ["GITHUB_API_BASE_URL"]
 
 ACTIONS_TO_PROCESS_PR = ["opened", "reopened", "review_requested", "ready_for_review"]
 ACTIONS_TO_UPDATE_DESC = ["opened", "reopened"]
+# Pushes to a reviewed PR, only the new commits are reviewed
+ACTIONS_TO_REVIEW_INCREMENTALLY = ["synchronize"]
+# The compare API lists at most 300 files, review bigger pushes in full
+MAX_COMPARE_FILES = 300
+
+# GitHub sends e.g. `opened` and `review_requested` together, a PR commit is
+# only processed once while a run for it is in flight
+_pr_flights = SingleFlight()
+_apr_flights = AsyncSingleFlight()
 
 
 confidence_mapping = {
@@ -26,24 +46,153 @@ confidence_mapping = {
 }
 
 
-def process_pull_request(payload):
-    comment_url = payload["pull_request"]["comments_url"]
+def _fetch_pull_request_data(payload):
     repo_name = payload["repository"]["full_name"]
     pull_number = payload["pull_request"]["number"]
     diff_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}.diff"
-    review_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}/reviews"
     pr_files_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}/files"
     installation_id = payload["installation"]["id"]
-    pr_title = payload["pull_request"]["title"]
-    pr_description = payload["pull_request"]["body"]
 
     access_token = get_installation_access_token(
         installation_id, PULL_REQUEST_PERMISSION
     )
-    diff_text = get_diff_text(diff_url, access_token)
+    with tracing.span("fetch_diff", repo=repo_name, pull_request=pull_number):
+        diff_text = get_diff_text(diff_url, access_token)
+
+        # Get PR Files
+        pr_files = get_pr_files(pr_files_url, access_token)
+    return diff_text, pr_files
+
+
+def _get_review_state():
+    config = ConfigData().get_github_app_config()
+    path = config.get("review_state_path", DEFAULT_REVIEW_STATE_PATH)
+    return registry.get_shared(
+        "review_state", ReviewStateStore, path=os.path.expanduser(path)
+    )
+
+
+def _fetch_compare_files(payload, base_sha):
+    repo_name = payload["repository"]["full_name"]
+    head_sha = payload["pull_request"]["head"]["sha"]
+    compare_url = (
+        GITHUB_API_BASE_URL + f"/repos/{repo_name}/compare/{base_sha}...{head_sha}"
+    )
+    access_token = get_installation_access_token(
+        payload["installation"]["id"], PULL_REQUEST_PERMISSION
+    )
+    with tracing.span("fetch_diff", repo=repo_name, base=base_sha, head=head_sha):
+        comparison = get_compare(compare_url, access_token)
+    # A force push rewrites the reviewed commits, they cannot be compared
+    if not comparison or comparison.get("status") not in ("ahead", "identical"):
+        return None
+    # Merging the base branch brings its changes into the comparison, which
+    # are not part of the pull request. The compare API also lists at most
+    # 250 commits, so a merge may be missing from a longer list.
+    commits = comparison.get("commits") or []
+    if comparison.get("total_commits", len(commits)) > len(commits) or any(
+        len(commit.get("parents") or []) > 1 for commit in commits
+    ):
+        return None
+    files = comparison.get("files") or []
+    if len(files) >= MAX_COMPARE_FILES:
+        return None
+    return files
+
+
+def _fetch_review_data(payload):
+    """
+    Return the diff text and files to review and the issues carried forward
+    from the previous review. For `ACTIONS_TO_REVIEW_INCREMENTALLY` these are
+    only the files changed since the last reviewed head, otherwise the whole
+    pull request with no carried issues.
+    """
+    if payload["action"] in ACTIONS_TO_REVIEW_INCREMENTALLY:
+        previous = _get_review_state().get(
+            payload["repository"]["full_name"], payload["pull_request"]["number"]
+        )
+        if previous is not None:
+            compare_files = _fetch_compare_files(payload, previous["head_sha"])
+            if compare_files is not None:
+                carried = carry_forward_issues(
+                    previous["issues"], Diff.from_pr_files(compare_files)
+                )
+                return "", compare_files, carried
+    diff_text, pr_files = _fetch_pull_request_data(payload)
+    return diff_text, pr_files, None
+
+
+def _save_review_state(payload, issues):
+    _get_review_state().set(
+        payload["repository"]["full_name"],
+        payload["pull_request"]["number"],
+        payload["pull_request"]["head"]["sha"],
+        issues,
+    )
+
+
+def _review_issues(review_data, carried_issues=None):
+    issues = [issue for reviews in review_data.topics.values() for issue in reviews]
+    return issues + (carried_issues or [])
+
+
+def _merge_topics(topics, issues):
+    merged = {topic: list(reviews) for topic, reviews in topics.items()}
+    for issue in issues:
+        merged.setdefault(issue.get("category", "General"), []).append(issue)
+    return merged
+
+
+def _pr_key(task, payload):
+    pull_request = payload["pull_request"]
+    return (
+        task,
+        payload["repository"]["full_name"],
+        pull_request["number"],
+        pull_request["head"]["sha"],
+    )
+
+
+def _post_review(payload, review_data, carried_issues=None):
+    comment_url = payload["pull_request"]["comments_url"]
+    repo_name = payload["repository"]["full_name"]
+    pull_number = payload["pull_request"]["number"]
+    review_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}/reviews"
+    installation_id = payload["installation"]["id"]
+
+    with tracing.span("format"):
+        topics = clean_keys(review_data.topics, "important")
+        # Carried forward issues are summarized again, but their comments
+        # were already posted by the review that found them
+        comments, _ = create_review_comments(topics)
+        if carried_issues:
+            topics = clean_keys(_merge_topics(topics, carried_issues), "important")
+        review_desc = create_pr_review_text(topics)
+
+    with tracing.span("post", comments=len(comments)):
+        post_pull_request(comment_url, review_desc, installation_id)
+        for review in comments:
+            post_pull_request_comments(review_url, review, installation_id)
+
+
+def process_pull_request(payload):
+    _, shared = _pr_flights.do(
+        _pr_key("review", payload), lambda: _process_pull_request(payload)
+    )
+    if shared:
+        logger.info("Skipped duplicate review request, it is already in progress")
+
 
-    # Get PR Files
-    pr_files = get_pr_files(pr_files_url, access_token)
+def _process_pull_request(payload):
+    repo_name = payload["repository"]["full_name"]
+    pr_number = payload["pull_request"]["number"]
+    pr_title = payload["pull_request"]["title"]
+    pr_description = payload["pull_request"]["body"]
+    diff_text, pr_files, carried = _fetch_review_data(payload)
+    if carried is not None and not pr_files:
+        logger.info(f"No changes to review in {repo_name}#{pr_number}")
+        _save_review_state(payload, carried)
+        return
 
     reviewer = CodeReviewer(llm_provider=LLMProvider(default_temperature=0.1))
     review_data = reviewer.review_pull_request(
@@ -53,13 +202,44 @@ def process_pull_request(payload):
         pull_request_files=pr_files,
         user=repo_name,
     )
-    topics = clean_keys(review_data.topics, "important")
-    review_desc = create_pr_review_text(topics)
-    comments, topics = create_review_comments(topics)
+    logger.info(f"Reviewed {repo_name}#{pr_number} in {review_data.timings}")
+    _post_review(payload, review_data, carried)
+    _save_review_state(payload, _review_issues(review_data, carried))
+
+
+async def aprocess_pull_request(payload):
+    _, shared = await _apr_flights.do(
+        _pr_key("review", payload), lambda: _aprocess_pull_request(payload)
+    )
+    if shared:
+        logger.info("Skipped duplicate review request, it is already in progress")
+
 
-    post_pull_request(comment_url, review_desc, installation_id)
-    for review in comments:
-        post_pull_request_comments(review_url, review, installation_id)
+async def _aprocess_pull_request(payload):
+    repo_name = payload["repository"]["full_name"]
+    pr_number = payload["pull_request"]["number"]
+    pr_title = payload["pull_request"]["title"]
+    pr_description = payload["pull_request"]["body"]
+    # GitHub calls use blocking requests, keep them off the event loop
+    diff_text, pr_files, carried = await asyncio.to_thread(_fetch_review_data, payload)
+    if carried is not None and not pr_files:
+        logger.info(f"No changes to review in {repo_name}#{pr_number}")
+        await asyncio.to_thread(_save_review_state, payload, carried)
+        return
+
+    reviewer = CodeReviewer(llm_provider=LLMProvider(default_temperature=0.1))
+    review_data = await reviewer.areview_pull_request(
+        diff_text=diff_text,
+        pull_request_title=pr_title,
+        pull_request_desc=pr_description,
+        pull_request_files=pr_files,
+        user=repo_name,
+    )
+    logger.info(f"Reviewed {repo_name}#{pr_number} in {review_data.timings}")
+    await asyncio.to_thread(_post_review, payload, review_data, carried)
+    await asyncio.to_thread(
+        _save_review_state, payload, _review_issues(review_data, carried)
+    )
 
 
 def create_review_comments(topics, confidence_level=4):
@@ -76,32 +256,61 @@ def create_review_comments(topics, confidence_level=4):
 
 
 def process_pr_desc(payload):
+    _, shared = _pr_flights.do(
+        _pr_key("description", payload), lambda: _process_pr_desc(payload)
+    )
+    if shared:
+        logger.info("Skipped duplicate description request, it is already in progress")
+
+
+def _process_pr_desc(payload):
     pr_url = payload["pull_request"]["url"]
     repo_name = payload["repository"]["full_name"]
-    pull_number = payload["pull_request"]["number"]
-    diff_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}.diff"
-    pr_files_url = GITHUB_API_BASE_URL + f"/repos/{repo_name}/pulls/{pull_number}/files"
+    pr_number = payload["pull_request"]["number"]
     installation_id = payload["installation"]["id"]
     pr_title = payload["pull_request"]["title"]
     pr_description = payload["pull_request"]["body"]
+    diff_text, pr_files = _fetch_pull_request_data(payload)
 
-    access_token = get_installation_access_token(
-        installation_id, PULL_REQUEST_PERMISSION
+    desc_generator = PRDescriptionGenerator(llm_provider=LLMProvider())
+    description = desc_generator.generate_pull_request_desc(
+        diff_text=diff_text,
+        pull_request_title=pr_title,
+        pull_request_desc=pr_description,
+        pull_request_files=pr_files,
+        user=repo_name,
+    )
+    logger.info(f"Described {repo_name}#{pr_number} in {description.timings}")
+    patch_pr_body(pr_url, description.desc, installation_id)
+
+
+async def aprocess_pr_desc(payload):
+    _, shared = await _apr_flights.do(
+        _pr_key("description", payload), lambda: _aprocess_pr_desc(payload)
     )
+    if shared:
+        logger.info("Skipped duplicate description request, it is already in progress")
 
-    # Get PR Files
-    pr_files = get_pr_files(pr_files_url, installation_id)
 
-    diff_text = get_diff_text(diff_url, access_token)
+async def _aprocess_pr_desc(payload):
+    pr_url = payload["pull_request"]["url"]
+    repo_name = payload["repository"]["full_name"]
+    pr_number = payload["pull_request"]["number"]
+    installation_id = payload["installation"]["id"]
+    pr_title = payload["pull_request"]["title"]
+    pr_description = payload["pull_request"]["body"]
+    diff_text, pr_files = await asyncio.to_thread(_fetch_pull_request_data, payload)
+
     desc_generator = PRDescriptionGenerator(llm_provider=LLMProvider())
-    description = desc_generator.generate_pull_request_desc(
+    description = await desc_generator.agenerate_pull_request_desc(
         diff_text=diff_text,
         pull_request_title=pr_title,
         pull_request_desc=pr_description,
         pull_request_files=pr_files,
         user=repo_name,
     )
-    patch_pr_body(pr_url, description.desc, installation_id)
+    logger.info(f"Described {repo_name}#{pr_number} in {description.timings}")
+    await asyncio.to_thread(patch_pr_body, pr_url, description.desc, installation_id)
 
 
 def post_pull_request(url, data, installation_id):
@@ -75,6 +75,22 @@ def get_pr_files(url, access_token):
     return response.json()
 
 
+def get_compare(url, access_token):
+    headers = {
+        "Accept": "application/vnd.github.v3+json",
+    }
+    if access_token:
+        headers["Authorization"] = f"Bearer {access_token}"
+
+    response = requests.get(url, headers=headers)
+    if not is_successful_status(response.status_code):
+        logger.error(
+            f"Unable to compare commits with error: {response.status_code} url: {url}"
+        )
+        return None
+    return response.json()
+
+
 def is_github_signature_valid(headers, body):
     """
     Validate the signature of the incoming request against the secret.
@@ -1,10 +1,11 @@
 from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
 from fastapi.responses import JSONResponse
 from github_app.github_helper.pull_requests import (
-    process_pull_request,
+    aprocess_pull_request,
     ACTIONS_TO_PROCESS_PR,
+    ACTIONS_TO_REVIEW_INCREMENTALLY,
     ACTIONS_TO_UPDATE_DESC,
-    process_pr_desc,
+    aprocess_pr_desc,
 )
 from github_app.github_helper.utils import is_github_signature_valid
 from kaizen.utils.config import ConfigData
@@ -33,16 +34,19 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
         return HTTPException(status_code=404, detail="Invalid Signature")
 
     if event == "pull_request":
-        if (
-            CONFIG_DATA["github_app"]["auto_pr_review"]
-            and payload["action"] in ACTIONS_TO_PROCESS_PR
+        if CONFIG_DATA["github_app"]["auto_pr_review"] and (
+            payload["action"] in ACTIONS_TO_PROCESS_PR
+            or (
+                CONFIG_DATA["github_app"].get("process_on_push", False)
+                and payload["action"] in ACTIONS_TO_REVIEW_INCREMENTALLY
+            )
         ):
-            background_tasks.add_task(process_pull_request, payload)
+            background_tasks.add_task(aprocess_pull_request, payload)
         if (
             CONFIG_DATA["github_app"]["edit_pr_desc"]
             and payload["action"] in ACTIONS_TO_UPDATE_DESC
         ):
-            background_tasks.add_task(process_pr_desc, payload)
+            background_tasks.add_task(aprocess_pr_desc, payload)
     else:
         logger.info(f"Ignored event: {event}")
     return JSONResponse(content={"message": "Webhook received"})
@@ -1,5 +1,7 @@
 from typing import Dict, List
 
+from kaizen.helpers.diff import Diff
+
 
 def calculate_score(issue):
     score = 0
@@ -47,9 +49,19 @@ def filter_and_categorize_issues(data, ignore_list=["error_handling"], pr_files=
     is_critical = False
     issues = []
     critical_issues = []
+    # Only keep issues for files which are part of the pull request, if known
+    file_names = None
+    if pr_files:
+        if isinstance(pr_files, Diff):
+            names = pr_files.file_names
+        else:
+            names = [file.get("filename", "") for file in pr_files]
+        file_names = {name.replace(" ", "") for name in names}
     for issue in data:
         if issue.get("type") in ignore_list:
             continue
+        if file_names is not None and issue.get("file_path") not in file_names:
+            continue
         category = categorize_issue(issue)
         if category == "critical":
             is_critical = True
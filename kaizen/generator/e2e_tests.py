@@ -3,6 +3,7 @@ import os
 from typing import Optional
 from kaizen.helpers import output
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.budget import Budget, budget_scope
 from kaizen.actors.e2e_test_runner import E2ETestRunner
 from kaizen.llms.prompts.e2e_tests_prompts import (
     E2E_MODULES_PROMPT,
@@ -34,15 +35,17 @@ class E2ETestGenerator:
         self,
         web_url: str,
         folder_path: Optional[str] = "",
+        budget: Optional[Budget] = None,
     ):
         """
         This method generates e2e tests with cypress code for a given web URL.
         """
         web_content = self.extract_webpage(web_url)
-        test_modules = self.identify_modules(web_content)
-        ui_tests, usage = self.generate_module_tests(
-            web_content, test_modules["modules"], web_url
-        )
+        with budget_scope(self.provider.new_budget(budget)):
+            test_modules = self.identify_modules(web_content)
+            ui_tests, usage = self.generate_module_tests(
+                web_content, test_modules["modules"], web_url
+            )
         self.store_tests_files(ui_tests, folder_path)
         self.total_usage = self.provider.update_usage(usage, test_modules["usage"])
         return ui_tests, self.total_usage
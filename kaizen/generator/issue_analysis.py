@@ -4,6 +4,7 @@ from dataclasses import dataclass
 
 from kaizen.helpers import output, parser
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.usage import usage_scope
 from kaizen.llms.prompts.issue_analysis_prompts import (
     ISSUE_LABEL_PROMPT,
     ISSUE_DESC_PROMPT,
@@ -31,12 +32,7 @@ class IssueAnalysisGenerator:
     def __init__(self, llm_provider: LLMProvider):
         self.logger = logging.getLogger(__name__)
         self.provider = llm_provider
-        self.provider.system_prompt = ISSUE_LABEL_SYSTEM_PROMPT
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
+        self.system_prompt = ISSUE_LABEL_SYSTEM_PROMPT
 
     def generate_issue_labels(
         self,
@@ -55,26 +51,25 @@ class IssueAnalysisGenerator:
                 "Issue labels missing for this repository. Create labels to ensure issue categorization."
             )
 
-        if (
-            issue_label_list
-            and issue_desc
-            and self.provider.is_inside_token_limit(PROMPT=prompt)
-        ):
-            labels = self._process_issue_for_labels(
-                issue_title,
-                issue_desc,
-                user,
-            )
-
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
+        with usage_scope() as usage:
+            if (
+                issue_label_list
+                and issue_desc
+                and self.provider.is_inside_token_limit(
+                    PROMPT=prompt, system_prompt=self.system_prompt
+                )
+            ):
+                labels = self._process_issue_for_labels(
+                    issue_title,
+                    issue_desc,
+                    user,
+                )
 
         return IssueLabelOutput(
             labels=labels,
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            cost=usage.cost,
         )
 
     def generate_issue_desc(
@@ -89,23 +84,23 @@ class IssueAnalysisGenerator:
         if not issue_desc:
             raise Exception("Original issue description is empty!")
 
-        if issue_desc and self.provider.is_inside_token_limit(PROMPT=prompt):
-            desc = self._process_issue_for_desc(
-                issue_title,
-                issue_desc,
-                user,
-            )
+        with usage_scope() as usage:
+            if issue_desc and self.provider.is_inside_token_limit(
+                PROMPT=prompt, system_prompt=self.system_prompt
+            ):
+                desc = self._process_issue_for_desc(
+                    issue_title,
+                    issue_desc,
+                    user,
+                )
 
         body = output.create_issue_description(desc, issue_desc)
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
 
         return IssueDescOutput(
             desc=body,
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            cost=usage.cost,
         )
 
     # TODO: Convert `labels` to a format suitable for the github handler
@@ -115,22 +110,18 @@ class IssueAnalysisGenerator:
         user: Optional[str],
     ) -> List[str]:
         self.logger.debug("Processing Issue for labels")
-        resp, usage = self.provider.chat_completion(
-            prompt=prompt,
-            user=user,
+        resp, _ = self.provider.chat_completion(
+            prompt=prompt, user=user, system_prompt=self.system_prompt
         )
         labels = parser.extract_code_from_markdown(resp)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
 
         return labels
 
     def _process_issue_for_desc(self, prompt: str, user: Optional[str]) -> str:
         self.logger.debug("Processing issue for description")
-        resp, usage = self.provider.chat_completion(
-            prompt=prompt,
-            user=user,
+        resp, _ = self.provider.chat_completion(
+            prompt=prompt, user=user, system_prompt=self.system_prompt
         )
         desc = parser.extract_code_from_markdown(resp)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
 
         return desc
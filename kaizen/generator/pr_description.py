@@ -1,10 +1,12 @@
 from typing import Optional, List, Dict, Generator
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import json
 
-from kaizen.helpers import output, parser
+from kaizen.helpers import chunking, output, parser, tracing
+from kaizen.helpers.diff import Diff, FileDiff
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.usage import UsageTracker, usage_scope
 from kaizen.llms.prompts.pr_desc_prompts import (
     PR_DESCRIPTION_PROMPT,
     MERGE_PR_DESCRIPTION_PROMPT,
@@ -19,18 +21,33 @@ class DescOutput:
     usage: Dict[str, int]
     model_name: str
     cost: Dict[str, float]
+    # Seconds spent per stage, see `kaizen.helpers.tracing`
+    timings: Dict[str, float] = field(default_factory=dict)
 
 
 class PRDescriptionGenerator:
     def __init__(self, llm_provider: LLMProvider):
         self.logger = logging.getLogger(__name__)
         self.provider = llm_provider
-        self.provider.system_prompt = PR_DESCRIPTION_SYSTEM_PROMPT
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
+        self.system_prompt = PR_DESCRIPTION_SYSTEM_PROMPT
+
+    def _build_desc_output(
+        self,
+        desc: str,
+        pull_request_desc: str,
+        usage: UsageTracker,
+        timings: tracing.Timings,
+    ) -> DescOutput:
+        with tracing.span("format"):
+            body = output.create_pr_description(desc, pull_request_desc)
+
+        return DescOutput(
+            desc=body,
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            cost=usage.cost,
+            timings=timings.snapshot(),
+        )
 
     def generate_pull_request_desc(
         self,
@@ -39,34 +56,64 @@ class PRDescriptionGenerator:
         pull_request_desc: str,
         pull_request_files: List[Dict],
         user: Optional[str] = None,
+        diff: Optional[Diff] = None,
     ) -> DescOutput:
-        prompt = PR_DESCRIPTION_PROMPT.format(
-            CODE_DIFF=diff_text,
-        )
-        if not diff_text and not pull_request_files:
-            raise Exception("Both diff_text and pull_request_files are empty!")
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt = PR_DESCRIPTION_PROMPT.format(
+                CODE_DIFF=diff_text,
+            )
+            if diff is None:
+                with tracing.span("parse_diff"):
+                    diff = Diff.from_pr_files(pull_request_files or [])
+            if not diff_text and not diff:
+                raise Exception("Both diff_text and pull_request_files are empty!")
 
-        if diff_text and self.provider.is_inside_token_limit(PROMPT=prompt):
-            desc = self._process_full_diff(prompt, user)
-        else:
-            desc = self._process_files(
-                pull_request_files,
-                pull_request_title,
-                pull_request_desc,
-                user,
+            if diff_text and self.provider.is_inside_token_limit(
+                PROMPT=prompt, system_prompt=self.system_prompt
+            ):
+                desc = self._process_full_diff(prompt, user)
+            else:
+                desc = self._process_files(
+                    diff,
+                    pull_request_title,
+                    pull_request_desc,
+                    user,
+                )
+
+            return self._build_desc_output(desc, pull_request_desc, usage, timings)
+
+    async def agenerate_pull_request_desc(
+        self,
+        diff_text: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        pull_request_files: List[Dict],
+        user: Optional[str] = None,
+        diff: Optional[Diff] = None,
+    ) -> DescOutput:
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt = PR_DESCRIPTION_PROMPT.format(
+                CODE_DIFF=diff_text,
             )
+            if diff is None:
+                with tracing.span("parse_diff"):
+                    diff = Diff.from_pr_files(pull_request_files or [])
+            if not diff_text and not diff:
+                raise Exception("Both diff_text and pull_request_files are empty!")
 
-        body = output.create_pr_description(desc, pull_request_desc)
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
+            if diff_text and self.provider.is_inside_token_limit(
+                PROMPT=prompt, system_prompt=self.system_prompt
+            ):
+                desc = await self._aprocess_full_diff(prompt, user)
+            else:
+                desc = await self._aprocess_files(
+                    diff,
+                    pull_request_title,
+                    pull_request_desc,
+                    user,
+                )
 
-        return DescOutput(
-            desc=body,
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
-        )
+            return self._build_desc_output(desc, pull_request_desc, usage, timings)
 
     def _process_full_diff(
         self,
@@ -74,15 +121,29 @@ class PRDescriptionGenerator:
         user: Optional[str],
     ) -> str:
         self.logger.debug("Processing directly from diff")
-        resp, usage = self.provider.chat_completion(prompt, user=user)
+        resp, _ = self.provider.chat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
+        desc = parser.extract_code_from_markdown(resp)
+
+        return desc
+
+    async def _aprocess_full_diff(
+        self,
+        prompt: str,
+        user: Optional[str],
+    ) -> str:
+        self.logger.debug("Processing directly from diff")
+        resp, _ = await self.provider.achat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
         desc = parser.extract_code_from_markdown(resp)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
 
         return desc
 
     def _process_files(
         self,
-        pull_request_files: List[Dict],
+        diff: Diff,
         pull_request_title: str,
         pull_request_desc: str,
         user: Optional[str],
@@ -90,7 +151,7 @@ class PRDescriptionGenerator:
         self.logger.debug("Processing based on files")
         file_descs = []
         for file_review in self._process_files_generator(
-            pull_request_files,
+            diff,
             pull_request_title,
             pull_request_desc,
             user,
@@ -99,61 +160,80 @@ class PRDescriptionGenerator:
 
         if len(file_descs) > 1:
             prompt = MERGE_PR_DESCRIPTION_PROMPT.format(DESCS=json.dumps(file_descs))
-            resp, usage = self.provider.chat_completion(prompt, user=user)
-            self.total_usage = self.provider.update_usage(self.total_usage, usage)
+            resp, _ = self.provider.chat_completion(
+                prompt, user=user, system_prompt=self.system_prompt
+            )
             desc = parser.extract_code_from_markdown(resp)
         else:
             desc = parser.extract_code_from_markdown(file_descs[0])
 
         return desc
 
-    def _process_files_generator(
+    async def _aprocess_files(
         self,
-        pull_request_files: List[Dict],
+        diff: Diff,
         pull_request_title: str,
         pull_request_desc: str,
         user: Optional[str],
-    ) -> Generator[List[Dict], None, None]:
-        combined_diff_data = ""
+    ) -> List[Dict]:
+        self.logger.debug("Processing based on files")
+        file_descs = []
+        with tracing.span("chunk"):
+            chunks = self._chunk_files(diff)
+        for diff_data in chunks:
+            file_descs.append(await self._aprocess_file_chunk(diff_data, user))
+
+        if len(file_descs) > 1:
+            prompt = MERGE_PR_DESCRIPTION_PROMPT.format(DESCS=json.dumps(file_descs))
+            resp, _ = await self.provider.achat_completion(
+                prompt, user=user, system_prompt=self.system_prompt
+            )
+            desc = parser.extract_code_from_markdown(resp)
+        else:
+            desc = parser.extract_code_from_markdown(file_descs[0])
+
+        return desc
+
+    def _chunk_files(self, diff: Diff) -> List[str]:
         available_tokens = self.provider.available_tokens(
             PR_DESCRIPTION_PROMPT.format(
                 CODE_DIFF="",
             )
         )
         diff_parts = []
-        for file in pull_request_files:
-            patch_details = file.get("patch")
-            filename = file.get("filename", "")
+        for file_diff in diff:
+            filename = file_diff.file_name
 
             if (
                 filename.split(".")[-1] not in parser.EXCLUDED_FILETYPES
-                and patch_details is not None
+                and file_diff.hunks
             ):
-                diff_parts.append(
-                    f"\n---->\nFile Name: {filename}\nPatch Details: \n{patch_details}"
+                diff_parts.extend(
+                    chunking.render_file_parts(
+                        file_diff,
+                        f"\n---->\nFile Name: {filename}\nPatch Details: \n",
+                        available_tokens,
+                        self.provider.get_token_count,
+                        render=FileDiff.to_patch,
+                    )
                 )
 
-                if (
-                    available_tokens
-                    - self.provider.get_token_count("".join(diff_parts))
-                    > 0
-                ):
-                    combined_diff_data = "".join(diff_parts)
-                    continue
-
-                yield self._process_file_chunk(
-                    combined_diff_data,
-                    pull_request_title,
-                    pull_request_desc,
-                    user,
-                )
-                diff_parts = [
-                    f"\n---->\nFile Name: {filename}\nPatch Details: {patch_details}"
-                ]
+        return chunking.pack_chunks(
+            diff_parts, available_tokens, self.provider.get_token_count
+        )
 
-        if diff_parts:
+    def _process_files_generator(
+        self,
+        diff: Diff,
+        pull_request_title: str,
+        pull_request_desc: str,
+        user: Optional[str],
+    ) -> Generator[List[Dict], None, None]:
+        with tracing.span("chunk"):
+            chunks = self._chunk_files(diff)
+        for diff_data in chunks:
             yield self._process_file_chunk(
-                "".join(diff_parts),
+                diff_data,
                 pull_request_title,
                 pull_request_desc,
                 user,
@@ -169,9 +249,21 @@ class PRDescriptionGenerator:
         prompt = PR_DESCRIPTION_PROMPT.format(
             CODE_DIFF=diff_data,
         )
-        resp, usage = self.provider.chat_completion(prompt, user=user)
+        resp, _ = self.provider.chat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
+        desc = parser.extract_code_from_markdown(resp)
+
+        return desc
+
+    async def _aprocess_file_chunk(self, diff_data: str, user: Optional[str]) -> str:
+        prompt = PR_DESCRIPTION_PROMPT.format(
+            CODE_DIFF=diff_data,
+        )
+        resp, _ = await self.provider.achat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
         desc = parser.extract_code_from_markdown(resp)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
 
         return desc
 
@@ -183,5 +275,8 @@ class PRDescriptionGenerator:
         prompt = PR_COMMIT_MESSAGE_PROMPT.format(
             DESC=desc,
         )
-        resp, usage = self.provider.chat_completion_with_json(prompt, user=user)
-        return resp, usage, self.provider.model
+        with usage_scope() as tracker:
+            resp, usage = self.provider.chat_completion_with_json(
+                prompt, user=user, system_prompt=self.system_prompt
+            )
+        return resp, usage, tracker.model or self.provider.model
@@ -5,9 +5,11 @@ from datetime import datetime
 from tqdm import tqdm
 import json
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pathlib import Path
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.budget import Budget, BudgetExceededError, budget_scope
+from kaizen.llms.usage import get_current_usage, usage_scope
 from kaizen.helpers.parser import extract_code_from_markdown
 from kaizen.actors.unit_test_runner import UnitTestRunner
 from kaizen.llms.prompts.unit_tests_prompts import (
@@ -54,11 +56,6 @@ class UnitTestGenerator:
 
     def __init__(self, verbose=False):
         self.output_folder = "./.kaizen/unit_test/"
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
         self.logger = logging.getLogger(__name__)
         self.provider = LLMProvider(system_prompt=UNIT_TEST_SYSTEM_PROMPT)
         self.verbose = verbose
@@ -80,9 +77,11 @@ class UnitTestGenerator:
         verbose: bool = False,
         enable_critique: bool = False,
         max_actions: int = 100000,
+        budget: Optional[Budget] = None,
     ):
         """
         dir_path: (str) - path of the directory containing source files
+        budget: (Budget) - token and cost limits shared by all files
         """
         self.max_critique = max_critique
         self.enable_critique = enable_critique
@@ -92,31 +91,34 @@ class UnitTestGenerator:
         tests = {}
         failed = []
         actions_used = 0
-        for file_path in Path(dir_path).rglob("*.*"):
-            if actions_used >= max_actions:
-                self.logger.info(f"Max actions used: {actions_used}/{self.max_actions}")
-                break
-            files.append(file_path)
-            try:
-                test_files, _, actions = self.generate_tests(
-                    file_path=str(file_path), output_path=output_path
-                )
-                tests.update(test_files)
-                actions_used += actions
-            except Exception as e:
-                failed.append(file_path)
-                print(f"Error: Could not generate tests for {file_path}: {e}")
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
-
+        with budget_scope(self.provider.new_budget(budget)), usage_scope() as usage:
+            for file_path in Path(dir_path).rglob("*.*"):
+                if actions_used >= max_actions:
+                    self.logger.info(
+                        f"Max actions used: {actions_used}/{self.max_actions}"
+                    )
+                    break
+                files.append(file_path)
+                try:
+                    test_files, _, actions = self.generate_tests(
+                        file_path=str(file_path), output_path=output_path
+                    )
+                    tests.update(test_files)
+                    actions_used += actions
+                except BudgetExceededError as e:
+                    failed.append(file_path)
+                    self.logger.warning(f"Stopping test generation: {e}")
+                    break
+                except Exception as e:
+                    failed.append(file_path)
+                    print(f"Error: Could not generate tests for {file_path}: {e}")
         return UnitTestOutput(
             tests=tests,
             files=files,
             failed=failed,
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            cost=usage.cost,
             scenarios=self.test_scenarios,
         )
 
@@ -130,6 +132,7 @@ class UnitTestGenerator:
         enable_critique: bool = False,
         temp_dir: str = "",
         max_actions: int = 100000,
+        budget: Optional[Budget] = None,
     ):
         self.max_critique = max_critique
         self.enable_critique = enable_critique
@@ -146,10 +149,11 @@ class UnitTestGenerator:
         content = content or self._read_file_content(file_path)
         parsed_data = parser.parse(content)
 
-        test_files, count = self.generate_test_files(
-            parsed_data, file_extension, file_path
-        )
-        return test_files, self.total_usage, count
+        with budget_scope(self.provider.new_budget(budget)), usage_scope() as usage:
+            test_files, count = self.generate_test_files(
+                parsed_data, file_extension, file_path
+            )
+        return test_files, usage.snapshot(), count
 
     def _get_parser(self, file_extension):
         parser_class_name = self.SUPPORTED_LANGUAGES[file_extension]
@@ -177,11 +181,14 @@ class UnitTestGenerator:
                 )
                 test_files[file_path] = test_code
                 actions_used += count
+            except BudgetExceededError:
+                raise
             except Exception:
                 self.logger.error(f"Failed to generate test case for item: {item}")
 
         print(
-            f"\nAll items processed successfully!\n Total Tokens Spent: {self.total_usage}"
+            "\nAll items processed successfully!\n Total Tokens Spent: "
+            f"{self._total_usage()}"
         )
         return test_files, actions_used
 
@@ -356,5 +363,10 @@ class UnitTestGenerator:
         self.log_step("Write test file", f"Test file written to: {test_file_path}")
 
     def update_usage(self, usage):
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
-        print(f"@ Token usage: current_step: {usage}, total: {self.total_usage}")
+        print(f"@ Token usage: current_step: {usage}, total: {self._total_usage()}")
+
+    @staticmethod
+    def _total_usage():
+        # The provider records usage into the current `usage_scope`
+        tracker = get_current_usage()
+        return tracker.snapshot() if tracker else {}
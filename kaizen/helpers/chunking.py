@@ -0,0 +1,183 @@
+from typing import Callable, List, Optional
+
+from kaizen.helpers.diff import CONTEXT, FileDiff, Hunk
+
+SEQUENTIAL = "sequential"
+FIRST_FIT_DECREASING = "ffd"
+DEFAULT_HUNK_OVERLAP = 3
+
+
+def pack_chunks(
+    parts: List[str],
+    budget: int,
+    count_tokens: Callable[[str], int],
+    strategy: str = FIRST_FIT_DECREASING,
+    token_counts: Optional[List[int]] = None,
+) -> List[str]:
+    """
+    Pack text parts into as few chunks as possible without exceeding a token budget.
+
+    Every part is tokenized exactly once and chunk sizes are tracked as running
+    sums, so packing is linear in the size of the input instead of re-tokenizing
+    the growing buffer after every append.
+
+    :param parts: Text parts to pack, e.g. one formatted diff per file
+    :param budget: Maximum number of tokens per chunk
+    :param count_tokens: Function returning the token count of a text
+    :param strategy: `SEQUENTIAL` keeps the parts in order and starts a new chunk
+        when the next part does not fit, `FIRST_FIT_DECREASING` places the biggest
+        parts first into the first chunk with room left, producing fuller chunks
+    :param token_counts: Token counts of the parts when they are already known,
+        in which case `count_tokens` is not called
+    :return: The packed chunks. Parts inside a chunk keep their original order
+        and a part bigger than the budget is returned as a chunk of its own
+    """
+    if token_counts is None:
+        token_counts = [count_tokens(part) for part in parts]
+    elif len(token_counts) != len(parts):
+        raise ValueError("token_counts must have one entry per part")
+    if strategy == SEQUENTIAL:
+        bins = _pack_sequential(token_counts, budget)
+    elif strategy == FIRST_FIT_DECREASING:
+        bins = _pack_first_fit_decreasing(token_counts, budget)
+    else:
+        raise ValueError(f"Unknown chunk packing strategy: {strategy}")
+    return ["".join(parts[index] for index in indexes) for indexes in bins]
+
+
+def _pack_sequential(token_counts: List[int], budget: int) -> List[List[int]]:
+    bins = []
+    current, used = [], 0
+    for index, count in enumerate(token_counts):
+        if current and used + count > budget:
+            bins.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += count
+    if current:
+        bins.append(current)
+    return bins
+
+
+def _pack_first_fit_decreasing(token_counts: List[int], budget: int) -> List[List[int]]:
+    bins = []
+    remaining = []
+    order = sorted(range(len(token_counts)), key=lambda i: (-token_counts[i], i))
+    for index in order:
+        count = token_counts[index]
+        for bin_index, space in enumerate(remaining):
+            if count <= space:
+                bins[bin_index].append(index)
+                remaining[bin_index] -= count
+                break
+        else:
+            bins.append([index])
+            remaining.append(budget - count)
+
+    # Keep the output deterministic and close to the input order
+    for indexes in bins:
+        indexes.sort()
+    bins.sort(key=lambda indexes: indexes[0])
+    return bins
+
+
+def split_file_diff(
+    file_diff: FileDiff,
+    budget: int,
+    count_tokens: Callable[[str], int],
+    render: Optional[Callable[[FileDiff], str]] = None,
+    overlap: int = DEFAULT_HUNK_OVERLAP,
+) -> List[FileDiff]:
+    """
+    Split a file diff which is too big for one prompt into smaller file diffs.
+
+    Consecutive hunks are grouped as long as they fit in the budget. A hunk which
+    is too big on its own is cut into line ranges, each repeating up to `overlap`
+    lines of the previous range as context so the reviewer does not lose track of
+    the surrounding code.
+
+    :param file_diff: The file diff to split
+    :param budget: Maximum number of tokens of a rendered piece, excluding the
+        file header added by the caller
+    :param count_tokens: Function returning the token count of a text
+    :param render: Function rendering a file diff the way it is sent to the
+        model, defaults to `FileDiff.render`
+    :param overlap: Number of context lines repeated when a hunk is cut
+    :return: File diffs with the same file name, in diff order
+    """
+    if render is None:
+        render = FileDiff.render
+
+    def count_hunk(hunk: Hunk) -> int:
+        return count_tokens(render(FileDiff(file_diff.file_name, [hunk])))
+
+    pieces = []
+    current, used = [], 0
+    for hunk in file_diff.hunks:
+        tokens = count_hunk(hunk)
+        if tokens > budget:
+            if current:
+                pieces.append(current)
+                current, used = [], 0
+            pieces.extend(
+                [piece] for piece in _split_hunk(hunk, budget, count_hunk, overlap)
+            )
+            continue
+        if current and used + tokens > budget:
+            pieces.append(current)
+            current, used = [], 0
+        current.append(hunk)
+        used += tokens
+    if current:
+        pieces.append(current)
+
+    return [FileDiff(file_diff.file_name, hunks, file_diff.status) for hunks in pieces]
+
+
+def _split_hunk(
+    hunk: Hunk, budget: int, count_hunk: Callable[[Hunk], int], overlap: int
+) -> List[Hunk]:
+    if len(hunk) <= 1:
+        return [hunk]
+    tokens = count_hunk(hunk)
+    lines_per_piece = len(hunk)
+    while True:
+        # Assume tokens are spread evenly over the lines and shrink the pieces
+        # until the biggest one fits
+        lines_per_piece = max(
+            1, min(lines_per_piece - 1, lines_per_piece * budget // tokens)
+        )
+        pieces = [
+            hunk.slice(start, start + lines_per_piece, overlap if start else 0)
+            for start in range(0, len(hunk), lines_per_piece)
+        ]
+        # Pieces made only of context lines have nothing to review
+        pieces = [
+            piece for piece in pieces if piece.kinds.count(CONTEXT) < len(piece)
+        ] or pieces
+        tokens = max(count_hunk(piece) for piece in pieces)
+        if tokens <= budget or lines_per_piece == 1:
+            return pieces
+
+
+def render_file_parts(
+    file_diff: FileDiff,
+    header: str,
+    budget: int,
+    count_tokens: Callable[[str], int],
+    render: Optional[Callable[[FileDiff], str]] = None,
+    overlap: int = DEFAULT_HUNK_OVERLAP,
+) -> List[str]:
+    """
+    Render a file diff prefixed by `header`, split with `split_file_diff` into
+    several parts which all repeat the header if it does not fit in the budget.
+    """
+    if render is None:
+        render = FileDiff.render
+    part = header + render(file_diff)
+    if count_tokens(part) <= budget:
+        return [part]
+    pieces = split_file_diff(
+        file_diff, budget - count_tokens(header), count_tokens, render, overlap
+    )
+    return [header + render(piece) for piece in pieces]
@@ -0,0 +1,327 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from kaizen.helpers.parser import HUNK_HEADER_PATTERN, format_change
+
+CONTEXT = ord(" ")
+ADDED = ord("+")
+REMOVED = ord("-")
+
+
+class Hunk:
+    """
+    A single `@@` hunk of a unified diff.
+
+    Line types are kept in the compact `kinds` bytearray (one of `CONTEXT`,
+    `ADDED` or `REMOVED` per line) next to the raw line contents, and the
+    `[LINE n] [TYPE]` representation is only built when rendering.
+    """
+
+    __slots__ = (
+        "file_name",
+        "old_start",
+        "old_count",
+        "new_start",
+        "new_count",
+        "section",
+        "kinds",
+        "lines",
+    )
+
+    def __init__(
+        self,
+        file_name: str,
+        old_start: int,
+        old_count: int,
+        new_start: int,
+        new_count: int,
+        section: str = "",
+    ):
+        self.file_name = file_name
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.section = section
+        self.kinds = bytearray()
+        self.lines: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __repr__(self) -> str:
+        return (
+            f"Hunk({self.file_name!r}, -{self.old_start},{self.old_count} "
+            f"+{self.new_start},{self.new_count}, {len(self.lines)} lines)"
+        )
+
+    def append(self, kind: int, content: str) -> None:
+        self.kinds.append(kind)
+        self.lines.append(content)
+
+    def slice(self, start: int, end: int, overlap: int = 0) -> "Hunk":
+        """
+        Return lines `start:end` as a hunk of their own with correct line numbers.
+
+        Up to `overlap` lines before `start` are prepended as context, removed
+        lines are skipped for it since they are not part of the new file.
+        """
+        old_num = self.old_start + start - self.kinds[:start].count(ADDED)
+        new_num = self.new_start + start - self.kinds[:start].count(REMOVED)
+        context = [
+            content
+            for kind, content in zip(
+                self.kinds[max(0, start - overlap) : start],
+                self.lines[max(0, start - overlap) : start],
+            )
+            if kind != REMOVED
+        ]
+        kinds = self.kinds[start:end]
+        hunk = Hunk(
+            self.file_name,
+            old_num - len(context),
+            len(context) + len(kinds) - kinds.count(ADDED),
+            new_num - len(context),
+            len(context) + len(kinds) - kinds.count(REMOVED),
+            self.section,
+        )
+        hunk.kinds = bytearray([CONTEXT]) * len(context) + kinds
+        hunk.lines = context + self.lines[start:end]
+        return hunk
+
+    def render(self, ignore_deletions: bool = False) -> Iterator[str]:
+        """Yield the hunk in the format produced by `patch_to_combined_chunks`."""
+        yield format_change(None, self.new_start, "CONTEXT", self.section)
+        old_num = self.old_start
+        new_num = self.new_start
+        for kind, content in zip(self.kinds, self.lines):
+            if kind == REMOVED:
+                if not ignore_deletions:
+                    yield format_change(None, old_num, "REMOVED", content)
+                old_num += 1
+            elif kind == ADDED:
+                yield format_change(None, new_num, "UPDATED", content)
+                new_num += 1
+            else:
+                # Context lines keep their leading space like in the raw patch
+                yield format_change(None, new_num, "CONTEXT", " " + content)
+                old_num += 1
+                new_num += 1
+
+
+def _file_name_from_header(line: str) -> str:
+    # diff --git a/path/to/file b/path/to/file
+    return line.rsplit(" b/", 1)[-1]
+
+
+def iter_hunks(lines: Iterable[str], file_name: str = "") -> Iterator[Hunk]:
+    """
+    Lazily parse unified diff lines into `Hunk` objects.
+
+    `lines` can be any iterable of diff lines (a list, an open file, a streamed
+    HTTP response) and each hunk is yielded as soon as it is complete, so memory
+    is bounded by the largest hunk rather than the whole diff. `file_name` is
+    used for patches without file headers, such as the `patch` field of the
+    GitHub pull request files API.
+    """
+    hunk: Optional[Hunk] = None
+    old_remaining = new_remaining = 0
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if hunk is not None:
+            tag = line[:1]
+            if tag == "\\":
+                # "\ No newline at end of file"
+                continue
+            if tag == "-":
+                hunk.append(REMOVED, line[1:])
+                old_remaining -= 1
+            elif tag == "+":
+                hunk.append(ADDED, line[1:])
+                new_remaining -= 1
+            else:
+                hunk.append(CONTEXT, line[1:])
+                old_remaining -= 1
+                new_remaining -= 1
+            if old_remaining <= 0 and new_remaining <= 0:
+                yield hunk
+                hunk = None
+            continue
+
+        if line.startswith("diff --git"):
+            file_name = _file_name_from_header(line)
+        elif line.startswith("+++ "):
+            name = line[4:]
+            if name != "/dev/null":
+                file_name = name[2:] if name.startswith("b/") else name
+        elif line.startswith("@@"):
+            match = HUNK_HEADER_PATTERN.match(line)
+            if not match:
+                continue
+            old_count = int(match.group(2)) if match.group(2) is not None else 1
+            new_count = int(match.group(4)) if match.group(4) is not None else 1
+            hunk = Hunk(
+                file_name,
+                int(match.group(1)),
+                old_count,
+                int(match.group(3)),
+                new_count,
+                match.group(5),
+            )
+            old_remaining, new_remaining = old_count, new_count
+            if old_remaining <= 0 and new_remaining <= 0:
+                yield hunk
+                hunk = None
+
+    if hunk is not None:
+        # Truncated diff, keep what we have
+        yield hunk
+
+
+class FileDiff:
+    """All hunks of a single file in a diff."""
+
+    __slots__ = ("file_name", "hunks", "status", "patch", "previous_file_name")
+
+    def __init__(
+        self,
+        file_name: str,
+        hunks: Optional[List[Hunk]] = None,
+        status: Optional[str] = None,
+        patch: Optional[str] = None,
+        previous_file_name: Optional[str] = None,
+    ):
+        self.file_name = file_name
+        self.hunks = hunks if hunks is not None else []
+        self.status = status
+        # Raw patch text when it was already available, to avoid re-rendering it
+        self.patch = patch
+        # Name before a rename, if the file was renamed
+        self.previous_file_name = previous_file_name
+
+    def __repr__(self) -> str:
+        return f"FileDiff({self.file_name!r}, {len(self.hunks)} hunks)"
+
+    def render(self, ignore_deletions: bool = False) -> str:
+        """Render the file in the format produced by `patch_to_combined_chunks`."""
+        entries = []
+        for hunk in self.hunks:
+            entries.append("\n")
+            entries.extend(hunk.render(ignore_deletions))
+        return "\n".join(entries)
+
+    def to_patch(self) -> str:
+        """Return the file's hunks as unified diff text."""
+        if self.patch is not None:
+            return self.patch
+        lines = []
+        for hunk in self.hunks:
+            header = f"@@ -{hunk.old_start},{hunk.old_count} +{hunk.new_start},{hunk.new_count} @@"
+            lines.append(f"{header} {hunk.section}" if hunk.section else header)
+            lines.extend(
+                chr(kind) + content for kind, content in zip(hunk.kinds, hunk.lines)
+            )
+        return "\n".join(lines)
+
+    def first_changed_line(self) -> int:
+        if not self.hunks:
+            return 1
+        return self.hunks[0].new_start
+
+    def map_lines(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """
+        Map lines `start` to `end` of the old file to the new file, i.e. the
+        `RIGHT` side lines of a review on the old file.
+
+        Returns None when the diff removes one of the lines or adds lines
+        between them, otherwise the range shifted by the lines added and
+        removed before it.
+        """
+        shift = 0
+        for hunk in self.hunks:
+            if hunk.old_start > end:
+                break
+            # A hunk without old lines adds them after `old_start`
+            old_num = hunk.old_start if hunk.old_count else hunk.old_start + 1
+            for kind in hunk.kinds:
+                if kind == REMOVED:
+                    if start <= old_num <= end:
+                        return None
+                    if old_num < start:
+                        shift -= 1
+                    old_num += 1
+                elif kind == ADDED:
+                    if start < old_num <= end:
+                        return None
+                    if old_num <= start:
+                        shift += 1
+                else:
+                    old_num += 1
+        return start + shift, end + shift
+
+
+class Diff:
+    """
+    Parsed representation of a pull request diff.
+
+    Build it once per pull request with `Diff.from_patch` or `Diff.from_pr_files`
+    and hand it to the reviewers, which then work on the parsed hunks instead of
+    re-parsing the raw patch strings.
+    """
+
+    __slots__ = ("files",)
+
+    def __init__(self, files: Optional[List[FileDiff]] = None):
+        self.files = files if files is not None else []
+
+    def __iter__(self) -> Iterator[FileDiff]:
+        return iter(self.files)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __repr__(self) -> str:
+        return f"Diff({len(self.files)} files)"
+
+    @property
+    def file_names(self) -> List[str]:
+        return [file_diff.file_name for file_diff in self.files]
+
+    def get(self, file_name: str) -> Optional[FileDiff]:
+        for file_diff in self.files:
+            if file_diff.file_name == file_name:
+                return file_diff
+        return None
+
+    @classmethod
+    def from_patch(cls, patch) -> "Diff":
+        """Parse a unified diff given as text or as an iterable of lines."""
+        if isinstance(patch, str):
+            patch = patch.replace("\r\n", "\n").splitlines()
+        files = []
+        current = None
+        for hunk in iter_hunks(patch):
+            if current is None or current.file_name != hunk.file_name:
+                current = FileDiff(hunk.file_name)
+                files.append(current)
+            current.hunks.append(hunk)
+        return cls(files)
+
+    @classmethod
+    def from_pr_files(cls, pull_request_files: List[Dict]) -> "Diff":
+        """Parse the files returned by the GitHub pull request files API."""
+        files = []
+        for file in pull_request_files:
+            file_name = file.get("filename", "")
+            patch = file.get("patch")
+            hunks = list(iter_hunks(patch.splitlines(), file_name)) if patch else []
+            files.append(
+                FileDiff(
+                    file_name,
+                    hunks,
+                    file.get("status"),
+                    patch,
+                    file.get("previous_filename"),
+                )
+            )
+        return cls(files)
@@ -1,7 +1,15 @@
+import asyncio
+import json
+import logging
+import random
 import re
 import time
+from email.utils import parsedate_to_datetime
 from functools import wraps
 from pathlib import Path
+from typing import Callable, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
 
 
 def safe_path_join(base_path, *paths):
@@ -27,22 +35,181 @@ def safe_path_join(base_path, *paths):
     return full_path
 
 
-def retry(max_attempts=3, delay=1):
+NON_RETRYABLE_STATUS_CODES = {400, 401, 403, 404, 422}
+
+
+class RetryPolicy:
+    """
+    Decides if and when a failed call is retried.
+
+    Delays grow exponentially from `base_delay` up to `max_delay` with full
+    jitter (a random delay between 0 and the exponential value), so workers hit
+    by the same rate limit do not retry at the same moment. A `Retry-After`
+    header on the error takes precedence over the computed delay. No retry is
+    started once `deadline` seconds have passed since the first attempt.
+
+    Errors listed in `retry_on` are always retried. Otherwise errors listed in
+    `no_retry_on`, and HTTP errors with a client error status such as 401 or
+    404, are raised right away.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1,
+        max_delay: float = 30,
+        deadline: Optional[float] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (json.JSONDecodeError,),
+        no_retry_on: Tuple[Type[BaseException], ...] = (
+            ValueError,
+            TypeError,
+            AttributeError,
+            NotImplementedError,
+        ),
+        only_retry_on: Optional[Tuple[Type[BaseException], ...]] = None,
+        jitter: bool = True,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.no_retry_on = no_retry_on
+        # When set, nothing but these errors is retried
+        self.only_retry_on = only_retry_on
+        self.jitter = jitter
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if self.only_retry_on is not None:
+            return isinstance(error, self.only_retry_on)
+        if isinstance(error, self.retry_on):
+            return True
+        if isinstance(error, self.no_retry_on):
+            return False
+        return _get_status_code(error) not in NON_RETRYABLE_STATUS_CODES
+
+    def get_delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Return the delay before retrying after the given (1-based) attempt."""
+        retry_after = _get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def next_delay(
+        self, attempt: int, error: BaseException, started_at: float
+    ) -> Optional[float]:
+        """Return the delay before the next attempt, or None to give up."""
+        if attempt >= self.max_attempts or not self.is_retryable(error):
+            return None
+        delay = self.get_delay(attempt, error)
+        if (
+            self.deadline is not None
+            and time.monotonic() - started_at + delay > self.deadline
+        ):
+            return None
+        return delay
+
+    def call(self, func: Callable, *args, **kwargs):
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(attempt, e, started_at)
+                if delay is None:
+                    raise
+                _log_retry(func, attempt, e, delay)
+                time.sleep(delay)
+
+    async def acall(self, func: Callable, *args, **kwargs):
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(attempt, e, started_at)
+                if delay is None:
+                    raise
+                _log_retry(func, attempt, e, delay)
+                await asyncio.sleep(delay)
+
+
+def _log_retry(func: Callable, attempt: int, error: BaseException, delay: float):
+    logger.warning(
+        f"{func.__qualname__} attempt {attempt} failed: error |{error}|. "
+        f"Retrying in {delay:.2f} seconds..."
+    )
+
+
+def _get_status_code(error: BaseException) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def _get_retry_after(error: BaseException) -> Optional[float]:
+    retry_after = getattr(error, "retry_after", None)
+    if isinstance(retry_after, (int, float)):
+        return float(retry_after)
+
+    for headers in (
+        getattr(error, "headers", None),
+        getattr(error, "litellm_response_headers", None),
+        getattr(getattr(error, "response", None), "headers", None),
+    ):
+        if not headers:
+            continue
+        try:
+            headers = {str(key).lower(): value for key, value in headers.items()}
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            # HTTP-date form
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def retry(max_attempts=3, delay=1, policy: Optional[RetryPolicy] = None):
+    if policy is None:
+        policy = RetryPolicy(max_attempts=max_attempts, base_delay=delay)
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            attempts = 0
-            while attempts < max_attempts:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    attempts += 1
-                    if attempts == max_attempts:
-                        raise
-                    print(
-                        f"Attempt {attempts} failed: error |{e}|. Retrying in {delay} seconds..."
-                    )
-                    time.sleep(delay)
+            return policy.call(func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def aretry(max_attempts=3, delay=1, policy: Optional[RetryPolicy] = None):
+    if policy is None:
+        policy = RetryPolicy(max_attempts=max_attempts, base_delay=delay)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await policy.acall(func, *args, **kwargs)
 
         return wrapper
 
@@ -1,6 +1,7 @@
 import json
 import re
 import os
+from collections import Counter
 
 EXCLUDED_FILETYPES = [
     # Compiled output
@@ -104,7 +105,209 @@ def should_ignore_file(filepath):
     return False
 
 
+JSON_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?[ \t]*\n(.*?)```", re.DOTALL)
+JSON_CLOSERS = {"{": "}", "[": "]"}
+
+# How often responses parsed as is, needed a local repair or could not be parsed
+# at all (which makes `chat_completion_with_json` request a new completion)
+json_stats = Counter()
+
+
 def extract_json(text):
+    """
+    Extract the JSON object from an LLM response.
+
+    Candidates are tried in order: fenced ```json blocks, the first balanced
+    `{...}` object and the text between the first `{` and the last `}`. Each
+    candidate is parsed as is first and then repaired locally: trailing commas
+    are dropped, raw newlines inside strings are accepted and a truncated
+    response gets its open strings and brackets closed.
+
+    :raises json.JSONDecodeError: When no candidate could be parsed
+    """
+    error = None
+    candidates = _json_candidates(text)
+    for repair in (False, True):
+        for candidate in candidates:
+            try:
+                parsed = json.loads(
+                    _repair_json(candidate) if repair else candidate, strict=False
+                )
+            except json.JSONDecodeError as e:
+                error = error or e
+                continue
+            json_stats["repaired" if repair else "parsed"] += 1
+            return parsed
+
+    try:
+        parsed = _extract_json_legacy(text)
+    except json.JSONDecodeError:
+        json_stats["failed"] += 1
+        if error is None:
+            raise
+        raise error
+    json_stats["repaired"] += 1
+    return parsed
+
+
+def _json_candidates(text):
+    candidates = [match.strip() for match in JSON_FENCE_PATTERN.findall(text)]
+    start_index = text.find("{")
+    if start_index != -1:
+        end_index = _find_json_end(text, start_index)
+        candidates.append(text[start_index:end_index])
+        last_index = text.rfind("}") + 1
+        if last_index > end_index:
+            candidates.append(text[start_index:last_index])
+    # Keep the order but skip duplicates
+    return list(dict.fromkeys(candidate for candidate in candidates if candidate))
+
+
+def _find_json_end(text, start_index):
+    """Return the end of the JSON value starting at `start_index`, or the text end."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start_index, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return len(text)
+
+
+def _repair_json(candidate):
+    """Drop trailing commas and close strings and brackets left open."""
+    output = []
+    stack = []
+    in_string = False
+    escaped = False
+    for char in candidate:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            output.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in JSON_CLOSERS:
+            stack.append(JSON_CLOSERS[char])
+        elif char in "}]":
+            _strip_trailing_comma(output)
+            if stack:
+                stack.pop()
+        output.append(char)
+
+    if in_string:
+        if escaped:
+            output.pop()
+        output.append('"')
+    _strip_trailing_comma(output)
+    if "".join(output[-8:]).rstrip().endswith(":"):
+        output.append("null")
+    while stack:
+        output.append(stack.pop())
+    return "".join(output)
+
+
+def _strip_trailing_comma(output):
+    index = len(output) - 1
+    while index >= 0 and output[index].isspace():
+        index -= 1
+    if index >= 0 and output[index] == ",":
+        del output[index]
+
+
+class JsonStreamParser:
+    """
+    Validate a JSON response while it is streamed and collect finished items.
+
+    Text is fed as it arrives. Objects inside an array of the top-level object,
+    e.g. the entries of `{"review": [...]}`, are returned by `feed` as soon as
+    they are complete. `json.JSONDecodeError` is raised as soon as the response
+    is clearly malformed: a bracket closes something it did not open, or no JSON
+    object started within the first `max_prefix` characters.
+    """
+
+    def __init__(self, max_prefix: int = 2000):
+        self.max_prefix = max_prefix
+        self.text = []
+        self.length = 0
+        self.started = False
+        self.done = False
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.item_start = None
+        self.items = []
+
+    def feed(self, text: str):
+        new_items = []
+        for char in text:
+            position = self.length
+            self.text.append(char)
+            self.length += 1
+            if self.done:
+                continue
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.stack.append("}")
+                elif self.length > self.max_prefix:
+                    self._fail("No JSON object found in response")
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in JSON_CLOSERS:
+                if char == "{" and self.stack == ["}", "]"]:
+                    self.item_start = position
+                self.stack.append(JSON_CLOSERS[char])
+            elif char in "}]":
+                if self.stack.pop() != char:
+                    self._fail(f"Unexpected {char!r}")
+                if self.item_start is not None and self.stack == ["}", "]"]:
+                    item = "".join(self.text[self.item_start : position + 1])
+                    self.item_start = None
+                    try:
+                        new_items.append(json.loads(_repair_json(item), strict=False))
+                    except json.JSONDecodeError:
+                        # Leave it to `extract_json` on the full response
+                        pass
+                if not self.stack:
+                    self.done = True
+        self.items.extend(new_items)
+        return new_items
+
+    def _fail(self, message: str):
+        raise json.JSONDecodeError(message, "".join(self.text), self.length - 1)
+
+
+def _extract_json_legacy(text):
     # Find the start and end positions of the JSON data
     start_index = text.find("{")
     end_index = text.rfind("}") + 1
@@ -209,66 +412,83 @@ def format_change(old_num, new_num, change_type, content, ignore_deletions=False
     return f"[LINE {new_num_str}] [{change_type}] {content}"
 
 
+HUNK_HEADER_PATTERN = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)")
+
+
 def patch_to_combined_chunks(patch_text, ignore_deletions=False):
     if not patch_text:
         return ""
-    patch_text = patch_text.replace("\r\n", "\n")
-    lines = patch_text.splitlines(keepends=True)
-    changes = []
+    lines = patch_text.replace("\r\n", "\n").splitlines()
+    return "\n".join(iter_combined_chunks(lines, ignore_deletions))
+
+
+def iter_combined_chunks(lines, ignore_deletions=False):
+    """
+    Lazily render diff lines in the `[LINE n] [TYPE] content` format.
+
+    Streaming counterpart of `patch_to_combined_chunks`: `lines` can be any
+    iterable of diff lines, such as an open file, and the output is yielded one
+    entry at a time, so `"\n".join(...)` of the result matches
+    `patch_to_combined_chunks`. Lines before the first `diff --git` header (e.g.
+    the mail headers of a `git format-patch` file) are held back until it is
+    known whether they belong to a diff and dropped once a header is found.
+    """
+    pending = []
+    buffering = True
+    last_entry = None
     removal_line_num = 1
     addition_line_num = 1
     is_diff = False
-    removed_hunk = False
-    current_file_name = ""
 
     for line in lines:
-        line = line.rstrip("\n")
-        if "diff --git" in line:
+        line = line.rstrip("\r\n")
+        entries = []
+        if line.startswith("diff --git"):
             is_diff = True
-            if not removed_hunk:
-                changes = []
-                removed_hunk = True
-            changes.append("\n")
+            if buffering:
+                pending = []
+                buffering = False
+                last_entry = None
+            entries.append("\n")
         elif is_diff:
             is_diff = False
         elif line.startswith("@@"):
-            match = re.match(r"@@ -(\d+),\d+ \+(\d+),\d+ @@ (.*)", line)
+            match = HUNK_HEADER_PATTERN.match(line)
             if match:
                 removal_line_num = int(match.group(1))
-                addition_line_num = int(match.group(2))
-                content = match.group(3)
-                changes.append("\n")
-                changes.append(
+                addition_line_num = int(match.group(3))
+                entries.append("\n")
+                entries.append(
                     format_change(
-                        None, addition_line_num, "CONTEXT", content, ignore_deletions
+                        None,
+                        addition_line_num,
+                        "CONTEXT",
+                        match.group(5),
+                        ignore_deletions,
                     )
                 )
+            if buffering:
+                # A bare patch without diff headers, nothing to drop
+                yield from pending
+                pending = []
+                buffering = False
         elif line.startswith("index "):
             continue
-        elif line.startswith("--- a"):
-            line = line.replace("--- a/", "")
-            current_file_name = line
-            if (
-                current_file_name != "/dev/null"
-                and changes
-                and "[FILE_START]" not in changes[-1]
-            ):
-                changes.append("\n[FILE_END]\n")
-                changes.append(f"\n[FILE_START] {current_file_name}\n")
-        elif line.startswith("+++ b"):
-            line = line.replace("+++ b/", "")
-            current_file_name = line
+        elif line in ("--- /dev/null", "+++ /dev/null"):
+            continue
+        elif line.startswith("--- a") or line.startswith("+++ b"):
+            current_file_name = line[len("--- a/") :]
             if (
                 current_file_name != "/dev/null"
-                and changes
-                and "[FILE_START]" not in changes[-1]
+                and last_entry is not None
+                and "[FILE_START]" not in last_entry
             ):
-                changes.append("\n[FILE_END]\n")
-                changes.append(f"\n[FILE_START] {current_file_name}\n")
+                entries.append("\n[FILE_END]\n")
+                entries.append(f"\n[FILE_START] {current_file_name}\n")
         elif line.startswith("-"):
             content = line[1:]
             if not ignore_deletions:
-                changes.append(
+                entries.append(
                     format_change(
                         None, removal_line_num, "REMOVED", content, ignore_deletions
                     )
@@ -276,7 +496,7 @@ def patch_to_combined_chunks(patch_text, ignore_deletions=False):
             removal_line_num += 1
         elif line.startswith("+"):
             content = line[1:]
-            changes.append(
+            entries.append(
                 format_change(
                     None, addition_line_num, "UPDATED", content, ignore_deletions
                 )
@@ -284,7 +504,7 @@ def patch_to_combined_chunks(patch_text, ignore_deletions=False):
             addition_line_num += 1
         else:
             content = line
-            changes.append(
+            entries.append(
                 format_change(
                     None,
                     addition_line_num,
@@ -296,9 +516,15 @@ def patch_to_combined_chunks(patch_text, ignore_deletions=False):
             removal_line_num += 1
             addition_line_num += 1
 
-    output = changes
+        if not entries:
+            continue
+        last_entry = entries[-1]
+        if buffering:
+            pending.extend(entries)
+        else:
+            yield from entries
 
-    return "\n".join(output)
+    yield from pending
 
 
 def format_add_linenum(new_num, content, ignore_deletions=False):
@@ -0,0 +1,137 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Tracing is optional
+    trace = None
+
+try:
+    from prometheus_client import Histogram
+except ImportError:  # Metrics are optional
+    Histogram = None
+
+_current_timings: ContextVar[Optional["Timings"]] = ContextVar(
+    "kaizen_timings", default=None
+)
+
+_tracer = trace.get_tracer("kaizen") if trace is not None else None
+STAGE_SECONDS = (
+    Histogram(
+        "kaizen_stage_duration_seconds",
+        "Time spent in each stage of reviews and LLM calls",
+        ["stage"],
+        buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    )
+    if Histogram is not None
+    else None
+)
+
+
+class Timings:
+    """
+    Seconds spent per stage in a `timing_scope`, summed over all occurrences.
+
+    Stages run concurrently for chunked reviews and nest, e.g. `reevaluate`
+    includes its `llm.request`, so their sum can exceed `total`, the wall time
+    of the scope. Like `UsageTracker`, updates are forwarded to the timings of
+    the enclosing scope.
+    """
+
+    def __init__(self, parent: Optional["Timings"] = None):
+        self.parent = parent
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+        if self.parent is not None:
+            self.parent.add(stage, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            timings = dict(self.stages)
+        timings["total"] = time.monotonic() - self.started_at
+        return timings
+
+
+def get_current_timings() -> Optional[Timings]:
+    return _current_timings.get()
+
+
+@contextmanager
+def timing_scope(timings: Optional[Timings] = None):
+    """
+    Collect the stage timings of this context into `timings`, new timings
+    nested in the active ones by default. Thread pool work must be run with
+    `contextvars.copy_context().run`, as for `usage_scope`.
+    """
+    if timings is None:
+        timings = Timings(parent=get_current_timings())
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def _attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    # OpenTelemetry only accepts primitive attribute values
+    return {
+        f"kaizen.{key}": (
+            value if isinstance(value, (str, bool, int, float)) else str(value)
+        )
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+def _observe(stage: str, seconds: float) -> None:
+    timings = get_current_timings()
+    if timings is not None:
+        timings.add(stage, seconds)
+    if STAGE_SECONDS is not None:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def record(stage: str, seconds: float, **attributes: Any) -> None:
+    """
+    Record a duration measured elsewhere, e.g. the time a request waited for
+    the rate limiter, as a stage ending now.
+    """
+    _observe(stage, seconds)
+    if _tracer is not None:
+        end = time.time_ns()
+        _tracer.start_span(
+            stage,
+            start_time=end - int(seconds * 1e9),
+            attributes=_attributes(attributes),
+        ).end(end_time=end)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any):
+    """
+    Time the enclosed block as `stage`. The duration is added to the current
+    timings and, when installed, emitted as an OpenTelemetry span and observed
+    in the `kaizen_stage_duration_seconds` Prometheus histogram.
+    """
+    start = time.monotonic()
+    if _tracer is None:
+        try:
+            yield
+        finally:
+            _observe(stage, time.monotonic() - start)
+        return
+    with _tracer.start_as_current_span(stage, attributes=_attributes(attributes)):
+        try:
+            yield
+        finally:
+            _observe(stage, time.monotonic() - start)
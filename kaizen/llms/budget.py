@@ -0,0 +1,191 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+_current_budget: ContextVar[Optional["Budget"]] = ContextVar(
+    "kaizen_budget", default=None
+)
+
+
+class BudgetExceededError(Exception):
+    """Raised before sending a request which would exceed the active budget."""
+
+
+class Budget:
+    """
+    Token and cost limits for a unit of work, such as reviewing one pull request.
+
+    `LLMProvider` checks the active budget before every request: the prompt
+    tokens, completion tokens and estimated cost of the request are reserved
+    and the request is rejected with `BudgetExceededError` when it would go over
+    a limit. Completion tokens are capped through `max_tokens` to what is left
+    after the requests in flight. When
+    `downgrade_model` is set, requests switch to that model group once
+    `downgrade_at` of any limit is spent, or when the requested model would not
+    fit but the downgrade model does.
+    """
+
+    # Completion tokens reserved for a request that does not set `max_tokens`
+    DEFAULT_MAX_TOKENS_PER_REQUEST = 4096
+
+    def __init__(
+        self,
+        max_prompt_tokens: Optional[int] = None,
+        max_completion_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+        downgrade_model: Optional[str] = None,
+        downgrade_at: float = 0.8,
+        max_tokens_per_request: int = DEFAULT_MAX_TOKENS_PER_REQUEST,
+    ):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.max_cost = max_cost
+        self.downgrade_model = downgrade_model
+        self.downgrade_at = downgrade_at
+        self.max_tokens_per_request = max_tokens_per_request
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        self.cost = 0.0
+        self._reserved_prompt_tokens = 0
+        self._reserved_completion_tokens = 0
+        self._reserved_cost = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> Optional["Budget"]:
+        if not config:
+            return None
+        return cls(
+            max_prompt_tokens=config.get("max_prompt_tokens"),
+            max_completion_tokens=config.get("max_completion_tokens"),
+            max_cost=config.get("max_cost"),
+            downgrade_model=config.get("downgrade_model"),
+            downgrade_at=config.get("downgrade_at", 0.8),
+            max_tokens_per_request=config.get(
+                "max_tokens_per_request", cls.DEFAULT_MAX_TOKENS_PER_REQUEST
+            ),
+        )
+
+    def _spent_fractions(self):
+        if self.max_prompt_tokens:
+            yield (
+                self.usage["prompt_tokens"] + self._reserved_prompt_tokens
+            ) / self.max_prompt_tokens
+        if self.max_completion_tokens:
+            yield (
+                self.usage["completion_tokens"] + self._reserved_completion_tokens
+            ) / self.max_completion_tokens
+        if self.max_cost:
+            yield (self.cost + self._reserved_cost) / self.max_cost
+
+    def should_downgrade(self) -> bool:
+        with self._lock:
+            return any(
+                fraction >= self.downgrade_at for fraction in self._spent_fractions()
+            )
+
+    def remaining_completion_tokens(self) -> Optional[int]:
+        if self.max_completion_tokens is None:
+            return None
+        with self._lock:
+            return self._remaining_completion_tokens()
+
+    def _remaining_completion_tokens(self) -> int:
+        spent = self.usage["completion_tokens"] + self._reserved_completion_tokens
+        return max(0, self.max_completion_tokens - spent)
+
+    def _check(self, prompt_tokens: int, cost: float) -> None:
+        if (
+            self.max_prompt_tokens is not None
+            and self.usage["prompt_tokens"]
+            + self._reserved_prompt_tokens
+            + prompt_tokens
+            > self.max_prompt_tokens
+        ):
+            raise BudgetExceededError(
+                f"Request of {prompt_tokens} prompt tokens exceeds the budget of "
+                f"{self.max_prompt_tokens} prompt tokens "
+                f"({self.usage['prompt_tokens']} used)"
+            )
+        if (
+            self.max_completion_tokens is not None
+            and self._remaining_completion_tokens() == 0
+        ):
+            raise BudgetExceededError(
+                f"Budget of {self.max_completion_tokens} completion tokens is spent "
+                f"or reserved by requests in flight"
+            )
+        if (
+            self.max_cost is not None
+            and self.cost + self._reserved_cost + cost > self.max_cost
+        ):
+            raise BudgetExceededError(
+                f"Request costing ~${cost:.4f} exceeds the budget of "
+                f"${self.max_cost:.4f} (${self.cost:.4f} spent)"
+            )
+
+    def reserve(
+        self,
+        prompt_tokens: int,
+        cost: float = 0.0,
+        completion_tokens: Optional[int] = None,
+    ) -> Tuple[int, float, int]:
+        """
+        Reserve room for a request, raising `BudgetExceededError` if there is none.
+
+        Up to `completion_tokens`, or `max_tokens_per_request` when it is None,
+        of the completion tokens left are reserved. The reservation is returned,
+        its last item is the `max_tokens` the request may use.
+        """
+        with self._lock:
+            self._check(prompt_tokens, cost)
+            if self.max_completion_tokens is not None:
+                completion_tokens = min(
+                    completion_tokens or self.max_tokens_per_request,
+                    self._remaining_completion_tokens(),
+                )
+            completion_tokens = completion_tokens or 0
+            self._reserved_prompt_tokens += prompt_tokens
+            self._reserved_completion_tokens += completion_tokens
+            self._reserved_cost += cost
+        return prompt_tokens, cost, completion_tokens
+
+    def settle(
+        self,
+        reservation: Tuple[int, float, int],
+        usage: Optional[Dict[str, int]] = None,
+        cost: float = 0.0,
+    ) -> None:
+        """Replace a reservation with the actual usage, or release it on failure."""
+        prompt_tokens, reserved_cost, completion_tokens = reservation
+        with self._lock:
+            self._reserved_prompt_tokens -= prompt_tokens
+            self._reserved_completion_tokens -= completion_tokens
+            self._reserved_cost -= reserved_cost
+            if usage:
+                for key in self.usage:
+                    self.usage[key] += usage.get(key, 0) or 0
+                self.cost += cost
+
+
+def get_current_budget() -> Optional[Budget]:
+    return _current_budget.get()
+
+
+@contextmanager
+def budget_scope(budget: Optional[Budget]):
+    """
+    Make `budget` the active budget for all provider calls in this context.
+
+    The budget follows asyncio tasks automatically. Work handed to a thread pool
+    must be run with `contextvars.copy_context().run` to keep it. `None` keeps
+    the budget that is already active.
+    """
+    if budget is None:
+        yield get_current_budget()
+        return
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
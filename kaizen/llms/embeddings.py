@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.expanduser("~/.kaizen/cache/embeddings.db")
+DEFAULT_EMBEDDING_DIMENSIONS = 1536
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_BATCH_TOKENS = 100000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def batch_texts(
+    texts: List[str],
+    count_tokens: Callable[[str], int],
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+) -> List[List[int]]:
+    """
+    Split `texts` into batches of indices that stay within the number of
+    inputs and tokens the provider accepts per embedding request. A text
+    bigger than `max_batch_tokens` gets a batch of its own.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (
+            len(batch) >= max_batch_size or batch_tokens + tokens > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding vectors keyed by model, dimensions and a hash of the
+    text, so unchanged functions are not embedded again when a repository is
+    re-indexed. Vectors are stored as float32, the precision of pgvector.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model, dimensions, text_hash)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(
+        self, model: str, dimensions: int, hashes: Iterable[str]
+    ) -> Dict[str, List[float]]:
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock:
+            # Stay below SQLite's limit of host parameters per statement
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT text_hash, vector FROM embeddings "
+                    "WHERE model = ? AND dimensions = ? AND text_hash IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    (model, dimensions, *chunk),
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def set_many(
+        self, model: str, dimensions: int, vectors: Dict[str, List[float]]
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(model, dimensions, text_hash, vector, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (model, dimensions, key, array("f", vector).tobytes(), now)
+                    for key, vector in vectors.items()
+                ],
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count}
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from kaizen.llms.cache import ResponseCache
+from kaizen.llms.tokens import estimate_tokens
+
+# Parses as a valid, empty result for the reviewers and generators
+DEFAULT_MOCK_RESPONSE = {
+    "review": [],
+    "issues": [],
+    "code_quality_percentage": 100,
+    "desc": "",
+}
+DEFAULT_ERROR_STATUS = 503
+STREAM_CHUNK_SIZE = 16
+
+
+class MockProviderError(Exception):
+    """Synthetic provider error, retried like a rate limit or a server error."""
+
+    def __init__(self, message: str, status_code: int = DEFAULT_ERROR_STATUS):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LatencyModel:
+    """
+    Response time of a mock deployment, in seconds.
+
+    `constant` always waits `median`, `uniform` waits between `min_latency`
+    and `max_latency` (twice the median by default) and `lognormal` waits
+    around `median` with the long tail of real providers, wider for a bigger
+    `sigma`. Every completion token adds `per_token`.
+    """
+
+    DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+    def __init__(
+        self,
+        distribution: str = "lognormal",
+        median: float = 1.0,
+        sigma: float = 0.5,
+        min_latency: float = 0.0,
+        max_latency: Optional[float] = None,
+        per_token: float = 0.0,
+    ):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.median = median
+        self.sigma = sigma
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.per_token = per_token
+
+    def sample(self, rng: random.Random) -> float:
+        """Time to the first token."""
+        if self.distribution == "constant":
+            latency = self.median
+        elif self.distribution == "uniform":
+            latency = rng.uniform(self.min_latency, self.max_latency or 2 * self.median)
+        else:
+            latency = rng.lognormvariate(math.log(self.median), self.sigma)
+        latency = max(self.min_latency, latency)
+        if self.max_latency is not None:
+            latency = min(self.max_latency, latency)
+        return latency
+
+
+class MockRouter:
+    """
+    Offline stand-in for the litellm `Router`, used with `"provider": "mock"`.
+
+    Responses are replayed from a response cache recorded against the real
+    provider, or fall back to `default_response`. Latency, errors and usage are
+    synthetic and seeded, so reviews can be load tested and benchmarked for
+    throughput and tail latency without network access. Deployments can
+    override the mock settings in `model_info.mock`, e.g. to make one of them
+    slow for the latency routing.
+    """
+
+    def __init__(
+        self,
+        model_list: List[Dict[str, Any]],
+        mock: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ):
+        settings = dict(mock or {})
+        self.model_list = model_list
+        # Models of every group, and the group and model of every deployment id
+        self.groups: Dict[str, List[str]] = {}
+        self.deployments: Dict[str, Tuple[str, str]] = {}
+        self.settings: Dict[str, Dict[str, Any]] = {}
+        for index, model_data in enumerate(model_list):
+            group = model_data["model_name"]
+            model = model_data["litellm_params"]["model"]
+            model_info = model_data.get("model_info", {})
+            deployment = model_info.get("id", str(index))
+            self.groups.setdefault(group, []).append(model)
+            self.deployments[deployment] = (group, model)
+            self.settings[deployment] = {**settings, **model_info.get("mock", {})}
+        self.latencies = {
+            deployment: LatencyModel(**deployment_settings.get("latency", {}))
+            for deployment, deployment_settings in self.settings.items()
+        }
+
+        self.replay = None
+        if settings.get("responses"):
+            # Recorded responses never expire
+            self.replay = ResponseCache(path=settings["responses"], ttl=None)
+        default_response = settings.get("default_response", DEFAULT_MOCK_RESPONSE)
+        if not isinstance(default_response, str):
+            default_response = json.dumps(default_response)
+        self.default_response = default_response
+
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._rng = random.Random(settings.get("seed"))
+        self._lock = threading.Lock()
+
+    def _group(self, model: str, specific_deployment: bool) -> Tuple[str, str]:
+        """Return the model group and the id of the deployment serving the request."""
+        if model in self.deployments:
+            return self.deployments[model][0], model
+        if specific_deployment:
+            # Like the router, the first deployment of the model is used
+            deployment = next(
+                (d for d, (_, m) in self.deployments.items() if m == model), None
+            )
+            if deployment is not None:
+                return self.deployments[deployment][0], deployment
+        deployments = [
+            d for d, (group, _) in self.deployments.items() if group == model
+        ]
+        if not deployments:
+            raise MockProviderError(f"Unknown model: {model}", status_code=400)
+        with self._lock:
+            return model, self._rng.choice(deployments)
+
+    def _content(self, messages, group: str, params: Dict[str, Any]) -> str:
+        if self.replay is not None:
+            # Same key as LLMProvider._cache_key, so a recorded response
+            # cache can be replayed
+            key = ResponseCache.completion_key(
+                group, self.groups.get(group, [group]), messages, params
+            )
+            recorded = self.replay.get(key)
+            if recorded is not None:
+                return recorded["content"]
+        return self.default_response
+
+    def _prepare(
+        self,
+        messages,
+        model: str,
+        specific_deployment: bool,
+        temperature=None,
+        n: int = 1,
+        **kwargs: Any,
+    ) -> Tuple[str, str, Dict[str, int], float, Optional[Exception]]:
+        group, deployment = self._group(model, specific_deployment)
+        settings = self.settings[deployment]
+        model = self.deployments[deployment][1]
+        content = self._content(
+            messages, group, dict(kwargs, temperature=temperature, n=n)
+        )
+        prompt_tokens = estimate_tokens(json.dumps(messages))
+        completion_tokens = settings.get("completion_tokens") or estimate_tokens(
+            content
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": n * completion_tokens,
+            "total_tokens": prompt_tokens + n * completion_tokens,
+        }
+        latency = self.latencies[deployment]
+        with self._lock:
+            delay = latency.sample(self._rng)
+            failed = self._rng.random() < settings.get("error_rate", 0.0)
+            self.requests[model] = self.requests.get(model, 0) + 1
+            if failed:
+                self.errors[model] = self.errors.get(model, 0) + 1
+        delay += latency.per_token * completion_tokens
+        error = None
+        if failed:
+            error = MockProviderError(
+                f"Mock error from {deployment}",
+                status_code=settings.get("error_status", DEFAULT_ERROR_STATUS),
+            )
+        return model, content, usage, delay, error
+
+    @staticmethod
+    def _response(
+        model: str, content: str, usage: Dict[str, int], n: int
+    ) -> Dict[str, Any]:
+        return {
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": index,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+                for index in range(n)
+            ],
+            "usage": usage,
+        }
+
+    @staticmethod
+    def _chunks(model: str, content: str, usage: Dict[str, int]):
+        response_id = f"mock-{uuid.uuid4().hex}"
+        created = int(time.time())
+        pieces = [
+            content[start : start + STREAM_CHUNK_SIZE]
+            for start in range(0, len(content), STREAM_CHUNK_SIZE)
+        ]
+        for index, piece in enumerate(pieces + [None]):
+            chunk = {
+                "id": response_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": piece},
+                        "finish_reason": None if piece is not None else "stop",
+                    }
+                ],
+            }
+            if piece is None:
+                chunk["usage"] = usage
+            yield chunk
+
+    def completion(
+        self,
+        messages,
+        model: str,
+        user: Optional[str] = None,
+        specific_deployment: bool = False,
+        stream: bool = False,
+        **kwargs: Any,
+    ):
+        model, content, usage, delay, error = self._prepare(
+            messages, model, specific_deployment, **kwargs
+        )
+        if not stream:
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return self._response(model, content, usage, kwargs.get("n", 1))
+
+        def chunks():
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            yield from self._chunks(model, content, usage)
+
+        return chunks()
+
+    async def acompletion(
+        self,
+        messages,
+        model: str,
+        user: Optional[str] = None,
+        specific_deployment: bool = False,
+        stream: bool = False,
+        **kwargs: Any,
+    ):
+        model, content, usage, delay, error = self._prepare(
+            messages, model, specific_deployment, **kwargs
+        )
+        if not stream:
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return self._response(model, content, usage, kwargs.get("n", 1))
+
+        async def chunks():
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            for chunk in self._chunks(model, content, usage):
+                yield chunk
+
+        return chunks()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors)}
@@ -1,15 +1,59 @@
 import litellm
 import os
-from typing import Dict, Optional, Any, Tuple
+import functools
+import random
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any, Set, Tuple
 from kaizen.llms.prompts.general_prompts import BASIC_SYSTEM_PROMPT
 from kaizen.utils.config import ConfigData
-from kaizen.helpers.general import retry
-from kaizen.helpers.parser import extract_json
+from kaizen.helpers.general import RetryPolicy, retry, aretry
+from kaizen.helpers.parser import JsonStreamParser, extract_json, json_stats
+from kaizen.helpers import tracing
+from kaizen.llms.tokens import TokenCounter
+from kaizen.llms.budget import Budget, BudgetExceededError, get_current_budget
+from kaizen.llms.usage import (
+    UsageTracker,
+    get_current_usage,
+    merge_usage,
+    normalize_usage,
+)
+from kaizen.llms import registry
+from kaizen.llms.routing import (
+    DEFAULT_LATENCY_WINDOW,
+    LatencyTracker,
+    ahedged_call,
+    hedged_call,
+)
+from kaizen.llms.rate_limiter import DEFAULT_RATE_LIMIT_PATH, RateLimiter
+from kaizen.llms.mock import MockRouter
+from kaizen.llms.singleflight import AsyncSingleFlight, SingleFlight
+from kaizen.llms.embeddings import (
+    DEFAULT_EMBEDDING_CACHE_PATH,
+    DEFAULT_EMBEDDING_DIMENSIONS,
+    DEFAULT_MAX_BATCH_SIZE,
+    DEFAULT_MAX_BATCH_TOKENS,
+    EmbeddingCache,
+    batch_texts,
+    text_hash,
+)
+from kaizen.llms.streaming import AsyncCompletionStream, CompletionStream
+from kaizen.llms.cache import (
+    ResponseCache,
+    DEFAULT_CACHE_PATH,
+    DEFAULT_TTL,
+    DEFAULT_MAX_ENTRIES,
+)
 from litellm import Router, embedding
 import logging
 from collections import defaultdict
 
 DEFAULT_MAX_TOKENS = 8000
+DEFAULT_HEDGE_DELAY = 10
+DEFAULT_MIN_HEDGE_DELAY = 0.5
 
 
 def set_all_loggers_to_ERROR():
@@ -35,6 +79,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Transient provider errors (rate limits, timeouts, 5xx) are retried around the
+# router calls only, so the JSON retries below do not multiply with them
+COMPLETION_RETRY_POLICY = RetryPolicy(
+    max_attempts=4, base_delay=1, max_delay=30, deadline=120
+)
+# Responses which could not be parsed even after a local repair
+JSON_RETRY_POLICY = RetryPolicy(
+    max_attempts=3, base_delay=0.1, max_delay=1, only_retry_on=(json.JSONDecodeError,)
+)
+
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+@functools.lru_cache(maxsize=64)
+def _system_message(system_prompt: str, cached: bool = False) -> Dict[str, Any]:
+    if cached:
+        content = [
+            {"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}
+        ]
+        return {"role": "system", "content": content}
+    return {"role": "system", "content": system_prompt}
+
 
 class LLMProvider:
     DEFAULT_MODEL = "gpt-4o-mini"
@@ -43,6 +110,7 @@ class LLMProvider:
     DEFAULT_MODEL_CONFIG = {"model": DEFAULT_MODEL}
     DEFAULT_MODEL_NAME = "default"
     DEFAULT_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    DEFAULT_MAX_CONCURRENT_REQUESTS = 4
 
     def __init__(
         self,
@@ -62,7 +130,10 @@ class LLMProvider:
 
         self._validate_config()
         self._setup_provider()
+        self._setup_routing()
         self._setup_observability()
+        self._setup_cache()
+        self._setup_embeddings()
         self._register_unkown_models()
 
     def _validate_config(self) -> None:
@@ -78,22 +149,99 @@ class LLMProvider:
                     "litellm_params": self.model_config,
                 }
             ]
+        # Model groups may share a model, e.g. a cheap one for small and default
+        # requests, so deployments are told apart by their `model_info.id` like
+        # the router does
+        self.models = [
+            dict(
+                model_data,
+                model_info={
+                    "id": f"{model_data['model_name']}-{index}",
+                    **model_data.get("model_info", {}),
+                },
+            )
+            for index, model_data in enumerate(self.models)
+        ]
 
     def set_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
 
+    def system_message(self, system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return the system message for `system_prompt`, or for the provider's
+        default system prompt. Messages are built once per prompt and shared
+        between requests, so they must not be mutated.
+        """
+        return _system_message(system_prompt or self.system_prompt, self.prompt_caching)
+
+    def build_messages(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        static_prefix: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Build the messages of a request.
+
+        With `prompt_caching` enabled the system prompt and `static_prefix`, the
+        start of `prompt` which is the same across requests, are marked with
+        `cache_control` so providers supporting prompt caching only process them
+        once. The variable rest of the prompt comes last.
+        """
+        if (
+            not self.prompt_caching
+            or not static_prefix
+            or not prompt.startswith(static_prefix)
+            or len(prompt) == len(static_prefix)
+        ):
+            user_content = prompt
+        else:
+            user_content = [
+                {"type": "text", "text": static_prefix, "cache_control": CACHE_CONTROL},
+                {"type": "text", "text": prompt[len(static_prefix) :]},
+            ]
+        return [
+            self.system_message(system_prompt),
+            {"role": "user", "content": user_content},
+        ]
+
     def _setup_provider(self) -> None:
         provider_kwargs = {
             "model_list": self.models,
             "allowed_fails": 1,
             "routing_strategy": "simple-shuffle",
+            # Retries are handled by COMPLETION_RETRY_POLICY
+            "num_retries": 0,
         }
 
         if self.config["language_model"].get("redis_enabled", False):
             self._setup_redis(provider_kwargs)
 
-        self.provider = Router(**provider_kwargs)
+        # Routers are shared by all providers with the same settings
+        if self.config["language_model"].get("provider") == "mock":
+            # Offline responses for load tests and benchmarks
+            self.provider = registry.get_shared(
+                "mock_router",
+                MockRouter,
+                mock=self.config["language_model"].get("mock", {}),
+                **provider_kwargs,
+            )
+        else:
+            self.provider = registry.get_shared("router", Router, **provider_kwargs)
+        # Default model, never changed afterwards so the provider can be shared
+        # across threads. Response models are reported through `usage_scope`.
         self.model = self.models[0]["litellm_params"]["model"]
+        self.max_concurrent_requests = self.config["language_model"].get(
+            "max_concurrent_requests", self.DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+        self.budget_config = self.config["language_model"].get("budget")
+        self.prompt_caching = self.config["language_model"].get("prompt_caching", False)
+        # Token counts outlive the provider, which is built per webhook
+        self.token_counter = registry.get_shared(
+            "token_counter",
+            TokenCounter,
+            estimate=self.config["language_model"].get("estimate_tokens", False),
+        )
         self.model_group_to_name = dict(
             defaultdict(
                 list,
@@ -107,6 +255,15 @@ class LLMProvider:
                 },
             )
         )
+        # Deployment ids of every model group and the model they serve
+        self.group_deployments: Dict[str, List[str]] = {}
+        self.deployment_models: Dict[str, str] = {}
+        for model_data in self.models:
+            deployment = model_data["model_info"]["id"]
+            self.group_deployments.setdefault(model_data["model_name"], []).append(
+                deployment
+            )
+            self.deployment_models[deployment] = model_data["litellm_params"]["model"]
 
     def _setup_redis(self, provider_kwargs: Dict[str, Any]) -> None:
         redis_host = os.environ.get("REDIS_HOST")
@@ -124,46 +281,723 @@ class LLMProvider:
             }
         )
 
+    def _setup_routing(self) -> None:
+        language_model = self.config["language_model"]
+        self.routing_strategy = language_model.get("routing_strategy")
+        self.hedging = language_model.get("hedged_requests", {})
+        self.latency_tracker = None
+        self.hedge_executor = None
+        self._setup_rate_limits()
+        if self.routing_strategy != "latency" and not self.hedging.get("enabled"):
+            return
+        # Latencies are tracked per deployment for the whole process, like the
+        # routers sending the requests
+        self.latency_tracker = registry.get_shared(
+            "latency_tracker",
+            LatencyTracker,
+            window=language_model.get("latency_window", DEFAULT_LATENCY_WINDOW),
+        )
+        if self.hedging.get("enabled"):
+            self.hedge_executor = registry.get_shared(
+                "hedge_executor",
+                ThreadPoolExecutor,
+                max_workers=2 * self.max_concurrent_requests,
+                thread_name_prefix="kaizen-hedge",
+            )
+
+    def _setup_rate_limits(self) -> None:
+        # Requests and tokens per minute of each deployment
+        self.deployment_limits: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        for model_data in self.models:
+            model_info = model_data.get("model_info", {})
+            litellm_params = model_data["litellm_params"]
+            rpm = model_info.get("rpm") or litellm_params.get("rpm")
+            tpm = model_info.get("tpm") or litellm_params.get("tpm")
+            if rpm or tpm:
+                self.deployment_limits[model_info["id"]] = (rpm, tpm)
+
+        self.rate_limiter = None
+        if self.deployment_limits:
+            limiter_config = self.config["language_model"].get("rate_limiter", {})
+            self.rate_limiter = registry.get_shared(
+                "rate_limiter",
+                RateLimiter,
+                backend=limiter_config.get("backend", "memory"),
+                path=limiter_config.get("path", DEFAULT_RATE_LIMIT_PATH),
+            )
+
     def _setup_observability(self) -> None:
         if self.config["language_model"].get("enable_observability_logging", False):
             litellm.success_callback = [self.callback_obj]
             litellm.failure_callback = [self.callback_obj]
 
-    def _register_unkown_models(self) -> None:
+    def _setup_cache(self) -> None:
+        cache_config = self.config["language_model"].get("response_cache", {})
+        self.response_cache = None
+        if cache_config.get("enabled", False):
+            self.response_cache = registry.get_shared(
+                "response_cache",
+                ResponseCache,
+                path=os.path.expanduser(cache_config.get("path", DEFAULT_CACHE_PATH)),
+                ttl=cache_config.get("ttl", DEFAULT_TTL),
+                max_entries=cache_config.get("max_entries", DEFAULT_MAX_ENTRIES),
+            )
+        # Identical completions running at the same time, e.g. for duplicate
+        # webhooks of a PR, share one request across the whole process
+        self.coalesce_requests = self.config["language_model"].get(
+            "coalesce_requests", True
+        )
+        self.singleflight = registry.get_shared("singleflight", SingleFlight)
+        self.async_singleflight = registry.get_shared(
+            "async_singleflight", AsyncSingleFlight
+        )
+
+    def _setup_embeddings(self) -> None:
+        # The embedding model and its limits are resolved once per provider
+        self.embedding_model = None
         for model_data in self.models:
-            model_info = model_data.get("model_info", {})
-            if "litellm_provider" in model_info:
-                # Register this model
-                litellm.register_model({model_data["model_name"]: model_info})
+            if model_data["model_name"] == "embedding":
+                model_info = model_data.get("model_info", {})
+                litellm_params = model_data["litellm_params"]
+                self.embedding_model = litellm_params["model"]
+                # Credentials and endpoint of the deployment, limits are applied
+                # by the rate limiter
+                self.embedding_params = {
+                    key: value
+                    for key, value in litellm_params.items()
+                    if key not in ("rpm", "tpm")
+                }
+                self.embedding_deployment = model_info["id"]
+                self.embedding_dimensions = model_info.get(
+                    "dimensions",
+                    litellm_params.get("dimensions", DEFAULT_EMBEDDING_DIMENSIONS),
+                )
+                self.embedding_batch_size = model_info.get(
+                    "max_batch_size", DEFAULT_MAX_BATCH_SIZE
+                )
+                self.embedding_batch_tokens = model_info.get(
+                    "max_batch_tokens", DEFAULT_MAX_BATCH_TOKENS
+                )
+                break
+        self.embedding_cache_config = self.config["language_model"].get(
+            "embedding_cache", {}
+        )
+
+    def _get_embedding_cache(self) -> Optional[EmbeddingCache]:
+        # Created on first use so providers that never embed do not open it
+        if not self.embedding_cache_config.get("enabled", True):
+            return None
+        return registry.get_shared(
+            "embedding_cache",
+            EmbeddingCache,
+            path=os.path.expanduser(
+                self.embedding_cache_config.get("path", DEFAULT_EMBEDDING_CACHE_PATH)
+            ),
+        )
+
+    def _register_unkown_models(self) -> None:
+        registry.register_models_once(self.models, litellm.register_model)
+
+    def router_completion(self, messages, user, custom_model):
+        return self._router_completion(messages, user, custom_model)[0]
 
     async def router_acompletion(self, messages, user, custom_model):
-        response = await self.provider.acompletion(
-            messages=messages, user=user, **custom_model
+        return (await self._router_acompletion(messages, user, custom_model))[0]
+
+    def _router_completion(self, messages, user, custom_model):
+        """Return the response and the model settings it was requested with."""
+        custom_model, budget, reservation = self._reserve_budget(messages, custom_model)
+        try:
+            response = self._send_completion(messages, user, custom_model)
+        except Exception:
+            self._settle_budget(budget, reservation)
+            raise
+        self._settle_budget(
+            budget, reservation, None if custom_model.get("stream") else response
         )
-        return response
+        return response, custom_model
 
-    def chat_completion(
+    async def _router_acompletion(self, messages, user, custom_model):
+        custom_model, budget, reservation = self._reserve_budget(messages, custom_model)
+        try:
+            response = await self._asend_completion(messages, user, custom_model)
+        except Exception:
+            self._settle_budget(budget, reservation)
+            raise
+        self._settle_budget(
+            budget, reservation, None if custom_model.get("stream") else response
+        )
+        return response, custom_model
+
+    def _send_completion(self, messages, user, custom_model):
+        # Deployments which failed are tried last by the retries
+        return self._attempt_completion(messages, user, custom_model, set())
+
+    @retry(policy=COMPLETION_RETRY_POLICY)
+    def _attempt_completion(self, messages, user, custom_model, failed: Set[str]):
+        tokens = self._rate_limit_tokens(messages, custom_model)
+        deployments = self._rank_deployments(custom_model, tokens, failed)
+        if not deployments:
+            with tracing.span("llm.request", model=custom_model.get("model")):
+                return self.provider.completion(
+                    messages=messages, user=user, **custom_model
+                )
+
+        def call(deployment):
+            limits = self.deployment_limits.get(deployment)
+            if limits:
+                waited = self.rate_limiter.acquire(deployment, *limits, tokens=tokens)
+                tracing.record("llm.queue", waited, model=deployment)
+            start = time.monotonic()
+            try:
+                with tracing.span("llm.request", model=deployment):
+                    # The router sends requests for a deployment id to that
+                    # deployment, retries are up to `_rank_deployments`
+                    response = self.provider.completion(
+                        messages=messages,
+                        user=user,
+                        **dict(custom_model, model=deployment),
+                    )
+            except Exception:
+                failed.add(deployment)
+                raise
+            self._record_deployment(deployment, custom_model, response, start)
+            return response
+
+        if self.hedge_executor is None or custom_model.get("stream"):
+            return call(deployments[0])
+        return hedged_call(
+            call,
+            deployments,
+            self._hedge_delay(deployments[0]),
+            self.hedge_executor,
+            on_discard=self._discarded_response_handler(),
+        )
+
+    async def _asend_completion(self, messages, user, custom_model):
+        return await self._aattempt_completion(messages, user, custom_model, set())
+
+    @aretry(policy=COMPLETION_RETRY_POLICY)
+    async def _aattempt_completion(
+        self, messages, user, custom_model, failed: Set[str]
+    ):
+        tokens = self._rate_limit_tokens(messages, custom_model)
+        deployments = self._rank_deployments(custom_model, tokens, failed)
+        if not deployments:
+            with tracing.span("llm.request", model=custom_model.get("model")):
+                return await self.provider.acompletion(
+                    messages=messages, user=user, **custom_model
+                )
+
+        async def call(deployment):
+            limits = self.deployment_limits.get(deployment)
+            if limits:
+                waited = await self.rate_limiter.aacquire(
+                    deployment, *limits, tokens=tokens
+                )
+                tracing.record("llm.queue", waited, model=deployment)
+            start = time.monotonic()
+            try:
+                with tracing.span("llm.request", model=deployment):
+                    response = await self.provider.acompletion(
+                        messages=messages,
+                        user=user,
+                        **dict(custom_model, model=deployment),
+                    )
+            except Exception:
+                failed.add(deployment)
+                raise
+            self._record_deployment(deployment, custom_model, response, start)
+            return response
+
+        if self.hedge_executor is None or custom_model.get("stream"):
+            return await call(deployments[0])
+        return await ahedged_call(
+            call,
+            deployments,
+            self._hedge_delay(deployments[0]),
+            on_discard=self._discarded_response_handler(),
+        )
+
+    def _group_deployments(self, custom_model: Dict[str, Any]) -> List[str]:
+        return list(self.group_deployments.get(custom_model.get("model"), []))
+
+    def _discarded_response_handler(self) -> Callable[[Any], None]:
+        """
+        Return a callback charging the losing response of a hedged request to
+        the usage tracker and budget of the current context. A losing thread
+        may finish after the request returned, when the context is no longer
+        active.
+        """
+        tracker, budget = get_current_usage(), get_current_budget()
+
+        def on_discard(response) -> None:
+            usage = normalize_usage(response["usage"])
+            costs = self._record_usage(usage, response["model"], tracker)
+            if budget is not None:
+                budget.settle((0, 0.0, 0), usage, sum(costs))
+
+        return on_discard
+
+    def _rate_limit_tokens(self, messages, custom_model: Dict[str, Any]) -> int:
+        if not any(
+            deployment in self.deployment_limits
+            for deployment in self._group_deployments(custom_model)
+        ):
+            return 0
+        return self.token_counter.count(
+            json.dumps(messages), self.DEFAULT_MODEL, estimate=True
+        )
+
+    def _rank_deployments(
+        self,
+        custom_model: Dict[str, Any],
+        tokens: int,
+        failed: Optional[Set[str]] = None,
+    ) -> List[str]:
+        """
+        Return the deployments of the requested model group in the order they
+        should be tried, or an empty list to let the router pick one. Retries
+        move on to the deployments which have not `failed` yet.
+        """
+        if self.latency_tracker is None and not self.deployment_limits:
+            return []
+        deployments = self._group_deployments(custom_model)
+        limited = any(d in self.deployment_limits for d in deployments)
+        if not limited and (len(deployments) < 2 or custom_model.get("stream")):
+            return []
+        # Deployments the ranking cannot tell apart share the load, like the
+        # router's simple shuffle, instead of filling up the first one
+        random.shuffle(deployments)
+        if self.latency_tracker is not None:
+            deployments = self.latency_tracker.rank(deployments)
+        if limited:
+            # Prefer deployments with room left, the sort keeps the latency order
+            deployments.sort(
+                key=lambda deployment: self.rate_limiter.wait_time(
+                    deployment,
+                    *self.deployment_limits.get(deployment, (None, None)),
+                    tokens,
+                )
+            )
+        if failed:
+            deployments.sort(key=lambda deployment: deployment in failed)
+        return deployments
+
+    def _record_deployment(
+        self, deployment: str, custom_model: Dict[str, Any], response, start: float
+    ) -> None:
+        # A stream returns before the response is generated
+        if custom_model.get("stream"):
+            return
+        if self.latency_tracker is not None:
+            self.latency_tracker.record(deployment, time.monotonic() - start)
+        limits = self.deployment_limits.get(deployment)
+        if limits and limits[1]:
+            completion_tokens = dict(response["usage"]).get("completion_tokens") or 0
+            self.rate_limiter.consume(deployment, limits[1], completion_tokens)
+
+    def _hedge_delay(self, deployment: str) -> float:
+        # Hedge once the primary is slower than it usually is
+        delay = self.latency_tracker.percentile(
+            deployment, self.hedging.get("percentile", 95)
+        )
+        if delay is None:
+            return self.hedging.get("delay", DEFAULT_HEDGE_DELAY)
+        return max(delay, self.hedging.get("min_delay", DEFAULT_MIN_HEDGE_DELAY))
+
+    def get_model_name(self) -> str:
+        """Return the model of the last response in the current `usage_scope`."""
+        tracker = get_current_usage()
+        if tracker is not None and tracker.model:
+            return tracker.model
+        return self.model
+
+    def new_budget(self, budget: Optional[Budget] = None) -> Optional[Budget]:
+        """
+        Return the budget for a review or other unit of work: `budget`, the one
+        of the current `budget_scope`, or a new one from the configuration.
+        """
+        return budget or get_current_budget() or Budget.from_config(self.budget_config)
+
+    def get_budget(self) -> Optional[Budget]:
+        """
+        Return the budget of the current `budget_scope`. Outside of one the
+        configured limits apply to each request on its own.
+        """
+        return self.new_budget()
+
+    def _estimate_request(
+        self, messages, custom_model: Dict[str, Any]
+    ) -> Tuple[int, float]:
+        model_group = custom_model.get("model")
+        model_name = self.model_group_to_name.get(model_group, [model_group])[0]
+        prompt_tokens = self.token_counter.count_messages(messages, model_name)
+        if prompt_tokens is None:
+            prompt_tokens = self.token_counter.count(
+                json.dumps(messages), self.DEFAULT_MODEL, estimate=True
+            )
+        prompt_cost, completion_cost = self.get_usage_cost(
+            {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": custom_model.get("max_tokens") or 0,
+            },
+            model=model_name,
+        )
+        return prompt_tokens, prompt_cost + completion_cost
+
+    def _reserve_budget(self, messages, custom_model: Dict[str, Any]):
+        budget = self.get_budget()
+        if budget is None:
+            return custom_model, None, None
+
+        custom_model = dict(custom_model)
+        downgrade_model = budget.downgrade_model
+        if (
+            downgrade_model
+            and custom_model.get("model") != downgrade_model
+            and budget.should_downgrade()
+        ):
+            self.logger.info(f"Budget nearly spent, downgrading to {downgrade_model}")
+            custom_model["model"] = downgrade_model
+        try:
+            reservation = budget.reserve(
+                *self._estimate_request(messages, custom_model),
+                completion_tokens=custom_model.get("max_tokens"),
+            )
+        except BudgetExceededError:
+            if not downgrade_model or custom_model.get("model") == downgrade_model:
+                raise
+            self.logger.info(f"Request over budget, downgrading to {downgrade_model}")
+            custom_model["model"] = downgrade_model
+            reservation = budget.reserve(
+                *self._estimate_request(messages, custom_model),
+                completion_tokens=custom_model.get("max_tokens"),
+            )
+
+        if budget.max_completion_tokens is not None:
+            custom_model["max_tokens"] = reservation[2]
+        return custom_model, budget, reservation
+
+    def _settle_budget(self, budget: Optional[Budget], reservation, response=None):
+        if response is None:
+            if budget is not None:
+                budget.settle(reservation)
+            return
+        usage = normalize_usage(response["usage"])
+        costs = self._record_usage(usage, response["model"])
+        if budget is not None:
+            budget.settle(reservation, usage, sum(costs))
+
+    def _record_usage(
+        self,
+        usage: Dict[str, int],
+        model: Optional[str],
+        tracker: Optional[UsageTracker] = None,
+    ) -> Tuple[float, float]:
+        """Add a response to the usage tracker of the current context."""
+        costs = self.get_usage_cost(usage, model=model)
+        tracker = tracker or get_current_usage()
+        if tracker is not None:
+            tracker.add(usage, model, *costs)
+        return costs
+
+    def _prepare_request(
         self,
         prompt,
-        user: str = None,
         model="default",
         custom_model=None,
         messages=None,
-    ) -> Tuple[str, Dict[str, int]]:
+        system_prompt: Optional[str] = None,
+    ) -> Tuple[list, Dict[str, Any]]:
         if not messages:
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt},
-            ]
-        if not custom_model:
-            custom_model = {"model": model}
+            messages = self.build_messages(prompt, system_prompt)
+        custom_model = dict(custom_model) if custom_model else {"model": model}
         if "temperature" not in custom_model:
             custom_model["temperature"] = self.default_temperature
-        response = self.provider.completion(
-            messages=messages, user=user, **custom_model
+        return messages, custom_model
+
+    def _cache_key(self, messages, custom_model: Dict[str, Any]) -> str:
+        model_group = custom_model.get("model")
+        return ResponseCache.completion_key(
+            model_group,
+            self.model_group_to_name.get(model_group, [model_group]),
+            messages,
+            custom_model,
         )
-        self.model = response["model"]
-        return response["choices"][0]["message"]["content"], response["usage"]
+
+    def _sent_cache_key(
+        self,
+        cache_key: Optional[str],
+        messages,
+        custom_model: Dict[str, Any],
+        sent_model: Dict[str, Any],
+    ) -> Optional[str]:
+        """
+        Return the cache key of the request actually sent. A response of the
+        cheaper model the budget downgraded to must not answer requests for
+        the original model once the budget pressure is gone.
+        """
+        if not cache_key or custom_model.get("model") == sent_model.get("model"):
+            return cache_key
+        return self._cache_key(messages, sent_model)
+
+    def _lookup_cache(
+        self, messages, custom_model: Dict[str, Any], use_cache: bool
+    ) -> Tuple[Optional[str], Optional[Tuple[str, Dict[str, int], str]]]:
+        if not use_cache or not self.response_cache:
+            return None, None
+        cache_key = self._cache_key(messages, custom_model)
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        self.logger.debug("Serving chat completion from response cache")
+        usage = self._reused_usage(cached["model"])
+        return cache_key, (cached["content"], usage, cached["model"])
+
+    def _reused_usage(self, model: str) -> Dict[str, int]:
+        # A reused response costs nothing, only its model is recorded
+        usage = dict(self.DEFAULT_USAGE)
+        tracker = get_current_usage()
+        if tracker is not None:
+            tracker.add(usage, model)
+        return usage
+
+    def _coalesce_key(
+        self,
+        messages,
+        custom_model: Dict[str, Any],
+        cache_key: Optional[str],
+        use_cache: bool,
+    ) -> Optional[str]:
+        # Callers asking for a fresh response do not wait for another request
+        if not use_cache or not self.coalesce_requests:
+            return None
+        return cache_key or self._cache_key(messages, custom_model)
+
+    def invalidate_cached_completion(
+        self,
+        prompt,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+    ) -> None:
+        if not self.response_cache:
+            return
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
+        self.response_cache.delete(self._cache_key(messages, custom_model))
+
+    def chat_completion(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Tuple[str, Dict[str, int]]:
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
+        cache_key, cached = self._lookup_cache(messages, custom_model, use_cache)
+        if cached is not None:
+            return cached[:2]
+
+        def complete():
+            response, sent_model = self._router_completion(messages, user, custom_model)
+            content = response["choices"][0]["message"]["content"]
+            key = self._sent_cache_key(cache_key, messages, custom_model, sent_model)
+            if key:
+                self.response_cache.set(
+                    key, {"content": content, "model": response["model"]}
+                )
+            return content, normalize_usage(response["usage"]), response["model"]
+
+        key = self._coalesce_key(messages, custom_model, cache_key, use_cache)
+        if key is None:
+            return complete()[:2]
+        (content, usage, model), shared = self.singleflight.do(key, complete)
+        if shared:
+            self.logger.debug("Sharing in-flight chat completion")
+            return content, self._reused_usage(model)
+        return content, usage
+
+    async def achat_completion(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Tuple[str, Dict[str, int]]:
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
+        cache_key, cached = self._lookup_cache(messages, custom_model, use_cache)
+        if cached is not None:
+            return cached[:2]
+
+        async def complete():
+            response, sent_model = await self._router_acompletion(
+                messages, user, custom_model
+            )
+            content = response["choices"][0]["message"]["content"]
+            key = self._sent_cache_key(cache_key, messages, custom_model, sent_model)
+            if key:
+                self.response_cache.set(
+                    key, {"content": content, "model": response["model"]}
+                )
+            return content, normalize_usage(response["usage"]), response["model"]
+
+        key = self._coalesce_key(messages, custom_model, cache_key, use_cache)
+        if key is None:
+            return (await complete())[:2]
+        (content, usage, model), shared = await self.async_singleflight.do(
+            key, complete
+        )
+        if shared:
+            self.logger.debug("Sharing in-flight chat completion")
+            return content, self._reused_usage(model)
+        return content, usage
+
+    def _on_stream_complete(
+        self, cache_key: Optional[str], budget: Optional[Budget], reservation
+    ) -> Callable[[CompletionStream], None]:
+        # The usage of a stream is only known once it has been read, so its
+        # budget reservation is held until then
+        tracker = get_current_usage()
+
+        def on_complete(stream: CompletionStream) -> None:
+            if stream.usage:
+                costs = self._record_usage(stream.usage, stream.model, tracker)
+                if budget is not None:
+                    budget.settle(reservation, stream.usage, sum(costs))
+            elif budget is not None:
+                budget.settle(reservation)
+            # An aborted response is incomplete, only its usage counts
+            if cache_key and not stream.aborted:
+                self.response_cache.set(
+                    cache_key, {"content": stream.content, "model": stream.model}
+                )
+
+        return on_complete
+
+    def chat_completion_stream(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> CompletionStream:
+        """
+        Stream a chat completion. Iterate the returned stream for the text as it
+        is generated, `content` and `usage` are set once it has been consumed.
+        """
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
+        cache_key, cached = self._lookup_cache(messages, custom_model, use_cache)
+        if cached is not None:
+            return CompletionStream.from_content(*cached)
+
+        requested = custom_model
+        custom_model, budget, reservation = self._reserve_budget(
+            messages, dict(custom_model, stream=True)
+        )
+        try:
+            response = self._send_completion(messages, user, custom_model)
+        except Exception:
+            self._settle_budget(budget, reservation)
+            raise
+        return CompletionStream(
+            response,
+            messages,
+            on_complete=self._on_stream_complete(
+                self._sent_cache_key(cache_key, messages, requested, custom_model),
+                budget,
+                reservation,
+            ),
+        )
+
+    async def achat_completion_stream(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> AsyncCompletionStream:
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
+        cache_key, cached = self._lookup_cache(messages, custom_model, use_cache)
+        if cached is not None:
+            return AsyncCompletionStream.from_content(*cached)
+
+        requested = custom_model
+        custom_model, budget, reservation = self._reserve_budget(
+            messages, dict(custom_model, stream=True)
+        )
+        try:
+            response = await self._asend_completion(messages, user, custom_model)
+        except Exception:
+            self._settle_budget(budget, reservation)
+            raise
+        return AsyncCompletionStream(
+            response,
+            messages,
+            on_complete=self._on_stream_complete(
+                self._sent_cache_key(cache_key, messages, requested, custom_model),
+                budget,
+                reservation,
+            ),
+        )
+
+    def _read_json_stream(
+        self, stream: CompletionStream, on_item: Optional[Callable[[Any], None]]
+    ) -> Tuple[str, Dict[str, int]]:
+        json_parser = JsonStreamParser()
+        try:
+            with tracing.span("llm.stream"):
+                for delta in stream:
+                    for item in json_parser.feed(delta):
+                        if on_item:
+                            on_item(item)
+        except json.JSONDecodeError as e:
+            self.logger.warning(f"Abandoning malformed streamed completion: {e.msg}")
+            raise
+        finally:
+            # Settles the usage read so far when reading stopped early
+            stream.close()
+        return stream.content, stream.usage
+
+    async def _aread_json_stream(
+        self, stream: AsyncCompletionStream, on_item: Optional[Callable[[Any], None]]
+    ) -> Tuple[str, Dict[str, int]]:
+        json_parser = JsonStreamParser()
+        try:
+            with tracing.span("llm.stream"):
+                async for delta in stream:
+                    for item in json_parser.feed(delta):
+                        if on_item:
+                            on_item(item)
+        except json.JSONDecodeError as e:
+            self.logger.warning(f"Abandoning malformed streamed completion: {e.msg}")
+            raise
+        finally:
+            await stream.aclose()
+        return stream.content, stream.usage
 
     def raw_chat_completion(
         self,
@@ -172,26 +1006,20 @@ class LLMProvider:
         model="default",
         custom_model=None,
         messages=None,
+        system_prompt: Optional[str] = None,
         n_choices=1,
     ) -> Tuple[Dict, Dict[str, int]]:
+        messages, custom_model = self._prepare_request(
+            prompt, model, custom_model, messages, system_prompt
+        )
         custom_model["n"] = n_choices
-        if not messages:
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt},
-            ]
-        if not custom_model:
-            custom_model = {"model": model}
-        if "temperature" not in custom_model:
-            custom_model["temperature"] = self.default_temperature
 
-        response = self.provider.completion(
-            messages=messages, user=user, **custom_model
+        response = self.router_completion(
+            messages=messages, user=user, custom_model=custom_model
         )
-        self.model = response["model"]
-        return response, response["usage"]
+        return response, normalize_usage(response["usage"])
 
-    @retry(max_attempts=3, delay=0.1)
+    @retry(policy=JSON_RETRY_POLICY)
     def chat_completion_with_json(
         self,
         prompt,
@@ -199,51 +1027,182 @@ class LLMProvider:
         model="default",
         custom_model=None,
         messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        stream: bool = False,
+        on_item: Optional[Callable[[Any], None]] = None,
     ):
+        """
+        Request a completion and parse the JSON object in it.
+
+        With `stream=True` the response is validated while it arrives, a clearly
+        malformed response is abandoned right away instead of being read to the
+        end, and `on_item` is called with every finished entry of the arrays in
+        the response (e.g. each review issue) before the full response is done.
+        """
+        if stream:
+            response, usage = self._read_json_stream(
+                self.chat_completion_stream(
+                    prompt=prompt,
+                    user=user,
+                    model=model,
+                    custom_model=custom_model,
+                    messages=messages,
+                    system_prompt=system_prompt,
+                    use_cache=use_cache,
+                ),
+                on_item,
+            )
+        else:
+            response, usage = self.chat_completion(
+                prompt=prompt,
+                user=user,
+                model=model,
+                custom_model=custom_model,
+                messages=messages,
+                system_prompt=system_prompt,
+                use_cache=use_cache,
+            )
+        # logger.info(f"completiong response: {response}")
+        try:
+            with tracing.span("llm.parse_json"):
+                response = extract_json(response)
+        except Exception:
+            # Local repair failed, the retry decorator requests a new completion
+            self.logger.warning(
+                f"Could not parse JSON from completion, stats: {dict(json_stats)}"
+            )
+            # Never keep serving a response we could not parse
+            if use_cache:
+                self.invalidate_cached_completion(
+                    prompt,
+                    model=model,
+                    custom_model=custom_model,
+                    messages=messages,
+                    system_prompt=system_prompt,
+                )
+            raise
+        return response, usage
+
+    def chat_completion_with_retry(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ):
+        # Kept for existing callers, the completion itself already retries
+        # transient provider errors with COMPLETION_RETRY_POLICY
         response, usage = self.chat_completion(
             prompt=prompt,
             user=user,
             model=model,
             custom_model=custom_model,
             messages=messages,
+            system_prompt=system_prompt,
+            use_cache=use_cache,
         )
-        # logger.info(f"completiong response: {response}")
-        response = extract_json(response)
         return response, usage
 
-    @retry(max_attempts=3, delay=0.1)
-    def chat_completion_with_retry(
+    @aretry(policy=JSON_RETRY_POLICY)
+    async def achat_completion_with_json(
         self,
         prompt,
         user: str = None,
         model="default",
         custom_model=None,
         messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        stream: bool = False,
+        on_item: Optional[Callable[[Any], None]] = None,
     ):
-        response, usage = self.chat_completion(
+        if stream:
+            response, usage = await self._aread_json_stream(
+                await self.achat_completion_stream(
+                    prompt=prompt,
+                    user=user,
+                    model=model,
+                    custom_model=custom_model,
+                    messages=messages,
+                    system_prompt=system_prompt,
+                    use_cache=use_cache,
+                ),
+                on_item,
+            )
+        else:
+            response, usage = await self.achat_completion(
+                prompt=prompt,
+                user=user,
+                model=model,
+                custom_model=custom_model,
+                messages=messages,
+                system_prompt=system_prompt,
+                use_cache=use_cache,
+            )
+        try:
+            with tracing.span("llm.parse_json"):
+                response = extract_json(response)
+        except Exception:
+            # Local repair failed, the retry decorator requests a new completion
+            self.logger.warning(
+                f"Could not parse JSON from completion, stats: {dict(json_stats)}"
+            )
+            if use_cache:
+                self.invalidate_cached_completion(
+                    prompt,
+                    model=model,
+                    custom_model=custom_model,
+                    messages=messages,
+                    system_prompt=system_prompt,
+                )
+            raise
+        return response, usage
+
+    async def achat_completion_with_retry(
+        self,
+        prompt,
+        user: str = None,
+        model="default",
+        custom_model=None,
+        messages=None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+    ):
+        # Kept for existing callers, the completion itself already retries
+        # transient provider errors with COMPLETION_RETRY_POLICY
+        response, usage = await self.achat_completion(
             prompt=prompt,
             user=user,
             model=model,
             custom_model=custom_model,
             messages=messages,
+            system_prompt=system_prompt,
+            use_cache=use_cache,
         )
         return response, usage
 
-    def is_inside_token_limit(self, PROMPT: str, percentage: float = 0.8) -> bool:
+    def _get_max_tokens(self, model: str) -> int:
+        max_tokens = self.token_counter.max_tokens(model)
+        if not max_tokens:
+            max_tokens = DEFAULT_MAX_TOKENS
+        return max_tokens
+
+    def is_inside_token_limit(
+        self, PROMPT: str, percentage: float = 0.8, system_prompt: Optional[str] = None
+    ) -> bool:
         # Include system prompt in token calculation
         messages = [
-            {"role": "system", "content": self.system_prompt},
+            self.system_message(system_prompt),
             {"role": "user", "content": PROMPT},
         ]
-        token_count = litellm.token_counter(model=self.model, messages=messages)
+        token_count = self.token_counter.count_messages(messages, self.model)
         if token_count is None:
-            token_count = litellm.token_counter(model=self.DEFAULT_MODEL, text=PROMPT)
-        try:
-            max_tokens = litellm.get_max_tokens(self.model)
-        except Exception:
-            max_tokens = DEFAULT_MAX_TOKENS
-        if not max_tokens:
-            max_tokens = DEFAULT_MAX_TOKENS
+            token_count = self.token_counter.count(PROMPT, self.DEFAULT_MODEL)
+        max_tokens = self._get_max_tokens(self.model)
         return token_count <= max_tokens * percentage
 
     def available_tokens(
@@ -251,27 +1210,26 @@ class LLMProvider:
     ) -> int:
         if not model:
             model = self.model
-        try:
-            max_tokens = litellm.get_max_tokens(model)
-        except Exception:
-            max_tokens = DEFAULT_MAX_TOKENS
-        used_tokens = litellm.token_counter(model=model, text=message)
-        if max_tokens:
-            return int(max_tokens * percentage) - used_tokens
-        else:
-            return DEFAULT_MAX_TOKENS - used_tokens
+        max_tokens = self._get_max_tokens(model)
+        used_tokens = self.token_counter.count(message, model)
+        return int(max_tokens * percentage) - used_tokens
 
-    def get_token_count(self, message: str, model: str = None) -> int:
+    def get_token_count(
+        self, message: str, model: str = None, estimate: Optional[bool] = None
+    ) -> int:
+        """
+        Count the tokens of `message`. Counts are cached per model and text;
+        pass `estimate=True` for a cheap byte-length based estimate, e.g. to
+        pre-filter content before counting it exactly.
+        """
         if not model:
             model = self.model
-        return litellm.token_counter(model=model, text=message)
+        return self.token_counter.count(message, model, estimate=estimate)
 
     def update_usage(
         self, total_usage: Optional[Dict[str, int]], current_usage: Dict[str, int]
     ) -> Dict[str, int]:
-        if total_usage is not None:
-            return {key: total_usage[key] + current_usage[key] for key in total_usage}
-        return {key: current_usage[key] for key in current_usage}
+        return merge_usage(total_usage, current_usage)
 
     def get_usage_cost(
         self, total_usage: Dict[str, int], model: str = None
@@ -286,11 +1244,134 @@ class LLMProvider:
             return 0, 0
 
     def get_text_embedding(self, text):
-        for model in self.config["language_model"]["models"]:
-            if model["model_name"] == "embedding":
-                model_name = model["litellm_params"]["model"]
-                break
-        response = embedding(
-            model=model_name, input=[text], dimensions=1536, encoding_format="float"
+        vectors, usage = self.get_text_embeddings([text])
+        data = [{"object": "embedding", "index": 0, "embedding": vectors[0]}]
+        return data, usage
+
+    def _plan_embeddings(
+        self, texts: List[str]
+    ) -> Tuple[List[str], Dict[str, List[float]], List[List[str]]]:
+        """
+        Return the hashes of `texts`, the vectors found in the embedding cache
+        and the batches of remaining texts, each embedded only once.
+        """
+        if not self.embedding_model:
+            raise ValueError("Missing 'embedding' model in configuration")
+        hashes = [text_hash(text) for text in texts]
+        cache = self._get_embedding_cache()
+        vectors = {}
+        if cache is not None:
+            vectors = cache.get_many(
+                self.embedding_model, self.embedding_dimensions, hashes
+            )
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missing_texts = list(missing.values())
+        batches = batch_texts(
+            missing_texts,
+            lambda text: self.get_token_count(text, self.embedding_model),
+            max_batch_size=self.embedding_batch_size,
+            max_batch_tokens=self.embedding_batch_tokens,
         )
-        return response["data"], response["usage"]
+        self.logger.debug(
+            f"Embedding {len(missing_texts)} of {len(texts)} texts "
+            f"in {len(batches)} batches"
+        )
+        return hashes, vectors, [[missing_texts[i] for i in b] for b in batches]
+
+    def _embedding_kwargs(self, batch: List[str]) -> Dict[str, Any]:
+        return dict(
+            self.embedding_params,
+            input=batch,
+            dimensions=self.embedding_dimensions,
+            encoding_format="float",
+        )
+
+    def _embedding_tokens(self, batch: List[str]) -> int:
+        # Counted while planning the batches, so these come from the cache
+        return sum(self.get_token_count(text, self.embedding_model) for text in batch)
+
+    @retry(policy=COMPLETION_RETRY_POLICY)
+    def _embed_batch(self, batch: List[str]):
+        limits = self.deployment_limits.get(self.embedding_deployment)
+        if limits:
+            waited = self.rate_limiter.acquire(
+                self.embedding_deployment, *limits, tokens=self._embedding_tokens(batch)
+            )
+            tracing.record("llm.queue", waited, model=self.embedding_deployment)
+        return embedding(**self._embedding_kwargs(batch))
+
+    @aretry(policy=COMPLETION_RETRY_POLICY)
+    async def _aembed_batch(self, batch: List[str]):
+        limits = self.deployment_limits.get(self.embedding_deployment)
+        if limits:
+            waited = await self.rate_limiter.aacquire(
+                self.embedding_deployment, *limits, tokens=self._embedding_tokens(batch)
+            )
+            tracing.record("llm.queue", waited, model=self.embedding_deployment)
+        return await litellm.aembedding(**self._embedding_kwargs(batch))
+
+    def _finish_embeddings(
+        self,
+        hashes: List[str],
+        vectors: Dict[str, List[float]],
+        batches: List[List[str]],
+        responses: List[Any],
+    ) -> Tuple[List[List[float]], Dict[str, int]]:
+        usage = dict(self.DEFAULT_USAGE)
+        new_vectors = {}
+        for batch, response in zip(batches, responses):
+            for item in response["data"]:
+                new_vectors[text_hash(batch[item["index"]])] = item["embedding"]
+            usage = merge_usage(usage, normalize_usage(response["usage"]))
+        if new_vectors:
+            cache = self._get_embedding_cache()
+            if cache is not None:
+                cache.set_many(
+                    self.embedding_model, self.embedding_dimensions, new_vectors
+                )
+            self._record_usage(usage, self.embedding_model)
+        vectors.update(new_vectors)
+        return [vectors[key] for key in hashes], usage
+
+    def get_text_embeddings(
+        self, texts: List[str]
+    ) -> Tuple[List[List[float]], Dict[str, int]]:
+        """
+        Embed `texts`, returning one vector per text and the usage of the
+        requests sent.
+
+        Texts are split into batches within the provider's input and token
+        limits, and up to `max_concurrent_requests` batches are sent at once.
+        Batches are retried and rate limited like completions. Texts already in
+        the embedding cache are not sent again.
+        """
+        hashes, vectors, batches = self._plan_embeddings(texts)
+        responses = []
+        if batches:
+            workers = min(len(batches), self.max_concurrent_requests)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Queue time is recorded in the caller's timing scope
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run, self._embed_batch, batch
+                    )
+                    for batch in batches
+                ]
+                responses = [future.result() for future in futures]
+        return self._finish_embeddings(hashes, vectors, batches, responses)
+
+    async def aget_text_embeddings(
+        self, texts: List[str]
+    ) -> Tuple[List[List[float]], Dict[str, int]]:
+        hashes, vectors, batches = self._plan_embeddings(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def embed(batch):
+            async with semaphore:
+                return await self._aembed_batch(batch)
+
+        responses = await asyncio.gather(*(embed(batch) for batch in batches))
+        return self._finish_embeddings(hashes, vectors, batches, responses)
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT_PATH = os.path.expanduser("~/.kaizen/cache/rate_limits.db")
+
+# (bucket key, amount to take, capacity, refill rate per second)
+Bucket = Tuple[str, float, float, float]
+
+
+def _wait_time(level: float, amount: float, capacity: float, rate: float) -> float:
+    # A request bigger than the whole bucket only waits for a full bucket
+    missing = min(amount, capacity) - level
+    return max(0.0, missing / rate)
+
+
+class MemoryBackend:
+    """Token buckets of the current process."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(
+        self, buckets: List[Bucket], force: bool = False, dry_run: bool = False
+    ) -> float:
+        """
+        Take `amount` from every bucket if all of them have enough, otherwise
+        return the seconds to wait before trying again. With `force` the
+        amounts are taken anyway, possibly leaving buckets negative, with
+        `dry_run` nothing is taken.
+        """
+        now = time.time()
+        with self._lock:
+            levels = []
+            for key, amount, capacity, rate in buckets:
+                level, updated_at = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, level + (now - updated_at) * rate))
+            wait = max(
+                (
+                    _wait_time(level, amount, capacity, rate)
+                    for level, (_, amount, capacity, rate) in zip(levels, buckets)
+                ),
+                default=0.0,
+            )
+            if dry_run or (wait and not force):
+                return wait
+            for level, (key, amount, _, _) in zip(levels, buckets):
+                self._buckets[key] = (level - amount, now)
+            return 0.0
+
+
+class SQLiteBackend:
+    """
+    Token buckets stored in a SQLite file, shared by all processes using the
+    same file, e.g. the workers of a Gunicorn server.
+    """
+
+    def __init__(self, path: str = DEFAULT_RATE_LIMIT_PATH):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def take(
+        self, buckets: List[Bucket], force: bool = False, dry_run: bool = False
+    ) -> float:
+        with self._lock:
+            # BEGIN IMMEDIATE locks the database for writing, making the read
+            # and update of the buckets atomic across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                levels = []
+                for key, amount, capacity, rate in buckets:
+                    row = self._conn.execute(
+                        "SELECT level, updated_at FROM buckets WHERE key = ?", (key,)
+                    ).fetchone()
+                    level, updated_at = row if row else (capacity, now)
+                    levels.append(min(capacity, level + (now - updated_at) * rate))
+                wait = max(
+                    (
+                        _wait_time(level, amount, capacity, rate)
+                        for level, (_, amount, capacity, rate) in zip(levels, buckets)
+                    ),
+                    default=0.0,
+                )
+                if not dry_run and (not wait or force):
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO buckets (key, level, updated_at) "
+                        "VALUES (?, ?, ?)",
+                        [
+                            (key, level - amount, now)
+                            for level, (key, amount, _, _) in zip(levels, buckets)
+                        ],
+                    )
+                    wait = 0.0
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+class RateLimiter:
+    """
+    Requests per minute and tokens per minute limits for model deployments.
+
+    Every deployment gets a token bucket per limit, refilled continuously so
+    short bursts up to the limit are allowed. `acquire` blocks until the
+    deployment has room for the request instead of failing, which keeps
+    concurrent reviews from running into 429 responses and retrying.
+    """
+
+    def __init__(self, backend: str = "memory", path: str = DEFAULT_RATE_LIMIT_PATH):
+        if backend == "memory":
+            self.backend = MemoryBackend()
+        elif backend == "sqlite":
+            self.backend = SQLiteBackend(os.path.expanduser(path))
+        else:
+            raise ValueError(f"Unknown rate limiter backend: {backend}")
+
+    @staticmethod
+    def _buckets(
+        key: str, rpm: Optional[int], tpm: Optional[int], tokens: int
+    ) -> List[Bucket]:
+        buckets = []
+        if rpm:
+            buckets.append((f"{key}:rpm", 1, rpm, rpm / 60))
+        if tpm and tokens:
+            buckets.append((f"{key}:tpm", tokens, tpm, tpm / 60))
+        return buckets
+
+    def try_acquire(
+        self, key: str, rpm: Optional[int] = None, tpm: Optional[int] = None, tokens=0
+    ) -> float:
+        """Acquire without blocking, returning the seconds to wait if there is no room."""
+        buckets = self._buckets(key, rpm, tpm, tokens)
+        if not buckets:
+            return 0.0
+        return self.backend.take(buckets)
+
+    def acquire(
+        self, key: str, rpm: Optional[int] = None, tpm: Optional[int] = None, tokens=0
+    ) -> float:
+        """Block until the request fits in the limits, returning the time waited."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(key, rpm, tpm, tokens)
+            if not wait:
+                return waited
+            logger.debug(f"Rate limit of {key} reached, waiting {wait:.2f}s")
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(
+        self, key: str, rpm: Optional[int] = None, tpm: Optional[int] = None, tokens=0
+    ) -> float:
+        waited = 0.0
+        while True:
+            # The SQLite backend may wait for other processes holding its lock,
+            # which must not block the event loop
+            wait = await asyncio.to_thread(self.try_acquire, key, rpm, tpm, tokens)
+            if not wait:
+                return waited
+            logger.debug(f"Rate limit of {key} reached, waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def consume(self, key: str, tpm: Optional[int], tokens: int) -> None:
+        """Count tokens only known after the request, such as completion tokens."""
+        buckets = self._buckets(key, None, tpm, tokens)
+        if buckets:
+            self.backend.take(buckets, force=True)
+
+    def wait_time(
+        self, key: str, rpm: Optional[int] = None, tpm: Optional[int] = None, tokens=0
+    ) -> float:
+        """Seconds until a request would fit, without acquiring anything."""
+        buckets = self._buckets(key, rpm, tpm, tokens)
+        if not buckets:
+            return 0.0
+        return self.backend.take(buckets, dry_run=True)
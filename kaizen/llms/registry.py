@@ -0,0 +1,59 @@
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, List, Set, TypeVar
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_instances: Dict[str, Any] = {}
+_registered_models: Set[str] = set()
+
+
+def config_hash(*parts: Any) -> str:
+    """Stable hash of JSON-like configuration values."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_shared(kind: str, factory: Callable[..., T], **kwargs: Any) -> T:
+    """
+    Return the process-wide instance built by `factory(**kwargs)`, creating it
+    on first use.
+
+    Instances are keyed by `kind` and a hash of `kwargs`, so every
+    `LLMProvider` with the same model list shares one litellm `Router` and its
+    HTTP connection pools instead of building a new one per webhook.
+    """
+    key = config_hash(kind, kwargs)
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = factory(**kwargs)
+                _instances[key] = instance
+    return instance
+
+
+def register_models_once(
+    models: List[Dict[str, Any]], register: Callable[[Dict[str, Any]], None]
+) -> None:
+    """Call `register` for every model with `litellm_provider` info, once per process."""
+    for model_data in models:
+        model_info = model_data.get("model_info", {})
+        if "litellm_provider" not in model_info:
+            continue
+        key = config_hash(model_data["model_name"], model_info)
+        with _lock:
+            if key in _registered_models:
+                continue
+            _registered_models.add(key)
+        register({model_data["model_name"]: model_info})
+
+
+def clear() -> None:
+    """Drop all shared instances, e.g. after the configuration changed."""
+    with _lock:
+        _instances.clear()
+        _registered_models.clear()
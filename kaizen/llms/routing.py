@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_WINDOW = 100
+DEFAULT_MIN_SAMPLES = 3
+
+
+class LatencyTracker:
+    """
+    Rolling latency statistics per deployment.
+
+    The last `window` latencies of every deployment are kept, which is enough
+    for stable p50/p95 estimates while still following a deployment that gets
+    slower or faster.
+    """
+
+    def __init__(
+        self,
+        window: int = DEFAULT_LATENCY_WINDOW,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, deployment: str, latency: float) -> None:
+        with self._lock:
+            latencies = self._latencies.get(deployment)
+            if latencies is None:
+                latencies = self._latencies[deployment] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def samples(self, deployment: str) -> int:
+        with self._lock:
+            return len(self._latencies.get(deployment, ()))
+
+    def percentile(self, deployment: str, percentile: float) -> Optional[float]:
+        """Return the latency percentile of a deployment, or None without data."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(deployment, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def p50(self, deployment: str) -> Optional[float]:
+        return self.percentile(deployment, 50)
+
+    def p95(self, deployment: str) -> Optional[float]:
+        return self.percentile(deployment, 95)
+
+    def rank(self, deployments: List[str]) -> List[str]:
+        """
+        Order deployments from fastest to slowest p50. Deployments without
+        enough samples come first, in their given order, so they get measured.
+        """
+        medians = {deployment: self.p50(deployment) for deployment in deployments}
+        unmeasured = [d for d in deployments if medians[d] is None]
+        measured = sorted(
+            (d for d in deployments if medians[d] is not None), key=medians.get
+        )
+        return unmeasured + measured
+
+
+def hedged_call(
+    call: Callable[[str], Any],
+    deployments: List[str],
+    delay: float,
+    executor: Executor,
+    on_discard: Optional[Callable[[Any], None]] = None,
+) -> Any:
+    """
+    Call the first deployment and, if it failed or has not answered `delay`
+    seconds after it started, the second one as well. The first successful
+    response wins, the other request is cancelled if it has not started yet.
+    Threads cannot be interrupted, so a started request runs to completion and
+    its response is passed to `on_discard`, e.g. to account for its usage.
+    """
+    started = threading.Event()
+
+    def call_primary(deployment: str) -> Any:
+        started.set()
+        return call(deployment)
+
+    primary = executor.submit(
+        contextvars.copy_context().run, call_primary, deployments[0]
+    )
+    # Time spent waiting for a worker of a busy executor is no reason to hedge
+    started.wait()
+    done, _ = wait([primary], timeout=delay)
+    if len(deployments) < 2 or (done and primary.exception() is None):
+        return primary.result()
+
+    logger.debug(f"Hedging request to {deployments[0]} with {deployments[1]}")
+    backup = executor.submit(contextvars.copy_context().run, call, deployments[1])
+    futures = (primary, backup)
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in futures:
+                    if other is not future and not other.cancel() and on_discard:
+                        other.add_done_callback(functools.partial(_discard, on_discard))
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def _discard(
+    on_discard: Callable[[Any], None], future: Union[Future, asyncio.Future]
+) -> None:
+    if not future.cancelled() and future.exception() is None:
+        on_discard(future.result())
+
+
+async def ahedged_call(
+    call: Callable[[str], Awaitable[Any]],
+    deployments: List[str],
+    delay: float,
+    on_discard: Optional[Callable[[Any], None]] = None,
+) -> Any:
+    """
+    Async counterpart of `hedged_call`, the losing request is cancelled unless
+    it finished together with the winner.
+    """
+    primary = asyncio.ensure_future(call(deployments[0]))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if len(deployments) < 2 or (done and primary.exception() is None):
+        return await primary
+
+    logger.debug(f"Hedging request to {deployments[0]} with {deployments[1]}")
+    backup = asyncio.ensure_future(call(deployments[1]))
+    tasks = (primary, backup)
+    pending = set(tasks)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in tasks:
+                        if other is not task and other.done() and on_discard:
+                            _discard(on_discard, other)
+                    return task.result()
+                error = error or task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise error
@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time.
+
+    Callers arriving while a call with the same key is in flight wait for it
+    and receive its result (or exception) instead of running it again. Nothing
+    is kept once the call is done, repeated calls are left to the caches.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return the result of `fn` and whether it was shared with another caller."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """Async counterpart of `SingleFlight`, calls are shared per event loop."""
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, Hashable], asyncio.Task] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        task = self._calls.get(loop_key)
+        shared = task is not None
+        if not shared:
+            # The call runs in a task of its own, so cancelling any caller, the
+            # first one included, leaves it running for the others
+            task = self._calls[loop_key] = loop.create_task(fn())
+            task.add_done_callback(functools.partial(self._finish, loop_key))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, loop_key: Tuple[int, Hashable], task: asyncio.Task) -> None:
+        del self._calls[loop_key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when nobody was waiting anymore
+            task.exception()
@@ -0,0 +1,141 @@
+from typing import Any, Callable, Dict, List, Optional
+
+import litellm
+
+from kaizen.llms.usage import normalize_usage
+
+OnComplete = Callable[["CompletionStream"], None]
+
+
+def _chunk_delta(chunk) -> str:
+    try:
+        return chunk["choices"][0]["delta"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return getattr(chunk.choices[0].delta, "content", None) or ""
+
+
+class CompletionStream:
+    """
+    Iterator over the text deltas of a streamed chat completion.
+
+    `content`, `usage` and `model` are available once the stream has been
+    consumed. Closing the stream early with `close` stops reading from the
+    provider, which is how callers abort a response they already know is bad.
+    The usage of the chunks received until then is still settled, as it is
+    when the provider fails mid-stream or the reader stops iterating.
+    """
+
+    def __init__(
+        self,
+        chunks,
+        messages: List[Dict[str, str]],
+        on_complete: Optional[OnComplete] = None,
+    ):
+        self._chunks = chunks
+        self.messages = messages
+        self.on_complete = on_complete
+        self.parts: List[str] = []
+        self.received: List[Any] = []
+        self.usage: Optional[Dict[str, int]] = None
+        self.model: Optional[str] = None
+        self.finished = False
+        self.aborted = False
+
+    @classmethod
+    def from_content(
+        cls, content: str, usage: Dict[str, int], model: Optional[str] = None
+    ) -> "CompletionStream":
+        """Wrap an already available response, e.g. one served from the cache."""
+        stream = cls([], [])
+        stream.parts = [content]
+        stream.usage = usage
+        stream.model = model
+        stream.finished = True
+        return stream
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def __iter__(self):
+        if self.finished:
+            yield from self.parts
+            return
+        try:
+            for chunk in self._chunks:
+                if self.aborted:
+                    return
+                self.received.append(chunk)
+                delta = _chunk_delta(chunk)
+                if delta:
+                    self.parts.append(delta)
+                    yield delta
+        except BaseException:
+            # A provider error, or the reader stopped iterating (GeneratorExit)
+            self.close()
+            raise
+        self._finish()
+
+    def close(self) -> None:
+        if self.finished:
+            return
+        self.aborted = True
+        try:
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if self.finished:
+            return
+        if self.received:
+            response = litellm.stream_chunk_builder(
+                self.received, messages=self.messages
+            )
+            self.model = response["model"]
+            self.usage = normalize_usage(response["usage"])
+        self.finished = True
+        if self.on_complete:
+            self.on_complete(self)
+
+
+class AsyncCompletionStream(CompletionStream):
+    """Async counterpart of `CompletionStream`, iterate it with `async for`."""
+
+    def __iter__(self):
+        raise TypeError("Use 'async for' to read an AsyncCompletionStream")
+
+    def close(self) -> None:
+        raise TypeError("Use 'await aclose()' to close an AsyncCompletionStream")
+
+    async def aclose(self) -> None:
+        if self.finished:
+            return
+        self.aborted = True
+        try:
+            aclose = getattr(self._chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            self._finish()
+
+    async def __aiter__(self):
+        if self.finished:
+            for part in self.parts:
+                yield part
+            return
+        try:
+            async for chunk in self._chunks:
+                if self.aborted:
+                    return
+                self.received.append(chunk)
+                delta = _chunk_delta(chunk)
+                if delta:
+                    self.parts.append(delta)
+                    yield delta
+        except BaseException:
+            await self.aclose()
+            raise
+        self._finish()
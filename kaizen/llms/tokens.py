@@ -0,0 +1,95 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import litellm
+
+try:
+    from litellm.utils import _select_tokenizer
+except ImportError:  # Older/newer litellm releases may not expose it
+    _select_tokenizer = None
+
+DEFAULT_MAX_CACHE_ENTRIES = 4096
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate based on the UTF-8 byte length of the text."""
+    if not text:
+        return 0
+    return -(-len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+
+
+class TokenCounter:
+    """
+    Caches everything needed to count tokens for a model.
+
+    Max token lookups are resolved once per model, and token counts are kept in
+    an LRU keyed by model and a hash of the text so the same file diff is never
+    tokenized twice. Providers share one counter per process, see
+    `kaizen.llms.registry`. With `estimate=True` counts come from
+    `estimate_tokens` instead of the real tokenizer.
+    """
+
+    def __init__(
+        self, max_cache_entries: int = DEFAULT_MAX_CACHE_ENTRIES, estimate=False
+    ):
+        self.max_cache_entries = max_cache_entries
+        self.estimate = estimate
+        self._counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+        self._max_tokens: Dict[str, Optional[int]] = {}
+        self._lock = threading.Lock()
+
+    def tokenizer(self, model: str) -> Optional[Dict[str, Any]]:
+        # litellm keeps the tokenizer of every model in an lru_cache
+        if _select_tokenizer is None:
+            return None
+        try:
+            return _select_tokenizer(model)
+        except Exception:
+            return None
+
+    def max_tokens(self, model: str) -> Optional[int]:
+        if model not in self._max_tokens:
+            try:
+                self._max_tokens[model] = litellm.get_max_tokens(model)
+            except Exception:
+                self._max_tokens[model] = None
+        return self._max_tokens[model]
+
+    def count(self, text: str, model: str, estimate: Optional[bool] = None) -> int:
+        if estimate is None:
+            estimate = self.estimate
+        if estimate:
+            return estimate_tokens(text)
+
+        key = (model, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+
+        count = self._count_text(text, model)
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_cache_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_messages(self, messages, model: str) -> Optional[int]:
+        return self._token_counter(model, messages=messages)
+
+    def _count_text(self, text: str, model: str) -> int:
+        return self._token_counter(model, text=text)
+
+    def _token_counter(self, model: str, **kwargs) -> Optional[int]:
+        handle = self.tokenizer(model)
+        if handle is not None:
+            return litellm.token_counter(model=model, custom_tokenizer=handle, **kwargs)
+        return litellm.token_counter(model=model, **kwargs)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+        self._max_tokens.clear()
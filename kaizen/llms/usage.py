@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from numbers import Number
+from typing import Dict, Optional
+
+_current_usage: ContextVar[Optional["UsageTracker"]] = ContextVar(
+    "kaizen_usage", default=None
+)
+
+
+def merge_usage(
+    total_usage: Optional[Dict[str, int]], current_usage: Optional[Dict[str, int]]
+) -> Dict[str, int]:
+    """
+    Add two usage dicts key by key.
+
+    Keys present in only one of them are kept, and non numeric entries such as
+    the `*_tokens_details` objects of litellm responses are skipped.
+    """
+    merged = {}
+    for usage in (total_usage, current_usage):
+        for key, value in (usage or {}).items():
+            if isinstance(value, Number) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def normalize_usage(usage) -> Dict[str, int]:
+    """
+    Convert the usage of a litellm response into a plain dict.
+
+    Prompt tokens served from the provider's prompt cache are reported as
+    `cached_tokens`, whether the provider returns them in
+    `prompt_tokens_details` (OpenAI, Gemini) or as `cache_read_input_tokens`
+    (Anthropic, Bedrock).
+    """
+    usage = dict(usage or {})
+    details = usage.get("prompt_tokens_details")
+    if isinstance(details, dict):
+        cached_tokens = details.get("cached_tokens")
+    else:
+        cached_tokens = getattr(details, "cached_tokens", None)
+    if not cached_tokens:
+        cached_tokens = usage.get("cache_read_input_tokens")
+    usage["cached_tokens"] = cached_tokens or 0
+    return usage
+
+
+class UsageTracker:
+    """
+    Accumulates the token usage, cost and models of the completions made in a
+    `usage_scope`.
+
+    `LLMProvider` adds every response to the tracker of the current context, so
+    one provider can serve concurrent reviews while each of them only sees its
+    own usage. Updates are forwarded to the tracker of the enclosing scope, if
+    any, so an outer scope still sees the total.
+    """
+
+    def __init__(self, parent: Optional["UsageTracker"] = None):
+        self.parent = parent
+        self.usage: Dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        }
+        self.prompt_cost = 0.0
+        self.completion_cost = 0.0
+        self.requests = 0
+        # Model of the last response, and usage per model
+        self.model: Optional[str] = None
+        self.models: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        usage: Optional[Dict[str, int]],
+        model: Optional[str] = None,
+        prompt_cost: float = 0.0,
+        completion_cost: float = 0.0,
+    ) -> None:
+        with self._lock:
+            self.usage = merge_usage(self.usage, usage)
+            self.prompt_cost += prompt_cost
+            self.completion_cost += completion_cost
+            self.requests += 1
+            if model:
+                self.model = model
+                self.models[model] = merge_usage(self.models.get(model), usage)
+        if self.parent is not None:
+            self.parent.add(usage, model, prompt_cost, completion_cost)
+
+    @property
+    def cost(self) -> Dict[str, float]:
+        return {
+            "prompt_cost": self.prompt_cost,
+            "completion_cost": self.completion_cost,
+        }
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.usage)
+
+
+def get_current_usage() -> Optional[UsageTracker]:
+    return _current_usage.get()
+
+
+@contextmanager
+def usage_scope(tracker: Optional[UsageTracker] = None):
+    """
+    Collect the usage of all provider calls in this context into `tracker`, a
+    new tracker nested in the active one by default.
+    Reviews and generators open one per call, so concurrent calls sharing a
+    provider keep their usage apart.
+
+    Like `budget_scope`, the scope follows asyncio tasks automatically while
+    thread pool work must be run with `contextvars.copy_context().run`.
+    """
+    if tracker is None:
+        tracker = UsageTracker(parent=get_current_usage())
+    token = _current_usage.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_usage.reset(token)
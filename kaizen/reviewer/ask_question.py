@@ -1,8 +1,10 @@
-from typing import Optional, List, Dict, Generator
-from dataclasses import dataclass
+from typing import Optional, List, Dict, Generator, Tuple
+from dataclasses import dataclass, field
 import logging
-from kaizen.helpers import parser
+from kaizen.helpers import chunking, parser, tracing
+from kaizen.helpers.diff import Diff
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.usage import UsageTracker, usage_scope
 from kaizen.llms.prompts.ask_question_prompts import (
     ANSWER_QUESTION_SYSTEM_PROMPT,
     ANSWER_QUESTION_PROMPT,
@@ -17,18 +19,15 @@ class AnswerOutput:
     usage: Dict[str, int]
     model_name: str
     cost: Dict[str, float]
+    # Seconds spent per stage, see `kaizen.helpers.tracing`
+    timings: Dict[str, float] = field(default_factory=dict)
 
 
 class QuestionAnswer:
     def __init__(self, llm_provider: LLMProvider):
         self.logger = logging.getLogger(__name__)
         self.provider = llm_provider
-        self.provider.system_prompt = ANSWER_QUESTION_SYSTEM_PROMPT
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
+        self.system_prompt = ANSWER_QUESTION_SYSTEM_PROMPT
 
     def is_ask_question_prompt_within_limit(
         self,
@@ -43,53 +42,114 @@ class QuestionAnswer:
             CODE_DIFF=parser.patch_to_combined_chunks(diff_text),
             QUESTION=question,
         )
-        return self.provider.is_inside_token_limit(PROMPT=prompt)
+        return self.provider.is_inside_token_limit(
+            PROMPT=prompt, system_prompt=self.system_prompt
+        )
 
-    def ask_pull_request(
+    def _build_answer_output(
+        self, resp: str, usage: UsageTracker, timings: tracing.Timings
+    ) -> AnswerOutput:
+        return AnswerOutput(
+            answer=resp,
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            cost=usage.cost,
+            timings=timings.snapshot(),
+        )
+
+    def _setup_question(
         self,
         diff_text: str,
         pull_request_title: str,
         pull_request_desc: str,
         question: str,
         pull_request_files: List[Dict],
-        user: Optional[str] = None,
-    ) -> AnswerOutput:
+        diff: Optional[Diff] = None,
+    ) -> Tuple[str, Diff]:
         prompt = ANSWER_QUESTION_PROMPT.format(
             PULL_REQUEST_TITLE=pull_request_title,
             PULL_REQUEST_DESC=pull_request_desc,
             CODE_DIFF=parser.patch_to_combined_chunks(diff_text),
             QUESTION=question,
         )
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
-        if not diff_text and not pull_request_files:
+        if diff is None:
+            with tracing.span("parse_diff"):
+                diff = Diff.from_pr_files(pull_request_files or [])
+        if not diff_text and not diff:
             raise Exception("Both diff_text and pull_request_files are empty!")
+        return prompt, diff
 
-        if diff_text and self.provider.is_inside_token_limit(PROMPT=prompt):
-            resp = self._process_full_diff_qa(prompt, user)
-
-        else:
-            resp = self._process_files_qa(
+    def ask_pull_request(
+        self,
+        diff_text: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        question: str,
+        pull_request_files: List[Dict],
+        user: Optional[str] = None,
+        diff: Optional[Diff] = None,
+    ) -> AnswerOutput:
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt, diff = self._setup_question(
+                diff_text,
+                pull_request_title,
+                pull_request_desc,
+                question,
                 pull_request_files,
+                diff,
+            )
+
+            if diff_text and self.provider.is_inside_token_limit(
+                PROMPT=prompt, system_prompt=self.system_prompt
+            ):
+                resp = self._process_full_diff_qa(prompt, user)
+
+            else:
+                resp = self._process_files_qa(
+                    diff,
+                    pull_request_title,
+                    pull_request_desc,
+                    question,
+                    user,
+                )
+
+            return self._build_answer_output(resp, usage, timings)
+
+    async def aask_pull_request(
+        self,
+        diff_text: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        question: str,
+        pull_request_files: List[Dict],
+        user: Optional[str] = None,
+        diff: Optional[Diff] = None,
+    ) -> AnswerOutput:
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt, diff = self._setup_question(
+                diff_text,
                 pull_request_title,
                 pull_request_desc,
                 question,
-                user,
+                pull_request_files,
+                diff,
             )
 
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
+            if diff_text and self.provider.is_inside_token_limit(
+                PROMPT=prompt, system_prompt=self.system_prompt
+            ):
+                resp = await self._aprocess_full_diff_qa(prompt, user)
 
-        return AnswerOutput(
-            answer=resp,
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
-        )
+            else:
+                resp = await self._aprocess_files_qa(
+                    diff,
+                    pull_request_title,
+                    pull_request_desc,
+                    question,
+                    user,
+                )
+
+            return self._build_answer_output(resp, usage, timings)
 
     def _process_full_diff_qa(
         self,
@@ -97,13 +157,25 @@ class QuestionAnswer:
         user: Optional[str],
     ) -> str:
         self.logger.debug("Processing directly from diff")
-        resp, usage = self.provider.chat_completion(prompt, user=user)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
+        resp, _ = self.provider.chat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
+        return resp
+
+    async def _aprocess_full_diff_qa(
+        self,
+        prompt: str,
+        user: Optional[str],
+    ) -> str:
+        self.logger.debug("Processing directly from diff")
+        resp, _ = await self.provider.achat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
         return resp
 
     def _process_files_qa(
         self,
-        pull_request_files: List[Dict],
+        diff: Diff,
         pull_request_title: str,
         pull_request_desc: str,
         question: str,
@@ -112,7 +184,7 @@ class QuestionAnswer:
         self.logger.debug("Processing based on files")
         responses = []
         for answer in self._process_files_generator_qa(
-            pull_request_files,
+            diff,
             pull_request_title,
             pull_request_desc,
             question,
@@ -122,87 +194,150 @@ class QuestionAnswer:
             ## summarize responses
         return self._summarize_responses(question, responses)
 
-    def _process_files_generator_qa(
+    async def _aprocess_files_qa(
         self,
-        pull_request_files: List[Dict],
+        diff: Diff,
         pull_request_title: str,
         pull_request_desc: str,
         question: str,
         user: Optional[str],
-    ) -> Generator[str, None, None]:
-        combined_diff_data = ""
-        available_tokens = self.provider.available_tokens(FILE_ANSWER_QUESTION_PROMPT)
+    ) -> str:
+        self.logger.debug("Processing based on files")
+        responses = []
+        with tracing.span("chunk"):
+            chunks = self._chunk_files_qa(diff)
+        for diff_data in chunks:
+            responses.append(
+                await self._aprocess_file_chunk_qa(
+                    diff_data,
+                    pull_request_title,
+                    pull_request_desc,
+                    question,
+                    user,
+                )
+            )
+        return await self._asummarize_responses(question, responses)
 
-        for file in pull_request_files:
-            patch_details = file.get("patch")
-            filename = file.get("filename", "")
+    def _chunk_files_qa(self, diff: Diff) -> List[str]:
+        available_tokens = self.provider.available_tokens(FILE_ANSWER_QUESTION_PROMPT)
+        diff_parts = []
+        for file_diff in diff:
+            filename = file_diff.file_name
 
             if (
                 filename.split(".")[-1] not in parser.EXCLUDED_FILETYPES
-                and patch_details is not None
+                and file_diff.hunks
             ):
-                temp_prompt = (
-                    combined_diff_data
-                    + f"\n---->\nFile Name: {filename}\nPatch Details: {parser.patch_to_combined_chunks(patch_details)}"
+                diff_parts.extend(
+                    chunking.render_file_parts(
+                        file_diff,
+                        f"\n---->\nFile Name: {filename}\nPatch Details: ",
+                        available_tokens,
+                        self.provider.get_token_count,
+                    )
                 )
 
-                if available_tokens - self.provider.get_token_count(temp_prompt) > 0:
-                    combined_diff_data = temp_prompt
-                    continue
-
-                yield self._process_file_chunk_qa(
-                    combined_diff_data,
-                    pull_request_title,
-                    pull_request_desc,
-                    question,
-                    user,
-                )
-                combined_diff_data = (
-                    f"\n---->\nFile Name: {filename}\nPatch Details: {patch_details}"
-                )
+        return chunking.pack_chunks(
+            diff_parts, available_tokens, self.provider.get_token_count
+        )
 
-        if combined_diff_data:
+    def _process_files_generator_qa(
+        self,
+        diff: Diff,
+        pull_request_title: str,
+        pull_request_desc: str,
+        question: str,
+        user: Optional[str],
+    ) -> Generator[str, None, None]:
+        with tracing.span("chunk"):
+            chunks = self._chunk_files_qa(diff)
+        for diff_data in chunks:
             yield self._process_file_chunk_qa(
-                combined_diff_data,
+                diff_data,
                 pull_request_title,
                 pull_request_desc,
                 question,
                 user,
             )
 
-    def _process_file_chunk_qa(
+    def _build_file_chunk_prompt(
         self,
         diff_data: str,
         pull_request_title: str,
         pull_request_desc: str,
         question: str,
-        user: Optional[str],
     ) -> str:
-        if not diff_data:
-            return ""
-        prompt = FILE_ANSWER_QUESTION_PROMPT.format(
+        return FILE_ANSWER_QUESTION_PROMPT.format(
             PULL_REQUEST_TITLE=pull_request_title,
             PULL_REQUEST_DESC=pull_request_desc,
             FILE_PATCH=diff_data,
             QUESTION=question,
         )
-        resp, usage = self.provider.chat_completion(prompt, user=user)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
+
+    def _process_file_chunk_qa(
+        self,
+        diff_data: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        question: str,
+        user: Optional[str],
+    ) -> str:
+        if not diff_data:
+            return ""
+        prompt = self._build_file_chunk_prompt(
+            diff_data, pull_request_title, pull_request_desc, question
+        )
+        resp, _ = self.provider.chat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
         return resp
 
-    def _summarize_responses(self, question: str, responses: List[str]) -> str:
-        if len(responses) == 1:
-            return responses[0]
+    async def _aprocess_file_chunk_qa(
+        self,
+        diff_data: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        question: str,
+        user: Optional[str],
+    ) -> str:
+        if not diff_data:
+            return ""
+        prompt = self._build_file_chunk_prompt(
+            diff_data, pull_request_title, pull_request_desc, question
+        )
+        resp, _ = await self.provider.achat_completion(
+            prompt, user=user, system_prompt=self.system_prompt
+        )
+        return resp
 
+    @staticmethod
+    def _build_summary_prompt(question: str, responses: List[str]) -> str:
         formatted_responses = "\n\n".join(
             f"Response for file/chunk {i + 1}:\n{response}"
             for i, response in enumerate(responses)
         )
-        summary_prompt = SUMMARIZE_ANSWER_PROMPT.format(
+        return SUMMARIZE_ANSWER_PROMPT.format(
             QUESTION=question, RESPONSES=formatted_responses
         )
 
-        summarized_answer, usage = self.provider.chat_completion(summary_prompt)
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
+    def _summarize_responses(self, question: str, responses: List[str]) -> str:
+        if len(responses) == 1:
+            return responses[0]
+
+        summary_prompt = self._build_summary_prompt(question, responses)
+        summarized_answer, _ = self.provider.chat_completion(
+            summary_prompt, system_prompt=self.system_prompt
+        )
+
+        return summarized_answer
+
+    async def _asummarize_responses(self, question: str, responses: List[str]) -> str:
+        if len(responses) == 1:
+            return responses[0]
+
+        summary_prompt = self._build_summary_prompt(question, responses)
+        summarized_answer, _ = await self.provider.achat_completion(
+            summary_prompt, system_prompt=self.system_prompt
+        )
 
         return summarized_answer
@@ -1,8 +1,15 @@
-from typing import Optional, List, Dict, Generator, Tuple
-from dataclasses import dataclass
+from typing import Callable, Optional, List, Dict, Tuple
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import logging
-from kaizen.helpers import parser
+import time
+from kaizen.helpers import chunking, parser, tracing
+from kaizen.helpers.diff import Diff, FileDiff
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.budget import Budget, budget_scope
+from kaizen.llms.usage import UsageTracker, usage_scope
 from kaizen.llms.prompts.code_review_prompts import (
     CODE_REVIEW_PROMPT,
     PR_REVIEW_EVALUATION_PROMPT,
@@ -92,36 +99,223 @@ class ReviewOutput:
     model_name: str
     cost: Dict[str, float]
     file_count: int
+    # Seconds spent per stage, see `kaizen.helpers.tracing`
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class _ReviewRun:
+    """
+    Settings and state of one review, passed along instead of being stored on
+    the reviewer so concurrent reviews on a shared `CodeReviewer` stay apart.
+    """
+
+    ignore_deletions: bool = False
+    custom_rules: str = ""
+    on_issue: Optional[Callable[[Dict], None]] = None
+    files_processed: int = 0
 
 
 class CodeReviewer:
-    def __init__(self, llm_provider: LLMProvider, default_model="default"):
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        default_model="default",
+        max_concurrency: Optional[int] = None,
+        hunk_overlap: int = chunking.DEFAULT_HUNK_OVERLAP,
+    ):
         self.logger = logging.getLogger(__name__)
         self.provider = llm_provider
-        self.provider.set_system_prompt(CODE_REVIEW_SYSTEM_PROMPT)
+        self.system_prompt = CODE_REVIEW_SYSTEM_PROMPT
         self.default_model = default_model
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
-        self.ignore_deletions = False
+        # Max number of file chunks reviewed in parallel, defaults to the
+        # provider's `max_concurrent_requests`
+        self.max_concurrency = max_concurrency
+        # Context lines repeated when a file too big for one prompt is split
+        self.hunk_overlap = hunk_overlap
 
     def is_code_review_prompt_within_limit(
         self,
         diff_text: str,
         pull_request_title: str,
         pull_request_desc: str,
+        ignore_deletions: bool = False,
+        custom_rules: str = "",
     ) -> bool:
         prompt = CODE_REVIEW_PROMPT.format(
             PULL_REQUEST_TITLE=pull_request_title,
             PULL_REQUEST_DESC=pull_request_desc,
             CODE_DIFF=parser.patch_to_combined_chunks(
-                diff_text, ignore_deletions=self.ignore_deletions
+                diff_text, ignore_deletions=ignore_deletions
             ),
-            CODE_REVIEW_PROMPT=self.custom_rules,
+            CODE_REVIEW_PROMPT=custom_rules,
+        )
+        return self.provider.is_inside_token_limit(
+            PROMPT=prompt, system_prompt=self.system_prompt
+        )
+
+    def _setup_review(
+        self,
+        diff_text: str,
+        pull_request_files: List[Dict],
+        diff: Optional[Diff] = None,
+    ) -> Diff:
+        if diff is None:
+            # Parse the pull request once, the full diff and the file chunks
+            # are both rendered from it
+            with tracing.span("parse_diff"):
+                diff = Diff.from_patch(diff_text) if diff_text else Diff()
+                if not diff:
+                    diff = Diff.from_pr_files(pull_request_files or [])
+        if not diff:
+            raise Exception("Both diff_text and pull_request_files are empty!")
+        return diff
+
+    def _split_diff(
+        self, run: _ReviewRun, diff: Diff
+    ) -> Tuple[List[FileDiff], List[str], List[int]]:
+        """Render the reviewable files of the diff and count their tokens once."""
+        file_diffs = []
+        diff_parts = []
+        for file_diff in diff:
+            filename = file_diff.file_name.replace(" ", "")
+
+            if not parser.should_ignore_file(filename) and file_diff.hunks:
+                run.files_processed += 1
+                file_diffs.append(file_diff)
+                diff_parts.append(
+                    self._format_file_part(
+                        filename, file_diff.render(run.ignore_deletions)
+                    )
+                )
+        with tracing.span("tokenize", files=len(diff_parts)):
+            token_counts = [self.provider.get_token_count(part) for part in diff_parts]
+        return file_diffs, diff_parts, token_counts
+
+    @staticmethod
+    def _format_file_part(filename: str, patch_details: str) -> str:
+        return f"\n---->\nFile Name: {filename}\nPatch Details:\n{patch_details}"
+
+    def _split_large_files(
+        self,
+        run: _ReviewRun,
+        file_diffs: List[FileDiff],
+        diff_parts: List[str],
+        token_counts: List[int],
+        available_tokens: int,
+    ) -> Tuple[List[str], List[int]]:
+        """Split files which do not fit in a single prompt along their hunks."""
+        parts, counts = [], []
+        for file_diff, part, count in zip(file_diffs, diff_parts, token_counts):
+            if count <= available_tokens:
+                parts.append(part)
+                counts.append(count)
+                continue
+
+            filename = file_diff.file_name.replace(" ", "")
+            file_parts = chunking.render_file_parts(
+                file_diff,
+                self._format_file_part(filename, ""),
+                available_tokens,
+                self.provider.get_token_count,
+                render=lambda piece: piece.render(run.ignore_deletions),
+                overlap=self.hunk_overlap,
+            )
+            self.logger.debug(f"Split {filename} into {len(file_parts)} parts")
+            parts.extend(file_parts)
+            counts.extend(self.provider.get_token_count(part) for part in file_parts)
+        return parts, counts
+
+    def _get_available_tokens(self, run: _ReviewRun, custom_context: str) -> int:
+        return self.provider.available_tokens(
+            self.system_prompt + self._build_prompt(run, "", custom_context)
+        )
+
+    def _plan_review(
+        self, run: _ReviewRun, diff: Diff, custom_context: str
+    ) -> Tuple[Optional[str], List[str]]:
+        """
+        Decide between reviewing the whole diff in one prompt or in file chunks.
+
+        Returns the full prompt when the diff fits in the model limit, otherwise
+        `None` and the file chunks. The per-file token counts are summed for the
+        decision and reused to pack the chunks, so nothing is tokenized twice.
+        """
+        file_diffs, diff_parts, token_counts = self._split_diff(run, diff)
+        available_tokens = self._get_available_tokens(run, custom_context)
+        if diff_parts and sum(token_counts) <= available_tokens:
+            return self._build_prompt(run, "".join(diff_parts), custom_context), []
+        with tracing.span("chunk", files=len(diff_parts)):
+            diff_parts, token_counts = self._split_large_files(
+                run, file_diffs, diff_parts, token_counts, available_tokens
+            )
+            chunks = chunking.pack_chunks(
+                diff_parts,
+                available_tokens,
+                self.provider.get_token_count,
+                token_counts=token_counts,
+            )
+        return None, chunks
+
+    @staticmethod
+    def _stream_options(run: _ReviewRun, final: bool) -> Dict:
+        # Only stream the responses whose issues end up in the review
+        if run.on_issue and final:
+            return {"stream": True, "on_item": run.on_issue}
+        return {}
+
+    def _get_max_concurrency(self) -> int:
+        if self.max_concurrency:
+            return self.max_concurrency
+        return self.provider.max_concurrent_requests
+
+    def _build_messages(self, run: _ReviewRun, prompt: str) -> List[Dict]:
+        # Everything before the diff is the same for every chunk of every review
+        # using the same rules, so it is sent first and marked for prompt caching
+        marker = "\0"
+        static_prefix = self._build_prompt(run, marker, "").split(marker, 1)[0]
+        return self.provider.build_messages(prompt, self.system_prompt, static_prefix)
+
+    def _build_prompt(
+        self, run: _ReviewRun, diff_data: str, custom_context: str
+    ) -> str:
+        return (
+            CODE_REVIEW_PROMPT.format(
+                CODE_DIFF=diff_data,
+                CUSTOM_RULES="Always mark issues that violate the following rules with a severity of 8 or higher (high and above):"
+                + run.custom_rules,
+            )
+            + custom_context
+        )
+
+    def _build_review_output(
+        self,
+        run: _ReviewRun,
+        reviews: List[Dict],
+        code_quality: Optional[float],
+        diff: Diff,
+        pull_request_files: Optional[List[Dict]],
+        check_sensetive: bool,
+        usage: UsageTracker,
+        timings: tracing.Timings,
+    ) -> ReviewOutput:
+        with tracing.span("format"):
+            if check_sensetive:
+                # The files list also has renamed and binary files, which
+                # have no hunks in the parsed diff
+                reviews.extend(self.check_sensitive_files(pull_request_files or diff))
+            categories = self._merge_categories(reviews)
+
+        return ReviewOutput(
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
+            topics=categories,
+            issues=reviews,
+            code_quality=code_quality,
+            cost=usage.cost,
+            file_count=run.files_processed,
+            timings=timings.snapshot(),
         )
-        return self.provider.is_inside_token_limit(PROMPT=prompt)
 
     def review_pull_request(
         self,
@@ -136,96 +330,136 @@ class CodeReviewer:
         custom_context: str = "",
         check_sensetive: bool = False,
         custom_rules: str = "",
+        diff: Optional[Diff] = None,
+        on_issue: Optional[Callable[[Dict], None]] = None,
+        budget: Optional[Budget] = None,
     ) -> ReviewOutput:
-        self.ignore_deletions = ignore_deletions
-        self.files_processed = 0
-        self.custom_rules = custom_rules
-        prompt = (
-            CODE_REVIEW_PROMPT.format(
-                CODE_DIFF=parser.patch_to_combined_chunks(
-                    diff_text, self.ignore_deletions
-                ),
-                CUSTOM_RULES="Always mark issues that violate the following rules with a severity of 8 or higher (high and above):"
-                + self.custom_rules,
-            )
-            + custom_context
-        )
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
-        if not diff_text and not pull_request_files:
-            raise Exception("Both diff_text and pull_request_files are empty!")
+        with tracing.timing_scope() as timings:
+            run = _ReviewRun(ignore_deletions, custom_rules, on_issue)
+            diff = self._setup_review(diff_text, pull_request_files, diff)
+            prompt, chunks = self._plan_review(run, diff, custom_context)
 
-        if diff_text and self.provider.is_inside_token_limit(PROMPT=prompt):
-            reviews, code_quality = self._process_full_diff(
-                prompt, user, reeval_response
-            )
-        else:
-            reviews, code_quality = self._process_files(
+            with usage_scope() as usage, budget_scope(self.provider.new_budget(budget)):
+                if prompt:
+                    reviews, code_quality = self._process_full_diff(
+                        run, prompt, user, reeval_response
+                    )
+                else:
+                    reviews, code_quality = self._process_files(
+                        run,
+                        chunks,
+                        pull_request_title,
+                        pull_request_desc,
+                        user,
+                        reeval_response,
+                        custom_context,
+                    )
+            return self._build_review_output(
+                run,
+                reviews,
+                code_quality,
+                diff,
                 pull_request_files,
-                pull_request_title,
-                pull_request_desc,
-                user,
-                reeval_response,
-                custom_context,
+                check_sensetive,
+                usage,
+                timings,
             )
-        if check_sensetive:
-            reviews.extend(self.check_sensitive_files(pull_request_files))
 
-        categories = self._merge_categories(reviews)
-        prompt_cost, completion_cost = self.provider.get_usage_cost(
-            total_usage=self.total_usage
-        )
+    async def areview_pull_request(
+        self,
+        diff_text: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        pull_request_files: List[Dict],
+        user: Optional[str] = None,
+        reeval_response: bool = False,
+        model="default",
+        ignore_deletions=False,
+        custom_context: str = "",
+        check_sensetive: bool = False,
+        custom_rules: str = "",
+        diff: Optional[Diff] = None,
+        on_issue: Optional[Callable[[Dict], None]] = None,
+        budget: Optional[Budget] = None,
+    ) -> ReviewOutput:
+        with tracing.timing_scope() as timings:
+            run = _ReviewRun(ignore_deletions, custom_rules, on_issue)
+            diff = self._setup_review(diff_text, pull_request_files, diff)
+            prompt, chunks = self._plan_review(run, diff, custom_context)
 
-        return ReviewOutput(
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            topics=categories,
-            issues=reviews,
-            code_quality=code_quality,
-            cost={"prompt_cost": prompt_cost, "completion_cost": completion_cost},
-            file_count=self.files_processed,
-        )
+            with usage_scope() as usage, budget_scope(self.provider.new_budget(budget)):
+                if prompt:
+                    reviews, code_quality = await self._aprocess_full_diff(
+                        run, prompt, user, reeval_response
+                    )
+                else:
+                    reviews, code_quality = await self._aprocess_files(
+                        run,
+                        chunks,
+                        pull_request_title,
+                        pull_request_desc,
+                        user,
+                        reeval_response,
+                        custom_context,
+                    )
+            return self._build_review_output(
+                run,
+                reviews,
+                code_quality,
+                diff,
+                pull_request_files,
+                check_sensetive,
+                usage,
+                timings,
+            )
 
     def _process_full_diff(
         self,
+        run: _ReviewRun,
         prompt: str,
         user: Optional[str],
         reeval_response: bool,
-    ) -> List[Dict]:
+    ) -> Tuple[List[Dict], Optional[float]]:
         self.logger.debug("Processing directly from diff")
         custom_model = {"model": self.default_model}
-        resp, usage = self.provider.chat_completion_with_json(
-            prompt, user=user, custom_model=custom_model
+        resp, _ = self.provider.chat_completion_with_json(
+            prompt,
+            user=user,
+            messages=self._build_messages(run, prompt),
+            custom_model=custom_model,
+            **self._stream_options(run, not reeval_response),
         )
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
         if reeval_response:
-            resp = self._reevaluate_response(prompt, resp, user)
+            resp = self._reevaluate_response(run, prompt, resp, user)
         return resp["review"], resp.get("code_quality_percentage", None)
 
-    def _process_files(
+    async def _aprocess_full_diff(
         self,
-        pull_request_files: List[Dict],
-        pull_request_title: str,
-        pull_request_desc: str,
+        run: _ReviewRun,
+        prompt: str,
         user: Optional[str],
         reeval_response: bool,
-        custom_context: str,
     ) -> Tuple[List[Dict], Optional[float]]:
-        self.logger.debug("Processing based on files")
+        self.logger.debug("Processing directly from diff")
+        custom_model = {"model": self.default_model}
+        resp, _ = await self.provider.achat_completion_with_json(
+            prompt,
+            user=user,
+            messages=self._build_messages(run, prompt),
+            custom_model=custom_model,
+            **self._stream_options(run, not reeval_response),
+        )
+        if reeval_response:
+            resp = await self._areevaluate_response(run, prompt, resp, user)
+        return resp["review"], resp.get("code_quality_percentage", None)
+
+    @staticmethod
+    def _merge_chunk_results(
+        results: List[Optional[Tuple[List[Dict], Optional[float]]]]
+    ) -> Tuple[List[Dict], Optional[float]]:
         reviews = []
         code_quality = None
-        file_chunks_generator = self._process_files_generator(
-            pull_request_files,
-            pull_request_title,
-            pull_request_desc,
-            user,
-            reeval_response,
-            custom_context,
-        )
-        for result in file_chunks_generator:
+        for result in results:
             if result:  # Check if the result is not None
                 file_review, quality = result
                 reviews.extend(file_review)
@@ -234,62 +468,90 @@ class CodeReviewer:
                         code_quality = quality
         return reviews, code_quality
 
-    def _process_files_generator(
+    def _process_files(
         self,
-        pull_request_files: List[Dict],
+        run: _ReviewRun,
+        chunks: List[str],
         pull_request_title: str,
         pull_request_desc: str,
         user: Optional[str],
         reeval_response: bool,
         custom_context: str,
-    ) -> Generator[Optional[Tuple[List[Dict], Optional[float]]], None, None]:
-        combined_diff_data = ""
-        available_tokens = self.provider.available_tokens(CODE_REVIEW_PROMPT)
-        diff_parts = []
-        for file in pull_request_files:
-            patch_details = file.get("patch")
-            filename = file.get("filename", "").replace(" ", "")
+    ) -> Tuple[List[Dict], Optional[float]]:
+        self.logger.debug("Processing based on files")
+        max_workers = min(self._get_max_concurrency(), len(chunks))
 
-            if not parser.should_ignore_file(filename) and patch_details is not None:
-                self.files_processed += 1
-                diff_parts.append(
-                    f"\n---->\nFile Name: {filename}\nPatch Details:\n{parser.patch_to_combined_chunks(patch_details, self.ignore_deletions)}"
-                )
+        def process_chunk(diff_data, submitted_at=None):
+            if submitted_at is not None:
+                tracing.record("llm.queue", time.monotonic() - submitted_at)
+            return self._process_file_chunk(
+                run,
+                diff_data,
+                pull_request_title,
+                pull_request_desc,
+                user,
+                reeval_response,
+                custom_context,
+            )
 
-                if (
-                    available_tokens
-                    - self.provider.get_token_count("".join(diff_parts))
-                    > 0
-                ):
-                    combined_diff_data = "".join(diff_parts)
-                    continue
+        if max_workers <= 1:
+            results = [process_chunk(diff_data) for diff_data in chunks]
+        else:
+            self.logger.debug(
+                f"Reviewing {len(chunks)} chunks with {max_workers} workers"
+            )
+            # Chunks run in a copy of the caller's context to keep its budget
+            # and usage scope,
+            # results are collected in chunk order so the review is deterministic
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                submitted_at = time.monotonic()
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        process_chunk,
+                        chunk,
+                        submitted_at,
+                    )
+                    for chunk in chunks
+                ]
+                results = [future.result() for future in futures]
+        return self._merge_chunk_results(results)
+
+    async def _aprocess_files(
+        self,
+        run: _ReviewRun,
+        chunks: List[str],
+        pull_request_title: str,
+        pull_request_desc: str,
+        user: Optional[str],
+        reeval_response: bool,
+        custom_context: str,
+    ) -> Tuple[List[Dict], Optional[float]]:
+        self.logger.debug("Processing based on files")
+        semaphore = asyncio.Semaphore(self._get_max_concurrency())
 
-                yield self._process_file_chunk(
-                    combined_diff_data,
+        async def process_chunk(diff_data):
+            waiting_since = time.monotonic()
+            async with semaphore:
+                tracing.record("llm.queue", time.monotonic() - waiting_since)
+                return await self._aprocess_file_chunk(
+                    run,
+                    diff_data,
                     pull_request_title,
                     pull_request_desc,
                     user,
                     reeval_response,
                     custom_context,
                 )
-                diff_parts = [
-                    f"\n---->\nFile Name: {filename}\nPatch Details: {parser.patch_to_combined_chunks(patch_details,  self.ignore_deletions)}"
-                ]
 
-        if diff_parts:
-            yield self._process_file_chunk(
-                "".join(diff_parts),
-                pull_request_title,
-                pull_request_desc,
-                user,
-                reeval_response,
-                custom_context,
-            )
-        else:
-            yield None  # Yield None if there's no data to process
+        results = await asyncio.gather(
+            *(process_chunk(diff_data) for diff_data in chunks)
+        )
+        return self._merge_chunk_results(results)
 
     def _process_file_chunk(
         self,
+        run: _ReviewRun,
         diff_data: str,
         pull_request_title: str,
         pull_request_desc: str,
@@ -299,40 +561,83 @@ class CodeReviewer:
     ) -> Optional[Tuple[List[Dict], Optional[float]]]:
         if not diff_data:
             return None
-        prompt = (
-            CODE_REVIEW_PROMPT.format(
-                CODE_DIFF=diff_data,
-                CUSTOM_RULES="Always mark issues that violate the following rules with a severity of 8 or higher (high and above):"
-                + self.custom_rules,
-            )
-            + custom_context
+        prompt = self._build_prompt(run, diff_data, custom_context)
+        custom_model = {"model": self.default_model}
+        resp, _ = self.provider.chat_completion_with_json(
+            prompt,
+            user=user,
+            messages=self._build_messages(run, prompt),
+            custom_model=custom_model,
+            **self._stream_options(run, not reeval_response),
         )
+
+        if reeval_response:
+            resp = self._reevaluate_response(run, prompt, resp, user)
+
+        return resp.get("review", []), resp.get("code_quality_percentage", None)
+
+    async def _aprocess_file_chunk(
+        self,
+        run: _ReviewRun,
+        diff_data: str,
+        pull_request_title: str,
+        pull_request_desc: str,
+        user: Optional[str],
+        reeval_response: bool,
+        custom_context: str,
+    ) -> Optional[Tuple[List[Dict], Optional[float]]]:
+        if not diff_data:
+            return None
+        prompt = self._build_prompt(run, diff_data, custom_context)
         custom_model = {"model": self.default_model}
-        resp, usage = self.provider.chat_completion_with_json(
-            prompt, user=user, custom_model=custom_model
+        resp, _ = await self.provider.achat_completion_with_json(
+            prompt,
+            user=user,
+            messages=self._build_messages(run, prompt),
+            custom_model=custom_model,
+            **self._stream_options(run, not reeval_response),
         )
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
 
         if reeval_response:
-            resp = self._reevaluate_response(prompt, resp, custom_context, user)
+            resp = await self._areevaluate_response(run, prompt, resp, user)
 
         return resp.get("review", []), resp.get("code_quality_percentage", None)
 
-    def _reevaluate_response(
-        self, prompt: str, resp: str, custom_context: str, user: Optional[str]
-    ) -> str:
+    def _build_reevaluation_messages(self, prompt: str, resp: Dict) -> Tuple[str, List]:
         new_prompt = PR_REVIEW_EVALUATION_PROMPT.format(
             ACTUAL_PROMPT=prompt, LLM_OUTPUT=json.dumps(resp)
         )
-        messages = [
-            {"role": "system", "content": self.provider.system_prompt},
-            {"role": "user", "content": new_prompt},
-        ]
+        messages = self.provider.build_messages(new_prompt, self.system_prompt)
+        return new_prompt, messages
+
+    def _reevaluate_response(
+        self, run: _ReviewRun, prompt: str, resp: str, user: Optional[str]
+    ) -> str:
+        new_prompt, messages = self._build_reevaluation_messages(prompt, resp)
         custom_model = {"model": self.default_model}
-        resp, usage = self.provider.chat_completion_with_json(
-            new_prompt, user=user, messages=messages, custom_model=custom_model
-        )
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
+        with tracing.span("reevaluate"):
+            resp, _ = self.provider.chat_completion_with_json(
+                new_prompt,
+                user=user,
+                messages=messages,
+                custom_model=custom_model,
+                **self._stream_options(run, True),
+            )
+        return resp
+
+    async def _areevaluate_response(
+        self, run: _ReviewRun, prompt: str, resp: str, user: Optional[str]
+    ) -> str:
+        new_prompt, messages = self._build_reevaluation_messages(prompt, resp)
+        custom_model = {"model": self.default_model}
+        with tracing.span("reevaluate"):
+            resp, _ = await self.provider.achat_completion_with_json(
+                new_prompt,
+                user=user,
+                messages=messages,
+                custom_model=custom_model,
+                **self._stream_options(run, True),
+            )
         return resp
 
     @staticmethod
@@ -342,18 +647,18 @@ class CodeReviewer:
             categories.setdefault(review["category"], []).append(review)
         return categories
 
-    def check_sensitive_files(self, pull_request_files: list):
+    def check_sensitive_files(self, pull_request_files):
         reviews = []
+        diff = pull_request_files
+        if not isinstance(diff, Diff):
+            diff = Diff.from_pr_files(pull_request_files)
 
         for category, patterns in sensitive_files.items():
-            for patch_data in pull_request_files:
-                file_name = patch_data.get("filename", "").replace(" ", "")
+            for file_diff in diff:
+                file_name = file_diff.file_name.replace(" ", "")
                 for pattern in patterns:
                     if fnmatch.fnmatch(file_name, pattern):
-                        patch = patch_data.get("patch", "")
-                        line = 1
-                        if patch:
-                            line = patch.split(" ")[2].split(",")[0][1:]
+                        line = file_diff.first_changed_line()
                         reviews.append(
                             {
                                 "category": category,
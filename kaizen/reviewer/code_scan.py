@@ -1,11 +1,13 @@
 from typing import Optional, List, Dict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from kaizen.llms.provider import LLMProvider
+from kaizen.llms.usage import UsageTracker, usage_scope
 from kaizen.llms.prompts.code_scan_prompts import (
     CODE_SCAN_SYSTEM_PROMPT,
     CODE_SCAN_PROMPT,
     CODE_SCAN_REEVALUATION_PROMPT,
 )
+from kaizen.helpers import tracing
 from kaizen.helpers.patterns import ignore_patterns
 import re
 from pathlib import Path
@@ -23,6 +25,8 @@ class CodeScanOutput:
     model_name: str
     total_files: int
     files_processed: int
+    # Seconds spent per stage, see `kaizen.helpers.tracing`
+    timings: Dict[str, float] = field(default_factory=dict)
 
 
 class CodeScanner:
@@ -30,18 +34,15 @@ class CodeScanner:
         self.logger = logging.getLogger(__name__)
         self.provider = llm_provider
         # self.provider.model = self.provider.model_group_to_name["best"][0]
-        self.provider.system_prompt = CODE_SCAN_SYSTEM_PROMPT
+        self.system_prompt = CODE_SCAN_SYSTEM_PROMPT
         self.reevaluate = False
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
         self.logger.info(f"CodeScanner initialized with model: {self.provider.model}")
 
     def is_code_review_prompt_within_limit(self, file_data: str) -> bool:
         prompt = CODE_SCAN_PROMPT.format(FILE_DATA=file_data)
-        result = self.provider.is_inside_token_limit(PROMPT=prompt)
+        result = self.provider.is_inside_token_limit(
+            PROMPT=prompt, system_prompt=self.system_prompt
+        )
         self.logger.debug(f"Prompt within token limit: {result}")
         return result
 
@@ -56,6 +57,12 @@ class CodeScanner:
             self.logger.debug(f"Ignoring file: {file_path}")
         return should_ignore
 
+    def _iter_scan_files(self, dir_path: str):
+        for file_path in Path(dir_path).rglob("*.*"):
+            if self.should_ignore(file_path):
+                continue
+            yield file_path
+
     def review_code_dir(
         self,
         dir_path: str,
@@ -66,89 +73,201 @@ class CodeScanner:
         self.logger.info(f"Starting code review for directory: {dir_path}")
         self.reevaluate = reevaluate
 
-        issues = []
-        files_processed = 0
-        for file_path in Path(dir_path).rglob("*.*"):
-            if self.should_ignore(file_path):
-                continue
-            try:
-                with open(str(file_path), "r") as f:
-                    file_data = f.read()
-                if max_files and files_processed >= max_files:
-                    self.logger.info(f"Max files processed: {max_files}")
-                    break
-                self.logger.debug(f"Reviewing file: {file_path}")
-                code_scan_output = self.review_code(file_data=file_data, user=user)
-                files_processed += 1
-                for issue in code_scan_output.issues:
-                    issue["file_path"] = str(file_path)
-                    issues.append(issue)
-            except Exception as e:
-                self.logger.error(
-                    f"Error reviewing file {file_path}: {e}", exc_info=True
-                )
-
-        self.logger.info(f"Completed code review for directory: {dir_path}")
-        return CodeScanOutput(
-            usage=self.total_usage,
-            model_name=self.provider.model,
-            issues=issues,
-            total_files=files_processed,
-            files_processed=files_processed,
-        )
+        # Usage and timings of the file reviews add up in these scopes
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            issues = []
+            files_processed = 0
+            for file_path in self._iter_scan_files(dir_path):
+                try:
+                    with open(str(file_path), "r") as f:
+                        file_data = f.read()
+                    if max_files and files_processed >= max_files:
+                        self.logger.info(f"Max files processed: {max_files}")
+                        break
+                    self.logger.debug(f"Reviewing file: {file_path}")
+                    code_scan_output = self.review_code(file_data=file_data, user=user)
+                    files_processed += 1
+                    for issue in code_scan_output.issues:
+                        issue["file_path"] = str(file_path)
+                        issues.append(issue)
+                except Exception as e:
+                    self.logger.error(
+                        f"Error reviewing file {file_path}: {e}", exc_info=True
+                    )
 
-    def review_code(self, file_data: str, user: Optional[str] = None) -> CodeScanOutput:
-        self.logger.debug("Starting code review for file")
+            self.logger.info(f"Completed code review for directory: {dir_path}")
+            return CodeScanOutput(
+                usage=usage.snapshot(),
+                model_name=usage.model or self.provider.model,
+                issues=issues,
+                total_files=files_processed,
+                files_processed=files_processed,
+                timings=timings.snapshot(),
+            )
+
+    async def areview_code_dir(
+        self,
+        dir_path: str,
+        reevaluate: bool = False,
+        user: Optional[str] = None,
+        max_files: Optional[int] = None,
+    ):
+        self.logger.info(f"Starting code review for directory: {dir_path}")
+        self.reevaluate = reevaluate
+
+        # Usage and timings of the file reviews add up in these scopes
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            issues = []
+            files_processed = 0
+            for file_path in self._iter_scan_files(dir_path):
+                try:
+                    with open(str(file_path), "r") as f:
+                        file_data = f.read()
+                    if max_files and files_processed >= max_files:
+                        self.logger.info(f"Max files processed: {max_files}")
+                        break
+                    self.logger.debug(f"Reviewing file: {file_path}")
+                    code_scan_output = await self.areview_code(
+                        file_data=file_data, user=user
+                    )
+                    files_processed += 1
+                    for issue in code_scan_output.issues:
+                        issue["file_path"] = str(file_path)
+                        issues.append(issue)
+                except Exception as e:
+                    self.logger.error(
+                        f"Error reviewing file {file_path}: {e}", exc_info=True
+                    )
+
+            self.logger.info(f"Completed code review for directory: {dir_path}")
+            return CodeScanOutput(
+                usage=usage.snapshot(),
+                model_name=usage.model or self.provider.model,
+                issues=issues,
+                total_files=files_processed,
+                files_processed=files_processed,
+                timings=timings.snapshot(),
+            )
+
+    def _build_scan_prompt(self, file_data: str) -> str:
         prompt = CODE_SCAN_PROMPT.format(FILE_DATA=self._add_line_numbers(file_data))
         if not file_data:
             self.logger.error("file_data is empty!")
             raise Exception("file_data is empty!")
 
-        if not self.provider.is_inside_token_limit(PROMPT=prompt):
+        if not self.provider.is_inside_token_limit(
+            PROMPT=prompt, system_prompt=self.system_prompt
+        ):
             self.logger.error("file_data bigger than model token limit")
             raise Exception("file_data bigger than model token limit")
+        return prompt
 
-        issues = self._process_file_data(prompt, user)
-        if self.reevaluate:
-            self.logger.info("Starting reevaluation of issues")
-            issues = self._reevaluate_issues(file_data, issues, user)
+    def _build_scan_output(
+        self, issues: List[Dict], usage: UsageTracker, timings: tracing.Timings
+    ) -> CodeScanOutput:
         self.logger.debug(f"Completed code review. Found {len(issues)} issues.")
-
         return CodeScanOutput(
-            usage=self.total_usage,
-            model_name=self.provider.model,
+            usage=usage.snapshot(),
+            model_name=usage.model or self.provider.model,
             issues=issues,
             total_files=1,
             files_processed=1,
+            timings=timings.snapshot(),
         )
 
+    def review_code(self, file_data: str, user: Optional[str] = None) -> CodeScanOutput:
+        self.logger.debug("Starting code review for file")
+        # Nested in the usage and timings of a directory scan, if any
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt = self._build_scan_prompt(file_data)
+
+            issues = self._process_file_data(prompt, user)
+            if self.reevaluate:
+                self.logger.info("Starting reevaluation of issues")
+                with tracing.span("reevaluate"):
+                    issues = self._reevaluate_issues(file_data, issues, user)
+
+            return self._build_scan_output(issues, usage, timings)
+
+    async def areview_code(
+        self, file_data: str, user: Optional[str] = None
+    ) -> CodeScanOutput:
+        self.logger.debug("Starting code review for file")
+        # Nested in the usage and timings of a directory scan, if any
+        with tracing.timing_scope() as timings, usage_scope() as usage:
+            prompt = self._build_scan_prompt(file_data)
+
+            issues = await self._aprocess_file_data(prompt, user)
+            if self.reevaluate:
+                self.logger.info("Starting reevaluation of issues")
+                with tracing.span("reevaluate"):
+                    issues = await self._areevaluate_issues(file_data, issues, user)
+
+            return self._build_scan_output(issues, usage, timings)
+
     def _process_file_data(self, prompt: str, user: Optional[str]) -> List[Dict]:
         self.logger.debug("Processing file data with LLM")
         resp, usage = self.provider.chat_completion_with_json(
-            prompt, user=user, model="default"
+            prompt, user=user, model="default", system_prompt=self.system_prompt
         )
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
         self.logger.info(f"LLM usage for this file: {usage}")
         return resp["issues"]
 
-    def _reevaluate_issues(
-        self, file_data: str, issues: List[Dict], user: Optional[str]
-    ) -> List[Dict]:
+    async def _aprocess_file_data(self, prompt: str, user: Optional[str]) -> List[Dict]:
+        self.logger.debug("Processing file data with LLM")
+        resp, usage = await self.provider.achat_completion_with_json(
+            prompt, user=user, model="default", system_prompt=self.system_prompt
+        )
+        self.logger.info(f"LLM usage for this file: {usage}")
+        return resp["issues"]
+
+    def _build_reevaluation_prompt(
+        self, file_data: str, issues: List[Dict]
+    ) -> Optional[str]:
         self.logger.debug("Reevaluating issues")
         reevaluation_prompt = CODE_SCAN_REEVALUATION_PROMPT.format(
             FILE_DATA=file_data, ISSUES=json.dumps({"issues": issues}, indent=2)
         )
 
-        if not self.provider.is_inside_token_limit(PROMPT=reevaluation_prompt):
+        if not self.provider.is_inside_token_limit(
+            PROMPT=reevaluation_prompt, system_prompt=self.system_prompt
+        ):
             self.logger.warning(
                 "Reevaluation prompt exceeds token limit. Skipping reevaluation."
             )
+            return None
+        return reevaluation_prompt
+
+    def _reevaluate_issues(
+        self, file_data: str, issues: List[Dict], user: Optional[str]
+    ) -> List[Dict]:
+        reevaluation_prompt = self._build_reevaluation_prompt(file_data, issues)
+        if reevaluation_prompt is None:
             return issues
 
         resp, usage = self.provider.chat_completion_with_json(
-            reevaluation_prompt, user=user, model="default"
+            reevaluation_prompt,
+            user=user,
+            model="default",
+            system_prompt=self.system_prompt,
+        )
+        self.logger.info(f"LLM usage for reevaluation: {usage}")
+
+        return resp.get("issues", issues)
+
+    async def _areevaluate_issues(
+        self, file_data: str, issues: List[Dict], user: Optional[str]
+    ) -> List[Dict]:
+        reevaluation_prompt = self._build_reevaluation_prompt(file_data, issues)
+        if reevaluation_prompt is None:
+            return issues
+
+        resp, usage = await self.provider.achat_completion_with_json(
+            reevaluation_prompt,
+            user=user,
+            model="default",
+            system_prompt=self.system_prompt,
         )
-        self.total_usage = self.provider.update_usage(self.total_usage, usage)
         self.logger.info(f"LLM usage for reevaluation: {usage}")
 
         return resp.get("issues", issues)
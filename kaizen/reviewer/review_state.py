@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from kaizen.helpers.diff import Diff
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REVIEW_STATE_PATH = os.path.expanduser("~/.kaizen/cache/review_state.db")
+
+
+class ReviewStateStore:
+    """
+    Last reviewed head commit and issues of every pull request, backed by SQLite.
+
+    Lets a push to a pull request be reviewed incrementally: only the commits
+    since the stored head are reviewed and the stored issues are carried
+    forward with `carry_forward_issues`.
+    """
+
+    def __init__(self, path: str = DEFAULT_REVIEW_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reviews (
+                repo TEXT NOT NULL,
+                pull_number INTEGER NOT NULL,
+                head_sha TEXT NOT NULL,
+                issues TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (repo, pull_number)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, repo: str, pull_number: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT head_sha, issues FROM reviews "
+                "WHERE repo = ? AND pull_number = ?",
+                (repo, pull_number),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"head_sha": row[0], "issues": json.loads(row[1])}
+
+    def set(
+        self, repo: str, pull_number: int, head_sha: str, issues: List[Dict]
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reviews "
+                "(repo, pull_number, head_sha, issues, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (repo, pull_number, head_sha, json.dumps(issues), time.time()),
+            )
+            self._conn.commit()
+
+    def delete(self, repo: str, pull_number: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM reviews WHERE repo = ? AND pull_number = ?",
+                (repo, pull_number),
+            )
+            self._conn.commit()
+
+
+def _line(issue: Dict, key: str) -> Optional[int]:
+    try:
+        return int(issue[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def carry_forward_issues(issues: List[Dict], diff: Diff) -> List[Dict]:
+    """
+    Return the issues of the previous review that `diff`, the changes pushed
+    since then, does not touch, with their lines and paths moved to match
+    the new head. Issues on changed lines are dropped, the changed hunks are
+    reviewed again.
+
+    Issues on the `LEFT` side point at lines of the pull request's base, which
+    `diff` does not move. They are kept as they are in untouched files and
+    dropped in changed ones, where the lines may no longer be part of the pull
+    request's diff.
+    """
+    changed = {
+        file_diff.previous_file_name or file_diff.file_name: file_diff
+        for file_diff in diff
+    }
+    carried = []
+    for issue in issues:
+        file_diff = changed.get(issue.get("file_path"))
+        if file_diff is None:
+            carried.append(issue)
+            continue
+        if file_diff.status == "removed" or issue.get("side") == "LEFT":
+            continue
+        if not file_diff.hunks and file_diff.status != "renamed":
+            # The patch is missing, e.g. for binary or very large files
+            continue
+        start, end = _line(issue, "start_line"), _line(issue, "end_line")
+        if start is None:
+            continue
+        lines = file_diff.map_lines(start, end if end is not None else start)
+        if lines is None:
+            continue
+        carried.append(
+            dict(
+                issue,
+                file_path=file_diff.file_name,
+                start_line=lines[0],
+                end_line=lines[1],
+            )
+        )
+    logger.debug(f"Carried forward {len(carried)} of {len(issues)} issues")
+    return carried
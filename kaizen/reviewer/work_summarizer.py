@@ -1,6 +1,7 @@
 from typing import Optional, List, Dict
 from kaizen.llms.provider import LLMProvider
-from kaizen.helpers import parser
+from kaizen.llms.usage import usage_scope
+from kaizen.helpers import chunking, parser
 from kaizen.llms.prompts.work_summary_prompts import (
     WORK_SUMMARY_PROMPT,
     WORK_SUMMARY_SYSTEM_PROMPT,
@@ -18,54 +19,64 @@ class WorkSummaryGenerator:
         self.provider = LLMProvider(
             system_prompt=WORK_SUMMARY_SYSTEM_PROMPT, default_temperature=0.1
         )
-        self.total_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-        }
+
+    def _chunk_file_diffs(self, diff_file_data: List[Dict]) -> List[str]:
+        available_tokens = self.provider.available_tokens(WORK_SUMMARY_PROMPT)
+        # Merge the files into as few prompts as the LLM can process
+        diff_parts = [
+            f"""\n---->\nFile Name: {file_dict["file"]}\nPatch: {file_dict["patch"]}\n Status: {file_dict["status"]}"""
+            for file_dict in diff_file_data
+        ]
+        return chunking.pack_chunks(
+            diff_parts, available_tokens, self.provider.get_token_count
+        )
 
     def generate_work_summaries(
         self,
         diff_file_data: List[Dict],
         user: Optional[str] = None,
     ):
-        available_tokens = self.provider.available_tokens(WORK_SUMMARY_PROMPT)
         summaries = []
-        # Try to merge the files untill LLM can process the response
-        combined_diff_data = ""
-        for file_dict in diff_file_data:
-            temp_prompt = combined_diff_data
-            temp_prompt += f"""\n---->\nFile Name: {file_dict["file"]}\nPatch: {file_dict["patch"]}\n Status: {file_dict["status"]}"""
+        with usage_scope() as usage:
+            for combined_diff_data in self._chunk_file_diffs(diff_file_data):
+                prompt = WORK_SUMMARY_PROMPT.format(PATCH_DATA=combined_diff_data)
+                response, _ = self.provider.chat_completion_with_json(prompt, user=user)
+                summaries.append(response)
 
-            # If available tokens is greated than the new prompt size, process it.
-            if available_tokens - self.provider.get_token_count(temp_prompt) > 0:
-                combined_diff_data = temp_prompt
-                continue
+            if len(summaries) > 1:
+                # TODO Merge summaries
+                prompt = MERGE_WORK_SUMMARY_PROMPT.format(
+                    SUMMARY_JSON=json.dumps(summaries)
+                )
+                response, _ = self.provider.chat_completion_with_json(prompt, user=user)
+                summaries = [response]
 
-            # Process the prompt
-            prompt = WORK_SUMMARY_PROMPT.format(PATCH_DATA=combined_diff_data)
-            response, usage = self.provider.chat_completion_with_json(prompt, user=user)
-            self.total_usage = self.provider.update_usage(self.total_usage, usage)
-            summaries.append(response)
-            combined_diff_data = ""
+        return {"summary": summaries[0], "usage": usage.snapshot()}
 
-        if combined_diff_data != "":
-            # process the remaining file diff pending
-            prompt = WORK_SUMMARY_PROMPT.format(PATCH_DATA=combined_diff_data)
-            response, usage = self.provider.chat_completion_with_json(prompt, user=user)
-            summaries.append(response)
-            combined_diff_data = ""
-            self.total_usage = self.provider.update_usage(self.total_usage, usage)
+    async def agenerate_work_summaries(
+        self,
+        diff_file_data: List[Dict],
+        user: Optional[str] = None,
+    ):
+        summaries = []
+        with usage_scope() as usage:
+            for combined_diff_data in self._chunk_file_diffs(diff_file_data):
+                prompt = WORK_SUMMARY_PROMPT.format(PATCH_DATA=combined_diff_data)
+                response, _ = await self.provider.achat_completion_with_json(
+                    prompt, user=user
+                )
+                summaries.append(response)
 
-        if len(summaries) > 1:
-            # TODO Merge summaries
-            prompt = MERGE_WORK_SUMMARY_PROMPT.format(
-                SUMMARY_JSON=json.dumps(summaries)
-            )
-            response, usage = self.provider.chat_completion_with_json(prompt, user=user)
-            summaries = [response]
+            if len(summaries) > 1:
+                prompt = MERGE_WORK_SUMMARY_PROMPT.format(
+                    SUMMARY_JSON=json.dumps(summaries)
+                )
+                response, _ = await self.provider.achat_completion_with_json(
+                    prompt, user=user
+                )
+                summaries = [response]
 
-        return {"summary": summaries[0], "usage": self.total_usage}
+        return {"summary": summaries[0], "usage": usage.snapshot()}
 
     def generate_twitter_post(
         self,
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+os.environ.setdefault("GITHUB_API_BASE_URL", "https://api.github.com")
+
+from github_app.github_helper import pull_requests  # noqa: E402
+from kaizen.reviewer.review_state import ReviewStateStore  # noqa: E402
+
+PATCH = """@@ -5,1 +5,2 @@
+-    step(1)
++    step(2)
++    step(3)"""
+
+
+def payload(action, head_sha="b2"):
+    return {
+        "action": action,
+        "repository": {"full_name": "org/repo"},
+        "installation": {"id": 1},
+        "pull_request": {"number": 7, "head": {"sha": head_sha}},
+    }
+
+
+def commit(sha, parents=1):
+    return {"sha": sha, "parents": [{"sha": f"p{i}"} for i in range(parents)]}
+
+
+def comparison(*commits, files=None):
+    return {
+        "status": "ahead",
+        "total_commits": len(commits),
+        "commits": list(commits),
+        "files": files
+        or [{"filename": "app.py", "status": "modified", "patch": PATCH}],
+    }
+
+
+@pytest.fixture
+def github(monkeypatch):
+    store = ReviewStateStore(path=":memory:")
+    calls = []
+    responses = {"compare": comparison(commit("b2"))}
+
+    def get_compare(url, token):
+        calls.append(("compare", url))
+        return responses["compare"]
+
+    monkeypatch.setattr(pull_requests, "_get_review_state", lambda: store)
+    monkeypatch.setattr(
+        pull_requests, "get_installation_access_token", lambda *args: "token"
+    )
+    monkeypatch.setattr(pull_requests, "get_compare", get_compare)
+    monkeypatch.setattr(
+        pull_requests,
+        "get_diff_text",
+        lambda url, token: calls.append(("diff", url)) or "full diff",
+    )
+    monkeypatch.setattr(
+        pull_requests,
+        "get_pr_files",
+        lambda url, token: calls.append(("files", url)) or [{"filename": "all.py"}],
+    )
+    return store, calls, responses
+
+
+def issue(file_path, start_line, side=None):
+    issue = {"file_path": file_path, "start_line": start_line, "end_line": start_line}
+    if side:
+        issue["side"] = side
+    return issue
+
+
+def test_review_data_without_state_reviews_everything(github):
+    _, calls, _ = github
+    diff_text, files, carried = pull_requests._fetch_review_data(payload("synchronize"))
+    assert (diff_text, files, carried) == ("full diff", [{"filename": "all.py"}], None)
+    assert [kind for kind, _ in calls] == ["diff", "files"]
+
+
+def test_review_data_reviews_new_commits(github):
+    store, calls, _ = github
+    store.set(
+        "org/repo",
+        7,
+        "a1",
+        [issue("app.py", 3), issue("app.py", 5), issue("app.py", 9), issue("x.py", 1)],
+    )
+    diff_text, files, carried = pull_requests._fetch_review_data(payload("synchronize"))
+    assert diff_text == ""
+    assert [f["filename"] for f in files] == ["app.py"]
+    assert [(i["file_path"], i["start_line"]) for i in carried] == [
+        ("app.py", 3),
+        ("app.py", 10),
+        ("x.py", 1),
+    ]
+    assert calls == [
+        (
+            "compare",
+            pull_requests.GITHUB_API_BASE_URL + "/repos/org/repo/compare/a1...b2",
+        )
+    ]
+
+
+def test_review_data_keeps_left_side_issues_of_untouched_files(github):
+    store, _, _ = github
+    store.set(
+        "org/repo",
+        7,
+        "a1",
+        [issue("app.py", 3, side="LEFT"), issue("x.py", 4, side="LEFT")],
+    )
+    _, _, carried = pull_requests._fetch_review_data(payload("synchronize"))
+    assert carried == [issue("x.py", 4, side="LEFT")]
+
+
+@pytest.mark.parametrize(
+    "compare",
+    [
+        # The base branch was merged into the pull request
+        comparison(commit("m1", parents=2), commit("b2")),
+        # More commits than the compare API lists
+        dict(comparison(commit("b2")), total_commits=251),
+        # A force push
+        dict(comparison(commit("b2")), status="diverged"),
+    ],
+)
+def test_review_data_falls_back_to_full_review(github, compare):
+    store, calls, responses = github
+    store.set("org/repo", 7, "a1", [issue("app.py", 3)])
+    responses["compare"] = compare
+    _, files, carried = pull_requests._fetch_review_data(payload("synchronize"))
+    assert (files, carried) == ([{"filename": "all.py"}], None)
+    assert [kind for kind, _ in calls] == ["compare", "diff", "files"]
+
+
+def test_review_data_for_other_actions_reviews_everything(github):
+    store, calls, _ = github
+    store.set("org/repo", 7, "a1", [issue("app.py", 3)])
+    _, _, carried = pull_requests._fetch_review_data(payload("opened"))
+    assert carried is None
+    assert [kind for kind, _ in calls] == ["diff", "files"]
@@ -0,0 +1,103 @@
+import pytest
+from kaizen.helpers.chunking import (
+    pack_chunks,
+    render_file_parts,
+    split_file_diff,
+    SEQUENTIAL,
+    FIRST_FIT_DECREASING,
+)
+from kaizen.helpers.diff import CONTEXT, Diff, FileDiff
+
+
+def count_tokens(text):
+    return len(text)
+
+
+def test_sequential_keeps_order():
+    parts = ["aaaa", "bb", "cccc", "d"]
+    chunks = pack_chunks(parts, 6, count_tokens, strategy=SEQUENTIAL)
+    assert chunks == ["aaaabb", "ccccd"]
+
+
+def test_first_fit_decreasing_fills_chunks():
+    parts = ["aaaa", "bbbbb", "cc", "d"]
+    chunks = pack_chunks(parts, 6, count_tokens, strategy=FIRST_FIT_DECREASING)
+    assert chunks == ["aaaacc", "bbbbbd"]
+    assert len(pack_chunks(parts, 6, count_tokens, strategy=SEQUENTIAL)) == 3
+
+
+def test_each_part_is_tokenized_once():
+    calls = []
+
+    def counting_tokens(text):
+        calls.append(text)
+        return len(text)
+
+    parts = ["a" * n for n in range(1, 20)]
+    pack_chunks(parts, 10, counting_tokens)
+    assert sorted(calls) == sorted(parts)
+
+
+def test_precomputed_token_counts_are_reused():
+    def fail(text):
+        raise AssertionError("parts should not be tokenized again")
+
+    chunks = pack_chunks(["aa", "bb", "cc"], 4, fail, token_counts=[2, 2, 2])
+    assert chunks == ["aabb", "cc"]
+
+
+def test_oversized_part_gets_its_own_chunk():
+    chunks = pack_chunks(["a" * 20, "bb"], 10, count_tokens)
+    assert chunks == ["a" * 20, "bb"]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        pack_chunks(["a"], 10, count_tokens, strategy="random")
+
+
+def test_split_file_diff_groups_hunks():
+    patch = "\n".join(
+        f"@@ -{n},1 +{n},1 @@\n-old {n}\n+new {n}" for n in (10, 20, 30, 40)
+    )
+    file_diff = Diff.from_patch(patch).files[0]
+    budget = count_tokens(FileDiff("", file_diff.hunks[:2]).render())
+    pieces = split_file_diff(file_diff, budget, count_tokens)
+    assert [len(piece.hunks) for piece in pieces] == [2, 2]
+
+
+def test_split_file_diff_cuts_large_hunk_with_overlap():
+    lines = [f"+line {n}" for n in range(1, 41)]
+    patch = "@@ -0,0 +1,40 @@\n" + "\n".join(lines)
+    file_diff = Diff.from_patch(patch).files[0]
+    budget = count_tokens(file_diff.render()) // 4
+    pieces = split_file_diff(file_diff, budget, count_tokens, overlap=2)
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert count_tokens(piece.render()) <= budget
+    second = pieces[1].hunks[0]
+    # The overlap is kept as context and line numbers follow the new file
+    assert bytes(second.kinds[:2]) == bytes([CONTEXT, CONTEXT])
+    rendered = pieces[1].render()
+    first_added = second.lines[2]
+    line_number = int(first_added.split()[1])
+    assert f"[LINE {line_number:<5}] [UPDATED] {first_added}" in rendered
+    updated = [
+        line
+        for piece in pieces
+        for line in piece.render().splitlines()
+        if "UPDATED" in line
+    ]
+    assert updated == file_diff.render().splitlines()[3:]
+
+
+def test_render_file_parts_repeats_header():
+    patch = "@@ -0,0 +1,40 @@\n" + "\n".join(f"+line {n}" for n in range(1, 41))
+    file_diff = Diff.from_patch(patch).files[0]
+    header = "File Name: big.py\n"
+    assert render_file_parts(file_diff, header, 10**6, count_tokens) == [
+        header + file_diff.render()
+    ]
+    parts = render_file_parts(file_diff, header, 400, count_tokens)
+    assert len(parts) > 1
+    assert all(part.startswith(header) and len(part) <= 400 for part in parts)
@@ -0,0 +1,116 @@
+import io
+from kaizen.helpers.diff import Diff, iter_hunks, ADDED, REMOVED, CONTEXT
+from kaizen.helpers.parser import patch_to_combined_chunks, iter_combined_chunks
+
+DIFF = """diff --git a/app/main.py b/app/main.py
+index 1436a23..ffd0282 100644
+--- a/app/main.py
++++ b/app/main.py
+@@ -8,3 +8,4 @@ def main():
+     start = time.time()
+-    run(7)
++    run(14)
++    log()
+     stop = time.time()
+\\ No newline at end of file
+diff --git a/app/new.py b/app/new.py
+new file mode 100644
+index 0000000..e35d38c
+--- /dev/null
++++ b/app/new.py
+@@ -0,0 +1,2 @@
++import os
++print(os.getcwd())
+"""
+
+GITHUB_FILE_PATCH = """@@ -1,3 +1,3 @@ class Config:
+ a = 1
+-b = 2
++b = 3
+ c = 4
+@@ -20 +20 @@
+-x = None
++x = {}"""
+
+
+def test_iter_hunks_parses_files_and_ranges():
+    hunks = list(iter_hunks(io.StringIO(DIFF)))
+    assert [(h.file_name, h.old_start, h.new_start) for h in hunks] == [
+        ("app/main.py", 8, 8),
+        ("app/new.py", 0, 1),
+    ]
+    first = hunks[0]
+    assert first.section == "def main():"
+    assert bytes(first.kinds) == bytes([CONTEXT, REMOVED, ADDED, ADDED, CONTEXT])
+    assert first.lines[1] == "    run(7)"
+
+
+def test_hunk_counts_without_lengths():
+    hunks = list(iter_hunks(GITHUB_FILE_PATCH.splitlines(), file_name="config.py"))
+    assert len(hunks) == 2
+    assert hunks[1].file_name == "config.py"
+    assert (hunks[1].old_count, hunks[1].new_count) == (1, 1)
+
+
+def test_render_matches_combined_chunks():
+    for ignore_deletions in (False, True):
+        rendered = []
+        for hunk in iter_hunks(GITHUB_FILE_PATCH.splitlines()):
+            rendered.append("\n")
+            rendered.extend(hunk.render(ignore_deletions))
+        assert "\n".join(rendered) == patch_to_combined_chunks(
+            GITHUB_FILE_PATCH, ignore_deletions
+        )
+
+
+def test_iter_combined_chunks_streams_file_objects():
+    streamed = "\n".join(iter_combined_chunks(io.StringIO(DIFF)))
+    assert streamed == patch_to_combined_chunks(DIFF)
+    assert "[LINE 9    ] [UPDATED]     run(14)" in streamed
+    assert "/dev/null" not in streamed
+
+
+def test_diff_from_patch_and_pr_files():
+    diff = Diff.from_patch(DIFF)
+    assert diff.file_names == ["app/main.py", "app/new.py"]
+    assert diff.get("app/new.py").first_changed_line() == 1
+
+    pr_files = [
+        {"filename": "config.py", "status": "modified", "patch": GITHUB_FILE_PATCH},
+        {"filename": "logo.png", "status": "added"},
+    ]
+    diff = Diff.from_pr_files(pr_files)
+    assert len(diff) == 2
+    config = diff.get("config.py")
+    assert config.render() == patch_to_combined_chunks(GITHUB_FILE_PATCH)
+    assert config.to_patch() == GITHUB_FILE_PATCH
+    assert diff.get("logo.png").hunks == []
+    assert diff.get("logo.png").first_changed_line() == 1
+
+
+def test_file_diff_to_patch_round_trips():
+    file_diff = Diff.from_patch(GITHUB_FILE_PATCH).files[0]
+    assert Diff.from_patch(file_diff.to_patch()).files[0].render() == (
+        file_diff.render()
+    )
+
+
+def test_file_diff_maps_untouched_lines():
+    file_diff = Diff.from_pr_files(
+        [{"filename": "config.py", "status": "modified", "patch": GITHUB_FILE_PATCH}]
+    ).get("config.py")
+    assert file_diff.map_lines(1, 1) == (1, 1)
+    assert file_diff.map_lines(2, 2) is None
+    assert file_diff.map_lines(1, 3) is None
+    assert file_diff.map_lines(10, 19) == (10, 19)
+    assert file_diff.map_lines(20, 20) is None
+
+    added = Diff.from_patch(DIFF).get("app/main.py")
+    # Two lines replace line 9
+    assert added.map_lines(8, 8) == (8, 8)
+    assert added.map_lines(9, 9) is None
+    assert added.map_lines(10, 12) == (11, 13)
+    inserted = Diff.from_patch("@@ -3,0 +4,2 @@\n+a\n+b").files[0]
+    assert inserted.map_lines(1, 3) == (1, 3)
+    assert inserted.map_lines(3, 4) is None
+    assert inserted.map_lines(4, 5) == (6, 7)
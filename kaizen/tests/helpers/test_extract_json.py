@@ -0,0 +1,53 @@
+import json
+import pytest
+from kaizen.helpers.parser import JsonStreamParser, extract_json, json_stats
+
+
+def test_plain_and_fenced_json():
+    assert extract_json('{"review": []}') == {"review": []}
+    text = 'Here is the review:\n```json\n{"review": [{"line": 1}]}\n```\nThanks {x}'
+    assert extract_json(text) == {"review": [{"line": 1}]}
+
+
+def test_balanced_object_ignores_trailing_text():
+    text = 'Result: {"a": "}", "b": {"c": 1}} and {"something": "else"}'
+    assert extract_json(text) == {"a": "}", "b": {"c": 1}}
+
+
+def test_repairs_trailing_commas_and_newlines():
+    json_stats.clear()
+    text = '{"review": [{"fixed_code": "a = 1\nb = 2",},],}'
+    assert extract_json(text) == {"review": [{"fixed_code": "a = 1\nb = 2"}]}
+    assert json_stats["repaired"] == 1
+
+
+def test_repairs_truncated_response():
+    text = '{"review": [{"description": "Missing check", "severity": 8}, {"description": "Unclo'
+    assert extract_json(text) == {
+        "review": [
+            {"description": "Missing check", "severity": 8},
+            {"description": "Unclo"},
+        ]
+    }
+
+
+def test_unparseable_response_is_counted():
+    json_stats.clear()
+    with pytest.raises(json.JSONDecodeError):
+        extract_json("no json here")
+    assert json_stats["failed"] == 1
+
+
+def test_stream_parser_yields_items_as_they_complete():
+    parser = JsonStreamParser()
+    assert parser.feed('Sure!\n```json\n{"code_quality": 80, "review": [{"a"') == []
+    assert parser.feed(': "}"}, {"b": [1,') == [{"a": "}"}]
+    assert parser.feed(" 2]}]}\n```") == [{"b": [1, 2]}]
+    assert parser.done
+
+
+def test_stream_parser_fails_early_on_malformed_output():
+    with pytest.raises(json.JSONDecodeError):
+        JsonStreamParser().feed('{"review": [{"a": 1]}')
+    with pytest.raises(json.JSONDecodeError):
+        JsonStreamParser(max_prefix=10).feed("I cannot review this code, sorry.")
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import patch
+from kaizen.helpers.general import RetryPolicy, retry
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers=None):
+        super().__init__("rate limited")
+        self.headers = headers or {}
+
+
+class AuthenticationError(Exception):
+    status_code = 401
+
+
+def flaky(errors, result="ok"):
+    errors = list(errors)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    func.calls = calls
+    return func
+
+
+def test_exponential_backoff_with_full_jitter():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+    with patch("kaizen.helpers.general.random.uniform", side_effect=lambda a, b: b):
+        assert [policy.get_delay(attempt) for attempt in range(1, 6)] == [
+            1,
+            2,
+            4,
+            5,
+            5,
+        ]
+    assert 0 <= RetryPolicy(base_delay=1).get_delay(3) <= 4
+
+
+def test_retry_after_header_is_respected():
+    policy = RetryPolicy(max_delay=30)
+    assert policy.get_delay(1, RateLimitError({"Retry-After": "7"})) == 7
+    assert policy.get_delay(1, RateLimitError({"retry-after-ms": "1500"})) == 1.5
+    assert policy.get_delay(1, RateLimitError({"retry-after": "120"})) == 30
+
+
+def test_error_classification():
+    policy = RetryPolicy()
+    assert policy.is_retryable(RateLimitError())
+    assert policy.is_retryable(json.JSONDecodeError("bad", "", 0))
+    assert not policy.is_retryable(ValueError("bad config"))
+    assert not policy.is_retryable(AuthenticationError())
+    only_json = RetryPolicy(only_retry_on=(json.JSONDecodeError,))
+    assert not only_json.is_retryable(RateLimitError())
+
+
+@patch("kaizen.helpers.general.time.sleep")
+def test_retries_until_success(sleep):
+    func = flaky([RateLimitError(), RateLimitError()])
+    assert RetryPolicy(max_attempts=3).call(func) == "ok"
+    assert len(func.calls) == 3
+    assert sleep.call_count == 2
+
+
+@patch("kaizen.helpers.general.time.sleep")
+def test_non_retryable_errors_are_raised_immediately(sleep):
+    func = flaky([ValueError("bad config")])
+    with pytest.raises(ValueError):
+        retry(max_attempts=3, delay=0)(func)()
+    assert len(func.calls) == 1
+    sleep.assert_not_called()
+
+
+@patch("kaizen.helpers.general.time.sleep")
+def test_deadline_stops_retrying(sleep):
+    func = flaky([RateLimitError({"retry-after": "10"})] * 3)
+    with pytest.raises(RateLimitError):
+        RetryPolicy(max_attempts=5, deadline=5).call(func)
+    assert len(func.calls) == 1
+
+
+def test_async_retry():
+    errors = [RateLimitError()]
+
+    async def func():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    policy = RetryPolicy(base_delay=0)
+    assert asyncio.run(policy.acall(func)) == "ok"
@@ -0,0 +1,40 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from kaizen.helpers import tracing
+
+
+def test_span_adds_to_current_timings():
+    with tracing.timing_scope() as timings:
+        with tracing.span("parse_diff"):
+            pass
+        with tracing.span("parse_diff"):
+            pass
+        tracing.record("llm.queue", 0.5)
+    snapshot = timings.snapshot()
+    assert timings.counts == {"parse_diff": 2, "llm.queue": 1}
+    assert snapshot["llm.queue"] == 0.5
+    assert snapshot["total"] >= snapshot["parse_diff"]
+
+
+def test_nested_scopes_forward_to_parent():
+    with tracing.timing_scope() as outer:
+
+        def work(seconds):
+            with tracing.timing_scope() as inner:
+                tracing.record("llm.request", seconds)
+                return inner.stages["llm.request"]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, work, seconds)
+                for seconds in (1, 2, 3)
+            ]
+            assert sorted(f.result() for f in futures) == [1, 2, 3]
+    assert outer.stages["llm.request"] == 6
+    assert tracing.get_current_timings() is None
+
+
+def test_span_without_scope_is_not_collected():
+    with tracing.span("format"):
+        pass
+    assert tracing.get_current_timings() is None
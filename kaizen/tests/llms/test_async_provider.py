@@ -0,0 +1,245 @@
+import asyncio
+import json
+
+import pytest
+
+from kaizen.llms import provider as provider_module
+from kaizen.llms import registry
+from kaizen.llms.budget import Budget, budget_scope
+from kaizen.llms.mock import MockProviderError
+from kaizen.llms.provider import LLMProvider
+from kaizen.llms.usage import usage_scope
+
+
+EMBEDDING_MODEL = {
+    "model_name": "embedding",
+    "litellm_params": {"model": "text-embedding-3-small"},
+    "model_info": {"dimensions": 2, "max_batch_size": 2},
+}
+
+
+@pytest.fixture
+def make_provider(tmp_path, monkeypatch):
+    def make(models, **options):
+        config = {
+            "language_model": {
+                "provider": "mock",
+                "mock": {
+                    "default_response": {"review": []},
+                    "latency": {"distribution": "constant", "median": 0.01},
+                },
+                "embedding_cache": {"path": str(tmp_path / "embeddings.db")},
+                "models": models,
+                **options,
+            }
+        }
+        (tmp_path / "config.json").write_text(json.dumps(config))
+        monkeypatch.chdir(tmp_path)
+        registry.clear()
+        return LLMProvider()
+
+    yield make
+    registry.clear()
+
+
+@pytest.fixture
+def llm_provider(make_provider):
+    return make_provider(
+        [
+            {"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}},
+            EMBEDDING_MODEL,
+        ]
+    )
+
+
+def test_achat_completion(llm_provider):
+    async def complete():
+        with usage_scope() as usage:
+            results = await asyncio.gather(
+                *(llm_provider.achat_completion(f"Review diff {i}") for i in range(5))
+            )
+        return results, usage
+
+    results, usage = asyncio.run(complete())
+    assert [json.loads(content) for content, _ in results] == [{"review": []}] * 5
+    assert usage.requests == 5
+    assert usage.model == "gpt-4o-mini"
+    assert llm_provider.provider.stats()["requests"] == {"gpt-4o-mini": 5}
+
+
+def test_achat_completion_with_json_retries_malformed_responses(
+    llm_provider, monkeypatch
+):
+    contents = iter(["Sorry, I cannot review this", '{"review": [1]}'])
+    monkeypatch.setattr(
+        llm_provider.provider, "_content", lambda *args, **kwargs: next(contents)
+    )
+    response, usage = asyncio.run(
+        llm_provider.achat_completion_with_json("Review this diff")
+    )
+    assert response == {"review": [1]}
+    assert usage["total_tokens"] > 0
+    assert llm_provider.provider.stats()["requests"] == {"gpt-4o-mini": 2}
+
+
+def test_aget_text_embeddings_batches_and_caches(llm_provider, monkeypatch):
+    batches = []
+
+    async def aembedding(model, input, **kwargs):
+        batches.append(list(input))
+        return {
+            "data": [
+                {"index": i, "embedding": [float(len(text)), 1.0]}
+                for i, text in enumerate(input)
+            ],
+            "usage": {"prompt_tokens": len(input), "total_tokens": len(input)},
+        }
+
+    monkeypatch.setattr(provider_module.litellm, "aembedding", aembedding)
+    texts = ["a", "bb", "a", "ccc"]
+    vectors, usage = asyncio.run(llm_provider.aget_text_embeddings(texts))
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0], [3.0, 1.0]]
+    assert sorted(map(len, batches)) == [1, 2]
+    assert usage["prompt_tokens"] == 3
+
+    # Vectors of texts embedded before come from the cache
+    vectors, usage = asyncio.run(llm_provider.aget_text_embeddings(["ccc", "a"]))
+    assert vectors == [[3.0, 1.0], [1.0, 1.0]]
+    assert len(batches) == 2
+    assert usage["prompt_tokens"] == 0
+
+
+def test_interleaved_calls_send_their_own_system_prompt(llm_provider, monkeypatch):
+    sent = []
+
+    def content(messages, group, params):
+        sent.append((messages[0]["content"], messages[1]["content"]))
+        return messages[0]["content"]
+
+    monkeypatch.setattr(llm_provider.provider, "_content", content)
+
+    async def complete(system_prompt, i):
+        return await llm_provider.achat_completion(
+            f"{system_prompt} request {i}", system_prompt=system_prompt
+        )
+
+    async def interleave():
+        return await asyncio.gather(
+            *(
+                complete(system_prompt, i)
+                for i in range(3)
+                for system_prompt in ("reviewer", "describer")
+            )
+        )
+
+    results = asyncio.run(interleave())
+    assert [content for content, _ in results] == ["reviewer", "describer"] * 3
+    assert len(sent) == 6
+    assert all(prompt.startswith(system) for system, prompt in sent)
+
+
+def test_rate_limited_requests_are_spread_over_deployments(make_provider):
+    llm_provider = make_provider(
+        [
+            {
+                "model_name": "default",
+                "litellm_params": {"model": model},
+                "model_info": {"rpm": 1000},
+            }
+            for model in ("gpt-4o-mini", "gpt-4o")
+        ]
+    )
+
+    async def complete():
+        return await asyncio.gather(
+            *(llm_provider.achat_completion(f"Review diff {i}") for i in range(20))
+        )
+
+    asyncio.run(complete())
+    requests = llm_provider.provider.stats()["requests"]
+    assert set(requests) == {"gpt-4o-mini", "gpt-4o"}
+    assert sum(requests.values()) == 20
+
+
+def test_retries_move_to_another_deployment(make_provider, monkeypatch):
+    monkeypatch.setattr(provider_module.COMPLETION_RETRY_POLICY, "base_delay", 0)
+    llm_provider = make_provider(
+        [
+            {
+                "model_name": "default",
+                "litellm_params": {"model": "gpt-4o-mini"},
+                "model_info": {"rpm": 1000},
+            },
+            {
+                "model_name": "default",
+                "litellm_params": {"model": "gpt-4o"},
+                "model_info": {
+                    "rpm": 1000,
+                    "mock": {"error_rate": 1.0, "error_status": 429},
+                },
+            },
+        ]
+    )
+    for i in range(10):
+        errors = llm_provider.provider.stats()["errors"].get("gpt-4o", 0)
+        asyncio.run(llm_provider.achat_completion(f"Review diff {i}"))
+        # The failing deployment is tried at most once per request
+        assert llm_provider.provider.stats()["errors"].get("gpt-4o", 0) - errors <= 1
+
+
+def test_downgraded_responses_do_not_answer_the_original_model(make_provider, tmp_path):
+    llm_provider = make_provider(
+        [
+            {"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}},
+            {"model_name": "best", "litellm_params": {"model": "gpt-4o"}},
+        ],
+        response_cache={"enabled": True, "path": str(tmp_path / "responses.db")},
+    )
+    budget = Budget(max_cost=1.0, downgrade_model="default", downgrade_at=0.0)
+    with budget_scope(budget):
+        asyncio.run(llm_provider.achat_completion("Review this diff", model="best"))
+    asyncio.run(llm_provider.achat_completion("Review this diff", model="best"))
+    asyncio.run(llm_provider.achat_completion("Review this diff", model="best"))
+    assert llm_provider.provider.stats()["requests"] == {
+        "gpt-4o-mini": 1,
+        "gpt-4o": 1,
+    }
+
+
+def test_providers_share_token_counts(llm_provider):
+    assert LLMProvider().token_counter is llm_provider.token_counter
+
+
+def test_embedding_batches_are_retried_with_the_deployment_params(
+    make_provider, monkeypatch
+):
+    monkeypatch.setattr(provider_module.COMPLETION_RETRY_POLICY, "base_delay", 0)
+    llm_provider = make_provider(
+        [
+            dict(
+                EMBEDDING_MODEL,
+                litellm_params={
+                    "model": "text-embedding-3-small",
+                    "api_base": "https://embeddings.example.com",
+                    "rpm": 100,
+                },
+            )
+        ]
+    )
+    calls = []
+
+    async def aembedding(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise MockProviderError("Rate limited", status_code=429)
+        return {
+            "data": [{"index": 0, "embedding": [1.0, 0.0]}],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+
+    monkeypatch.setattr(provider_module.litellm, "aembedding", aembedding)
+    vectors, _ = asyncio.run(llm_provider.aget_text_embeddings(["a"]))
+    assert vectors == [[1.0, 0.0]]
+    assert len(calls) == 2
+    assert calls[1]["api_base"] == "https://embeddings.example.com"
+    assert "rpm" not in calls[1]
@@ -0,0 +1,76 @@
+import pytest
+from kaizen.llms.budget import (
+    Budget,
+    BudgetExceededError,
+    budget_scope,
+    get_current_budget,
+)
+
+
+def test_from_config():
+    assert Budget.from_config(None) is None
+    budget = Budget.from_config({"max_cost": 0.5, "downgrade_model": "default"})
+    assert budget.max_cost == 0.5
+    assert budget.downgrade_model == "default"
+    assert budget.downgrade_at == 0.8
+
+
+def test_reservations_count_against_the_budget():
+    budget = Budget(max_prompt_tokens=100)
+    reservation = budget.reserve(60)
+    with pytest.raises(BudgetExceededError):
+        budget.reserve(60)
+    budget.settle(reservation)
+    assert budget.usage["prompt_tokens"] == 0
+    budget.reserve(60)
+
+
+def test_settle_records_usage_and_cost():
+    budget = Budget(max_completion_tokens=50, max_cost=1.0)
+    reservation = budget.reserve(10, cost=0.1)
+    budget.settle(
+        reservation,
+        {"prompt_tokens": 10, "completion_tokens": 50, "total_tokens": 60},
+        cost=0.2,
+    )
+    assert budget.usage["total_tokens"] == 60
+    assert budget.cost == 0.2
+    assert budget.remaining_completion_tokens() == 0
+    with pytest.raises(BudgetExceededError):
+        budget.reserve(1)
+
+
+def test_completion_tokens_are_reserved_while_in_flight():
+    budget = Budget(max_completion_tokens=100, max_tokens_per_request=40)
+    first = budget.reserve(10)
+    second = budget.reserve(10, completion_tokens=50)
+    assert (first[2], second[2]) == (40, 50)
+    assert budget.remaining_completion_tokens() == 10
+    assert budget.reserve(10, completion_tokens=50)[2] == 10
+    with pytest.raises(BudgetExceededError):
+        budget.reserve(10)
+
+    # Only the completion tokens used are kept, the rest is released
+    budget.settle(
+        first, {"prompt_tokens": 10, "completion_tokens": 15, "total_tokens": 25}
+    )
+    assert budget.remaining_completion_tokens() == 25
+
+
+def test_should_downgrade():
+    budget = Budget(max_cost=1.0, downgrade_at=0.5)
+    assert not budget.should_downgrade()
+    budget.settle(budget.reserve(0, cost=0.4), {"prompt_tokens": 1}, cost=0.6)
+    assert budget.should_downgrade()
+
+
+def test_budget_scope():
+    outer, inner = Budget(max_cost=1.0), Budget(max_cost=2.0)
+    assert get_current_budget() is None
+    with budget_scope(outer):
+        with budget_scope(None):
+            assert get_current_budget() is outer
+        with budget_scope(inner):
+            assert get_current_budget() is inner
+        assert get_current_budget() is outer
+    assert get_current_budget() is None
@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import patch
+from kaizen.llms.cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(path=str(tmp_path / "cache.db"), ttl=60, max_entries=2)
+
+
+def test_make_key_is_order_independent():
+    key1 = ResponseCache.make_key(model="default", temperature=0)
+    key2 = ResponseCache.make_key(temperature=0, model="default")
+    assert key1 == key2
+    assert key1 != ResponseCache.make_key(model="default", temperature=0.3)
+
+
+def test_completion_key_includes_call_arguments():
+    messages = [{"role": "user", "content": "Review this diff"}]
+
+    def key(**params):
+        return ResponseCache.completion_key("default", ["gpt-4o"], messages, params)
+
+    assert key(temperature=0) == key(temperature=0, n=1, stream=True, user="org")
+    assert key(temperature=0) != key(temperature=0, max_tokens=100)
+    assert key(max_tokens=100) != key(max_tokens=200)
+
+
+def test_get_and_set(cache):
+    assert cache.get("missing") is None
+    cache.set("key", {"content": "response", "model": "gpt-4o-mini"})
+    assert cache.get("key") == {"content": "response", "model": "gpt-4o-mini"}
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_expired_entries_are_misses(cache):
+    cache.set("key", "value")
+    with patch("kaizen.llms.cache.time.time", return_value=10**12):
+        assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "lru.db"), ttl=None, max_entries=2)
+    clock = iter(range(1000, 2000))
+    with patch("kaizen.llms.cache.time.time", side_effect=lambda: next(clock)):
+        cache.set("first", 1)
+        cache.set("second", 2)
+        cache.get("first")
+        cache.set("third", 3)
+    assert cache.get("second") is None
+    assert cache.get("first") == 1
+    assert cache.get("third") == 3
+
+
+def test_delete(cache):
+    cache.set("key", "value")
+    cache.delete("key")
+    assert cache.get("key") is None
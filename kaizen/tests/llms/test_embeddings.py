@@ -0,0 +1,30 @@
+import pytest
+from kaizen.llms.embeddings import EmbeddingCache, batch_texts, text_hash
+
+
+def test_batch_texts_respects_size_and_token_limits():
+    texts = ["a" * n for n in [1, 2, 3, 10, 1, 1, 1]]
+    batches = batch_texts(texts, len, max_batch_size=3, max_batch_tokens=6)
+    assert batches == [[0, 1, 2], [3], [4, 5, 6]]
+    assert batch_texts([], len) == []
+
+
+def test_embedding_cache(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"))
+    keys = [text_hash("def foo(): pass"), text_hash("def bar(): pass")]
+    cache.set_many("text-embedding-3-small", 3, {keys[0]: [0.5, 0.25, -1.0]})
+
+    assert cache.get_many("text-embedding-3-small", 3, keys) == {
+        keys[0]: [0.5, 0.25, -1.0]
+    }
+    # Vectors of other models or dimensions are not shared
+    assert cache.get_many("text-embedding-3-large", 3, keys) == {}
+    assert cache.get_many("text-embedding-3-small", 2, keys) == {}
+    assert cache.stats() == {"hits": 1, "misses": 5, "entries": 1}
+
+
+def test_vectors_are_stored_as_float32(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"))
+    key = text_hash("text")
+    cache.set_many("model", 1, {key: [0.1]})
+    assert cache.get_many("model", 1, [key])[key][0] == pytest.approx(0.1)
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import random
+import pytest
+from kaizen.llms.cache import ResponseCache
+from kaizen.llms.mock import LatencyModel, MockProviderError, MockRouter
+
+MODELS = [
+    {"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}},
+    {
+        "model_name": "best",
+        "litellm_params": {"model": "gpt-4o"},
+        "model_info": {"mock": {"error_rate": 1.0, "error_status": 429}},
+    },
+]
+MESSAGES = [{"role": "user", "content": "Review this diff"}]
+NO_LATENCY = {"latency": {"distribution": "constant", "median": 0}}
+
+
+def test_default_response_and_usage():
+    router = MockRouter(MODELS, mock=NO_LATENCY)
+    response = router.completion(messages=MESSAGES, model="default", temperature=0.1)
+    assert response["model"] == "gpt-4o-mini"
+    assert json.loads(response["choices"][0]["message"]["content"])["review"] == []
+    usage = response["usage"]
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+    assert router.stats() == {"requests": {"gpt-4o-mini": 1}, "errors": {}}
+
+
+def test_replays_recorded_responses(tmp_path):
+    path = str(tmp_path / "responses.db")
+    key = ResponseCache.completion_key(
+        "default", ["gpt-4o-mini"], MESSAGES, {"temperature": 0.1, "max_tokens": 50}
+    )
+    ResponseCache(path=path).set(key, {"content": "recorded", "model": "gpt-4o-mini"})
+
+    router = MockRouter(MODELS, mock=dict(NO_LATENCY, responses=path))
+    response = asyncio.run(
+        router.acompletion(
+            messages=MESSAGES, model="default", temperature=0.1, max_tokens=50
+        )
+    )
+    assert response["choices"][0]["message"]["content"] == "recorded"
+    response = router.completion(messages=MESSAGES, model="default", temperature=0.1)
+    assert response["choices"][0]["message"]["content"] != "recorded"
+
+
+def test_errors_per_deployment():
+    router = MockRouter(MODELS, mock=NO_LATENCY)
+    with pytest.raises(MockProviderError) as error:
+        router.completion(messages=MESSAGES, model="best")
+    assert error.value.status_code == 429
+    with pytest.raises(MockProviderError):
+        router.completion(messages=MESSAGES, model="unknown")
+
+
+def test_deployment_ids():
+    models = MODELS + [
+        {
+            "model_name": "small",
+            "litellm_params": {"model": "gpt-4o-mini"},
+            "model_info": {"id": "small-mini", "mock": {"error_rate": 1.0}},
+        }
+    ]
+    router = MockRouter(models, mock=NO_LATENCY)
+    response = router.completion(messages=MESSAGES, model="0")
+    assert response["model"] == "gpt-4o-mini"
+    # The same model in another group is a deployment with its own settings
+    with pytest.raises(MockProviderError):
+        router.completion(messages=MESSAGES, model="small-mini")
+    assert router.stats()["requests"] == {"gpt-4o-mini": 2}
+
+
+def test_stream_chunks():
+    router = MockRouter(MODELS, mock=dict(NO_LATENCY, default_response="x" * 40))
+    chunks = list(router.completion(messages=MESSAGES, model="default", stream=True))
+    content = "".join(c["choices"][0]["delta"]["content"] or "" for c in chunks)
+    assert content == "x" * 40
+    assert chunks[-1]["usage"]["completion_tokens"] == 10
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert LatencyModel("constant", median=2).sample(rng) == 2
+    uniform = LatencyModel("uniform", min_latency=1, max_latency=2)
+    assert all(1 <= uniform.sample(rng) <= 2 for _ in range(100))
+    lognormal = LatencyModel(median=1, sigma=1, max_latency=5)
+    samples = sorted(lognormal.sample(rng) for _ in range(1000))
+    assert 0.8 < samples[500] < 1.25
+    assert samples[-1] == 5
+    with pytest.raises(ValueError):
+        LatencyModel("pareto")
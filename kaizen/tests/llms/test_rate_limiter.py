@@ -0,0 +1,65 @@
+import asyncio
+import sqlite3
+
+import pytest
+from unittest.mock import patch
+from kaizen.llms.rate_limiter import RateLimiter
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter(request, tmp_path):
+    return RateLimiter(backend=request.param, path=str(tmp_path / "limits.db"))
+
+
+def test_requests_per_minute(limiter):
+    with patch("kaizen.llms.rate_limiter.time.time", return_value=1000.0):
+        assert limiter.try_acquire("gpt-4o", rpm=2) == 0
+        assert limiter.try_acquire("gpt-4o", rpm=2) == 0
+        # One request is refilled every 30 seconds
+        assert limiter.try_acquire("gpt-4o", rpm=2) == pytest.approx(30)
+        assert limiter.try_acquire("gpt-4o-mini", rpm=2) == 0
+    with patch("kaizen.llms.rate_limiter.time.time", return_value=1030.0):
+        assert limiter.try_acquire("gpt-4o", rpm=2) == 0
+
+
+def test_tokens_per_minute(limiter):
+    with patch("kaizen.llms.rate_limiter.time.time", return_value=1000.0):
+        assert limiter.try_acquire("gpt-4o", tpm=600, tokens=500) == 0
+        assert limiter.wait_time("gpt-4o", tpm=600, tokens=200) == pytest.approx(10)
+        limiter.consume("gpt-4o", tpm=600, tokens=100)
+        assert limiter.try_acquire("gpt-4o", tpm=600, tokens=200) == pytest.approx(20)
+        # Requests bigger than the limit wait for a full bucket only
+        assert limiter.wait_time("gpt-4o", tpm=600, tokens=5000) == pytest.approx(60)
+
+
+def test_limits_are_checked_together(limiter):
+    with patch("kaizen.llms.rate_limiter.time.time", return_value=1000.0):
+        assert limiter.try_acquire("gpt-4o", rpm=10, tpm=100, tokens=100) == 0
+        assert limiter.try_acquire("gpt-4o", rpm=10, tpm=100, tokens=100) > 0
+        # The request slot was not taken by the rejected request
+        for _ in range(9):
+            assert limiter.try_acquire("gpt-4o", rpm=10) == 0
+        assert limiter.try_acquire("gpt-4o", rpm=10) > 0
+
+
+def test_aacquire_does_not_block_the_event_loop(tmp_path):
+    path = str(tmp_path / "limits.db")
+    limiter = RateLimiter(backend="sqlite", path=path)
+    # Another process holds the database lock
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def release():
+        await asyncio.sleep(0.1)
+        other.execute("COMMIT")
+
+    async def run():
+        return await asyncio.gather(limiter.aacquire("gpt-4o", rpm=10), release())
+
+    assert asyncio.run(run()) == [0.0, None]
+    other.close()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        RateLimiter(backend="redis")
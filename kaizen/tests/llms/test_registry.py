@@ -0,0 +1,36 @@
+import pytest
+from kaizen.llms import registry
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    registry.clear()
+    yield
+    registry.clear()
+
+
+def test_get_shared_reuses_instances_with_the_same_settings():
+    created = []
+
+    def factory(**kwargs):
+        created.append(kwargs)
+        return object()
+
+    models = [{"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}}]
+    first = registry.get_shared("router", factory, model_list=models, num_retries=0)
+    second = registry.get_shared("router", factory, num_retries=0, model_list=models)
+    other = registry.get_shared("router", factory, model_list=models, num_retries=1)
+    assert first is second
+    assert other is not first
+    assert len(created) == 2
+
+
+def test_register_models_once():
+    registered = []
+    models = [
+        {"model_name": "custom", "model_info": {"litellm_provider": "openai"}},
+        {"model_name": "default", "litellm_params": {"model": "gpt-4o-mini"}},
+    ]
+    registry.register_models_once(models, registered.append)
+    registry.register_models_once(models, registered.append)
+    assert registered == [{"custom": {"litellm_provider": "openai"}}]
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from kaizen.llms.routing import LatencyTracker, ahedged_call, hedged_call
+
+LATENCIES = {"fast": 0.01, "slow": 0.5}
+
+
+def test_latency_percentiles_and_rank():
+    tracker = LatencyTracker(window=10, min_samples=2)
+    assert tracker.p50("a") is None
+    for latency in [1.0, 2.0, 3.0, 4.0]:
+        tracker.record("a", latency)
+        tracker.record("b", latency / 10)
+    assert tracker.p50("a") == 3.0
+    assert tracker.p95("a") == 4.0
+    assert tracker.rank(["a", "b", "c"]) == ["c", "b", "a"]
+
+
+def test_window_drops_old_latencies():
+    tracker = LatencyTracker(window=2, min_samples=1)
+    for latency in [10.0, 1.0, 1.0]:
+        tracker.record("a", latency)
+    assert tracker.p95("a") == 1.0
+
+
+def test_hedged_call_uses_the_backup_when_the_primary_is_slow():
+    def call(deployment):
+        time.sleep(LATENCIES[deployment])
+        return deployment
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert hedged_call(call, ["slow", "fast"], 0.05, executor) == "fast"
+        assert hedged_call(call, ["fast", "slow"], 0.2, executor) == "fast"
+
+
+def test_hedged_call_hands_over_the_losing_response():
+    discarded = []
+
+    def call(deployment):
+        time.sleep(LATENCIES[deployment])
+        return deployment
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_call(call, ["slow", "fast"], 0.05, executor, discarded.append)
+        assert (result, discarded) == ("fast", [])
+    # Leaving the executor waits for the slow request
+    assert discarded == ["slow"]
+
+
+def test_concurrent_hedged_calls_wait_for_a_worker_before_hedging():
+    calls = []
+
+    def call(deployment):
+        calls.append(deployment)
+        time.sleep(0.02)
+        return deployment
+
+    def request(_):
+        return hedged_call(call, ["a", "b"], 0.1, executor)
+
+    # Eight requests queue on one worker, none of them is slow to answer
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with ThreadPoolExecutor(max_workers=8) as requests:
+            results = list(requests.map(request, range(8)))
+    assert results == ["a"] * 8
+    assert calls == ["a"] * 8
+
+
+def test_hedged_calls_try_the_backup_when_the_primary_fails():
+    def call(deployment):
+        if deployment == "slow":
+            raise ConnectionError("overloaded")
+        return deployment
+
+    async def acall(deployment):
+        return call(deployment)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert hedged_call(call, ["slow", "fast"], 10, executor) == "fast"
+    assert asyncio.run(ahedged_call(acall, ["slow", "fast"], 10)) == "fast"
+
+
+def test_ahedged_call_hands_over_a_loser_finishing_with_the_winner():
+    discarded = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def call(deployment):
+            if deployment == "slow":
+                await gate.wait()
+            else:
+                gate.set()
+            return deployment
+
+        return await ahedged_call(call, ["slow", "fast"], 0.01, discarded.append)
+
+    result = asyncio.run(run())
+    assert sorted([result] + discarded) == ["fast", "slow"]
+
+
+def test_ahedged_call_cancels_the_loser():
+    cancelled = []
+
+    async def call(deployment):
+        try:
+            await asyncio.sleep(LATENCIES[deployment])
+        except asyncio.CancelledError:
+            cancelled.append(deployment)
+            raise
+        return deployment
+
+    async def run():
+        result = await ahedged_call(call, ["slow", "fast"], 0.05)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "fast"
+    assert cancelled == ["slow"]
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from kaizen.llms.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def fn():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "review"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(flights.do, "pr", fn)
+        started.wait()
+        followers = [executor.submit(flights.do, "pr", fn) for _ in range(2)]
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert calls == [1]
+    assert results == [("review", False), ("review", True), ("review", True)]
+    # Finished calls are not remembered
+    assert flights.do("pr", fn) == ("review", False)
+
+
+def test_errors_are_shared():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("rate limited")
+
+    async def run():
+        return await asyncio.gather(
+            flights.do("pr", fn), flights.do("pr", fn), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert calls == [1]
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_async_calls_share_one_result():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fn(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    async def run():
+        return await asyncio.gather(
+            flights.do("a", lambda: fn("a")),
+            flights.do("a", lambda: fn("a")),
+            flights.do("b", lambda: fn("b")),
+        )
+
+    assert asyncio.run(run()) == [("A", False), ("A", True), ("B", False)]
+    assert calls == ["a", "b"]
+
+
+def test_cancelled_follower_does_not_cancel_the_call():
+    flights = AsyncSingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("pr", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("pr", fn))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(run()) == ("done", False)
+
+
+def test_cancelled_leader_does_not_cancel_the_call():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("pr", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("pr", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ("done", True)
+    assert calls == [1]
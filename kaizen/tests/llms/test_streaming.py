@@ -0,0 +1,120 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from kaizen.llms.streaming import AsyncCompletionStream, CompletionStream
+
+MESSAGES = [{"role": "user", "content": "Review this diff"}]
+
+
+def chunk(content):
+    return {"choices": [{"delta": {"content": content}}]}
+
+
+def build_response(chunks, messages):
+    return {
+        "model": "gpt-4o-mini",
+        "usage": {
+            "prompt_tokens": 10,
+            "completion_tokens": len(chunks),
+            "total_tokens": 10 + len(chunks),
+        },
+    }
+
+
+@pytest.fixture(autouse=True)
+def stream_chunk_builder():
+    with patch(
+        "kaizen.llms.streaming.litellm.stream_chunk_builder",
+        side_effect=build_response,
+    ):
+        yield
+
+
+def test_close_settles_partial_usage():
+    state = {"closed": False}
+
+    def chunks():
+        try:
+            for part in ["{", '"a"', ":", "1}"]:
+                yield chunk(part)
+        finally:
+            state["closed"] = True
+
+    completed = []
+    stream = CompletionStream(chunks(), MESSAGES, on_complete=completed.append)
+    deltas = iter(stream)
+    assert [next(deltas), next(deltas)] == ["{", '"a"']
+    stream.close()
+    stream.close()
+
+    assert state["closed"]
+    assert stream.aborted and stream.finished
+    assert completed == [stream]
+    assert stream.usage["completion_tokens"] == 2
+    assert list(deltas) == []
+
+
+def test_aclose_settles_partial_usage():
+    state = {"closed": False}
+
+    async def chunks():
+        try:
+            for part in ["{", '"a"', ":", "1}"]:
+                yield chunk(part)
+        finally:
+            state["closed"] = True
+
+    async def read(stream):
+        async for delta in stream:
+            if delta == ":":
+                await stream.aclose()
+                return
+
+    completed = []
+    stream = AsyncCompletionStream(chunks(), MESSAGES, on_complete=completed.append)
+    asyncio.run(read(stream))
+
+    assert state["closed"]
+    assert completed == [stream]
+    assert stream.usage["completion_tokens"] == 3
+    with pytest.raises(TypeError):
+        stream.close()
+
+
+def test_provider_error_settles_partial_usage():
+    def chunks():
+        yield chunk("{")
+        raise ConnectionError("stream reset")
+
+    completed = []
+    stream = CompletionStream(chunks(), MESSAGES, on_complete=completed.append)
+    with pytest.raises(ConnectionError):
+        list(stream)
+
+    assert stream.aborted
+    assert completed == [stream]
+    assert stream.usage["completion_tokens"] == 1
+
+
+def test_stopping_early_settles_partial_usage():
+    state = {"closed": False}
+
+    def chunks():
+        try:
+            for part in ["{", '"a"', ":", "1}"]:
+                yield chunk(part)
+        finally:
+            state["closed"] = True
+
+    completed = []
+    stream = CompletionStream(chunks(), MESSAGES, on_complete=completed.append)
+    for delta in stream:
+        if delta == '"a"':
+            break
+
+    assert state["closed"]
+    assert stream.aborted
+    assert completed == [stream]
+    assert stream.usage["completion_tokens"] == 2
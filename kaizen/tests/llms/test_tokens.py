@@ -0,0 +1,48 @@
+import litellm
+import pytest
+
+from kaizen.llms import tokens
+from kaizen.llms.tokens import TokenCounter, estimate_tokens
+
+TEXT = "def add(a, b):\n    return a + b  # ünïcödé\n" * 20
+
+
+@pytest.mark.parametrize("model", ["gpt-4o-mini", "gpt-3.5-turbo"])
+def test_counts_match_litellm(model):
+    counter = TokenCounter()
+    assert counter.count(TEXT, model) == litellm.token_counter(model=model, text=TEXT)
+    messages = [{"role": "user", "content": TEXT}]
+    assert counter.count_messages(messages, model) == litellm.token_counter(
+        model=model, messages=messages
+    )
+
+
+def test_counts_are_cached_per_text_and_model(monkeypatch):
+    calls = []
+    token_counter = litellm.token_counter
+
+    def counting_token_counter(**kwargs):
+        calls.append((kwargs["model"], kwargs["text"]))
+        return token_counter(**kwargs)
+
+    monkeypatch.setattr(tokens.litellm, "token_counter", counting_token_counter)
+    counter = TokenCounter(max_cache_entries=2)
+    first = counter.count(TEXT, "gpt-4o-mini")
+    assert counter.count(TEXT, "gpt-4o-mini") == first
+    assert len(calls) == 1
+
+    # Other models and texts are counted on their own
+    counter.count(TEXT, "gpt-3.5-turbo")
+    counter.count("other", "gpt-4o-mini")
+    assert len(calls) == 3
+    # The least recently used count was dropped
+    counter.count(TEXT, "gpt-4o-mini")
+    assert len(calls) == 4
+
+
+def test_estimate_skips_the_tokenizer(monkeypatch):
+    monkeypatch.setattr(tokens.litellm, "token_counter", None)
+    assert TokenCounter(estimate=True).count(TEXT, "gpt-4o-mini") == estimate_tokens(
+        TEXT
+    )
+    assert estimate_tokens("") == 0
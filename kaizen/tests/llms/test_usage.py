@@ -0,0 +1,56 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from kaizen.llms.usage import (
+    UsageTracker,
+    get_current_usage,
+    merge_usage,
+    normalize_usage,
+    usage_scope,
+)
+
+
+def test_merge_usage_keeps_all_keys():
+    merged = merge_usage(
+        {"prompt_tokens": 1, "total_tokens": 1},
+        {"prompt_tokens": 2, "cached_tokens": 3, "prompt_tokens_details": object()},
+    )
+    assert merged == {"prompt_tokens": 3, "total_tokens": 1, "cached_tokens": 3}
+    assert merge_usage(None, {"total_tokens": 4}) == {"total_tokens": 4}
+
+
+def test_tracker_records_models_and_cost():
+    tracker = UsageTracker()
+    tracker.add({"prompt_tokens": 10, "total_tokens": 10}, "gpt-4o", 0.1, 0.2)
+    tracker.add({"prompt_tokens": 5, "total_tokens": 5}, "gpt-4o-mini")
+    assert tracker.usage["prompt_tokens"] == 15
+    assert tracker.model == "gpt-4o-mini"
+    assert tracker.models["gpt-4o"]["prompt_tokens"] == 10
+    assert tracker.cost == {"prompt_cost": 0.1, "completion_cost": 0.2}
+    assert tracker.requests == 2
+
+
+def test_nested_scopes_forward_to_parent():
+    with usage_scope() as outer:
+
+        def work(tokens):
+            with usage_scope() as inner:
+                get_current_usage().add({"total_tokens": tokens})
+                return inner.usage["total_tokens"]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, work, tokens)
+                for tokens in range(1, 9)
+            ]
+            assert [future.result() for future in futures] == list(range(1, 9))
+    assert outer.usage["total_tokens"] == 36
+    assert get_current_usage() is None
+
+
+def test_normalize_usage_reports_cached_tokens():
+    openai_usage = normalize_usage(
+        {"prompt_tokens": 10, "prompt_tokens_details": {"cached_tokens": 8}}
+    )
+    assert openai_usage["cached_tokens"] == 8
+    assert normalize_usage({"cache_read_input_tokens": 5})["cached_tokens"] == 5
+    assert normalize_usage({"prompt_tokens": 10})["cached_tokens"] == 0
@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import re
+import time
+
+import pytest
+
+from kaizen.llms.budget import Budget, get_current_budget
+from kaizen.reviewer.code_review import CodeReviewer
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+FILES = [f"src/module_{i}.py" for i in range(4)]
+
+
+def pull_request_files():
+    patch = "@@ -1,1 +1,12 @@\n" + "\n".join(f"+value_{i} = {i}" for i in range(12))
+    return [{"filename": name, "status": "modified", "patch": patch} for name in FILES]
+
+
+class FakeProvider:
+    """Reviews each file chunk, the first chunks take the longest."""
+
+    model = "fake-model"
+    max_concurrent_requests = 4
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.seen = []
+
+    def available_tokens(self, message):
+        # Room for one file per prompt, so every file is its own chunk
+        return 200
+
+    def get_token_count(self, text):
+        return len(text) // 4
+
+    def new_budget(self, budget=None):
+        return budget
+
+    def build_messages(self, prompt, system_prompt=None, static_prefix=None):
+        return [{"role": "user", "content": prompt}]
+
+    def _review(self, prompt, on_item=None, **kwargs):
+        file_path = re.search(r"File Name: (\S+)", prompt).group(1)
+        self.seen.append((file_path, request_id.get(), get_current_budget()))
+        if file_path == self.fail_on:
+            raise RuntimeError(f"Review of {file_path} failed")
+        issue = {"file_path": file_path, "category": "Bug", "start_line": 1}
+        if on_item:
+            on_item(issue)
+        return {"review": [issue], "code_quality_percentage": 80}, {}
+
+    def _delay(self, prompt):
+        index = FILES.index(re.search(r"File Name: (\S+)", prompt).group(1))
+        return 0.02 * (len(FILES) - index)
+
+    def chat_completion_with_json(self, prompt, **kwargs):
+        time.sleep(self._delay(prompt))
+        return self._review(prompt, **kwargs)
+
+    async def achat_completion_with_json(self, prompt, **kwargs):
+        await asyncio.sleep(self._delay(prompt))
+        return self._review(prompt, **kwargs)
+
+
+def review(reviewer, **kwargs):
+    return reviewer.review_pull_request(
+        diff_text="",
+        pull_request_title="title",
+        pull_request_desc="",
+        pull_request_files=pull_request_files(),
+        **kwargs,
+    )
+
+
+def areview(reviewer, **kwargs):
+    return asyncio.run(
+        reviewer.areview_pull_request(
+            diff_text="",
+            pull_request_title="title",
+            pull_request_desc="",
+            pull_request_files=pull_request_files(),
+            **kwargs,
+        )
+    )
+
+
+@pytest.mark.parametrize("run_review", [review, areview])
+def test_issues_keep_chunk_order(run_review):
+    provider = FakeProvider()
+    output = run_review(CodeReviewer(llm_provider=provider))
+    # Chunks finished in reverse order, issues are still in file order
+    assert [file_path for file_path, _, _ in provider.seen] == FILES[::-1]
+    assert [issue["file_path"] for issue in output.issues] == FILES
+    assert output.file_count == len(FILES)
+
+
+@pytest.mark.parametrize("run_review", [review, areview])
+def test_chunk_errors_propagate(run_review):
+    reviewer = CodeReviewer(llm_provider=FakeProvider(fail_on=FILES[2]))
+    with pytest.raises(RuntimeError, match="module_2"):
+        run_review(reviewer)
+
+
+def test_chunks_run_in_the_callers_context():
+    provider = FakeProvider()
+    budget = Budget(max_cost=1.0)
+    request_id.set("review-1")
+    review(CodeReviewer(llm_provider=provider), budget=budget)
+    assert {(rid, b) for _, rid, b in provider.seen} == {("review-1", budget)}
+
+
+def test_concurrent_reviews_keep_their_settings():
+    provider = FakeProvider()
+    reviewer = CodeReviewer(llm_provider=provider)
+    found = {"first": [], "second": []}
+
+    async def run():
+        return await asyncio.gather(
+            reviewer.areview_pull_request(
+                diff_text="",
+                pull_request_title="title",
+                pull_request_desc="",
+                pull_request_files=pull_request_files()[:1],
+                on_issue=found["first"].append,
+            ),
+            reviewer.areview_pull_request(
+                diff_text="",
+                pull_request_title="title",
+                pull_request_desc="",
+                pull_request_files=pull_request_files(),
+                on_issue=found["second"].append,
+            ),
+        )
+
+    first, second = asyncio.run(run())
+    assert (first.file_count, second.file_count) == (1, len(FILES))
+    assert [issue["file_path"] for issue in found["first"]] == FILES[:1]
+    assert sorted(issue["file_path"] for issue in found["second"]) == FILES
+
+
+def test_sensitive_files_without_hunks_are_flagged():
+    patch = pull_request_files()[0]["patch"]
+    files = pull_request_files()[:1] + [
+        {"filename": "Dockerfile", "status": "renamed", "previous_filename": "a"},
+        {"filename": "certs/server.pem", "status": "added"},
+    ]
+    output = CodeReviewer(llm_provider=FakeProvider()).review_pull_request(
+        diff_text=f"diff --git a/{FILES[0]} b/{FILES[0]}\n"
+        f"--- a/{FILES[0]}\n+++ b/{FILES[0]}\n{patch}\n",
+        pull_request_title="title",
+        pull_request_desc="",
+        pull_request_files=files,
+        check_sensetive=True,
+    )
+    assert [issue["file_path"] for issue in output.issues] == [
+        FILES[0],
+        "Dockerfile",
+        "certs/server.pem",
+    ]
@@ -0,0 +1,58 @@
+from kaizen.helpers.diff import Diff
+from kaizen.reviewer.review_state import ReviewStateStore, carry_forward_issues
+
+PATCH = """@@ -10,3 +10,4 @@ def run():
+     start()
+-    step(1)
++    step(2)
++    step(3)
+     stop()"""
+
+
+def issue(file_path, start_line, end_line=None):
+    return {
+        "file_path": file_path,
+        "start_line": start_line,
+        "end_line": end_line or start_line,
+        "category": "Bug",
+    }
+
+
+def test_carry_forward_issues():
+    diff = Diff.from_pr_files(
+        [
+            {"filename": "app.py", "status": "modified", "patch": PATCH},
+            {"filename": "old.py", "status": "removed"},
+            {"filename": "new.py", "status": "renamed", "previous_filename": "mv.py"},
+            {"filename": "logo.png", "status": "modified"},
+        ]
+    )
+    carried = carry_forward_issues(
+        [
+            issue("app.py", 2),
+            issue("app.py", 11),
+            issue("app.py", 20, 22),
+            issue("other.py", 5),
+            issue("old.py", 1),
+            issue("mv.py", 3),
+            issue("logo.png", 1),
+            issue("app.py", "n/a"),
+        ],
+        diff,
+    )
+    assert [(i["file_path"], i["start_line"], i["end_line"]) for i in carried] == [
+        ("app.py", 2, 2),
+        ("app.py", 21, 23),
+        ("other.py", 5, 5),
+        ("new.py", 3, 3),
+    ]
+
+
+def test_review_state_store(tmp_path):
+    store = ReviewStateStore(path=str(tmp_path / "state" / "reviews.db"))
+    assert store.get("org/repo", 1) is None
+    store.set("org/repo", 1, "abc", [issue("app.py", 2)])
+    store.set("org/repo", 1, "def", [])
+    assert store.get("org/repo", 1) == {"head_sha": "def", "issues": []}
+    store.delete("org/repo", 1)
+    assert store.get("org/repo", 1) is None
@@ -1,18 +1,34 @@
+import copy
 import json
+import threading
 from pathlib import Path
 import os
 
+# Parsed config files keyed by path, reloaded only when their mtime changes
+_config_files = {}
+_config_files_lock = threading.Lock()
+
+
+def _load_config_file(path):
+    mtime = os.stat(path).st_mtime_ns
+    with _config_files_lock:
+        cached = _config_files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r") as f:
+                cached = (mtime, json.loads(f.read()))
+            _config_files[path] = cached
+    # Callers are free to update their copy
+    return copy.deepcopy(cached[1])
+
 
 class ConfigData:
     def __init__(self, config_data=None):
         config_local_path = "config.json"
         config_file_path = os.path.expanduser("~/.kaizen_config.json")
         if Path(config_local_path).is_file():
-            with open(config_local_path, "r") as f:
-                self.config_data = json.loads(f.read())
+            self.config_data = _load_config_file(os.path.abspath(config_local_path))
         elif Path(config_file_path).is_file():
-            with open(config_file_path, "r") as f:
-                self.config_data = json.loads(f.read())
+            self.config_data = _load_config_file(config_file_path)
         else:
             self.config_data = {
                 "language_model": {